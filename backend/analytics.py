@@ -0,0 +1,311 @@
+"""
+Rolling per-variant analytics.
+Aggregates are updated in O(1) as variants, scores and winners are recorded,
+so reading them costs the same no matter how many runs have been stored.
+"""
+
+from typing import Dict, Any, Callable, List, Optional, Tuple
+import math
+import time
+
+from models import ScoreComponents
+
+COMPONENTS = tuple(ScoreComponents.model_fields)
+
+# name -> (window length in seconds, number of rotating slots); None is all time
+WINDOWS: Dict[str, Optional[Tuple[int, int]]] = {
+    "5m": (300, 10),
+    "1h": (3600, 12),
+    "all": None
+}
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Relative accuracy of the latency sketches
+RELATIVE_ACCURACY = 0.01
+
+class QuantileSketch:
+    """
+    Log-bucketed streaming quantile sketch (the DDSketch scheme).
+    Every estimate is within relative_accuracy of the true quantile, and the
+    number of buckets grows with log(max / min), not with the number of values.
+    """
+
+    __slots__ = ("relative_accuracy", "_gamma", "_log_gamma", "_bins", "_zero_count", "count")
+
+    def __init__(self, relative_accuracy: float = 0.01):
+        self.relative_accuracy = relative_accuracy
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self._bins: Dict[int, int] = {}
+        self._zero_count = 0
+        self.count = 0
+
+    def add(self, value: float) -> None:
+        """Record a non-negative value."""
+        self.count += 1
+        if value <= 0:
+            self._zero_count += 1
+            return
+
+        key = math.ceil(math.log(value) / self._log_gamma)
+        self._bins[key] = self._bins.get(key, 0) + 1
+
+    def merge(self, other: "QuantileSketch") -> None:
+        """Fold another sketch with the same accuracy into this one."""
+        self.count += other.count
+        self._zero_count += other._zero_count
+        for key, count in other._bins.items():
+            self._bins[key] = self._bins.get(key, 0) + count
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimate the q-quantile (0 <= q <= 1), or None if empty."""
+        if self.count == 0:
+            return None
+
+        rank = q * (self.count - 1)
+        seen = self._zero_count
+        if rank < seen:
+            return 0.0
+
+        for key in sorted(self._bins):
+            seen += self._bins[key]
+            if rank < seen:
+                return 2 * self._gamma ** key / (self._gamma + 1)
+        return 2 * self._gamma ** max(self._bins) / (self._gamma + 1)
+
+class VariantStats:
+    """Sums and a latency sketch for one variant over one time slot."""
+
+    __slots__ = ("runs", "wins", "scored", "total_sum", "component_sums", "latency", "prompted", "prompt_tokens_sum")
+
+    def __init__(self, relative_accuracy: float):
+        self.runs = 0
+        self.wins = 0
+        self.scored = 0
+        self.total_sum = 0.0
+        self.component_sums = [0.0] * len(COMPONENTS)
+        self.latency = QuantileSketch(relative_accuracy)
+        self.prompted = 0
+        self.prompt_tokens_sum = 0
+
+    def add_variant(self, variant: Any) -> None:
+        """Count a variant's participation in a run, its latency and prompt size."""
+        self.runs += 1
+        if variant.latency_ms is not None:
+            self.latency.add(variant.latency_ms)
+        if variant.prompt_tokens is not None:
+            self.prompted += 1
+            self.prompt_tokens_sum += variant.prompt_tokens
+
+    def add_score(self, score: Any) -> None:
+        """Add a score to the running sums."""
+        self.scored += 1
+        self.total_sum += score.total
+        self.component_sums = [
+            total + getattr(score.components, name) for total, name in zip(self.component_sums, COMPONENTS)
+        ]
+
+    def add_win(self) -> None:
+        """Count a run won by the variant."""
+        self.wins += 1
+
+    def counters(self) -> Dict[str, float]:
+        """
+        The stats as flat named counters that add up across slots (for storing
+        them as rows): the sums, "component:<name>" sums and "latency:<bin>" counts.
+        """
+        counters = {
+            "runs": self.runs,
+            "wins": self.wins,
+            "scored": self.scored,
+            "total_sum": self.total_sum,
+            "prompted": self.prompted,
+            "prompt_tokens_sum": self.prompt_tokens_sum
+        }
+        counters.update({f"component:{name}": total for name, total in zip(COMPONENTS, self.component_sums)})
+        if self.latency._zero_count:
+            counters["latency:zero"] = self.latency._zero_count
+        counters.update({f"latency:{key}": count for key, count in self.latency._bins.items()})
+        return {name: value for name, value in counters.items() if value}
+
+    def add_counters(self, counters: Dict[str, float]) -> None:
+        """Add counters produced by counters(); unknown components are ignored."""
+        for name, value in counters.items():
+            kind, _, key = name.partition(":")
+            if kind == "component":
+                if key in COMPONENTS:
+                    self.component_sums[COMPONENTS.index(key)] += value
+            elif kind == "latency":
+                self.latency.count += int(value)
+                if key == "zero":
+                    self.latency._zero_count += int(value)
+                else:
+                    self.latency._bins[int(key)] = self.latency._bins.get(int(key), 0) + int(value)
+            elif kind == "total_sum":
+                self.total_sum += value
+            else:
+                setattr(self, kind, getattr(self, kind) + int(value))
+
+    def merge(self, other: "VariantStats") -> None:
+        """Fold another slot's stats into this one."""
+        self.runs += other.runs
+        self.wins += other.wins
+        self.scored += other.scored
+        self.total_sum += other.total_sum
+        self.component_sums = [a + b for a, b in zip(self.component_sums, other.component_sums)]
+        self.latency.merge(other.latency)
+        self.prompted += other.prompted
+        self.prompt_tokens_sum += other.prompt_tokens_sum
+
+    def summary(self) -> Dict[str, Any]:
+        """JSON-ready statistics."""
+        return {
+            "runs": self.runs,
+            "wins": self.wins,
+            "win_rate": self.wins / self.runs if self.runs else None,
+            "mean_total": self.total_sum / self.scored if self.scored else None,
+            "mean_components": {
+                name: (total / self.scored if self.scored else None)
+                for name, total in zip(COMPONENTS, self.component_sums)
+            },
+            "latency_ms": {
+                f"p{int(q * 100)}": self.latency.quantile(q) for q in QUANTILES
+            },
+            "mean_prompt_tokens": self.prompt_tokens_sum / self.prompted if self.prompted else None
+        }
+
+def window_epochs(now: float) -> Dict[str, Tuple[int, int]]:
+    """Each window's (current slot epoch, oldest epoch still inside it); all time is one slot, 0."""
+    epochs = {}
+    for name, window in WINDOWS.items():
+        if window is None:
+            epochs[name] = (0, 0)
+        else:
+            span, slots = window
+            epoch = int(now // (span / slots))
+            epochs[name] = (epoch, epoch - slots + 1)
+    return epochs
+
+def rank_variants(snapshot: Dict[str, VariantStats]) -> List[Dict[str, Any]]:
+    """Variant summaries, best first: highest mean score, then lowest median latency. Unscored variants rank last."""
+    ranked = [{"variant_id": variant_id, **stats.summary()} for variant_id, stats in snapshot.items()]
+
+    def sort_key(entry: Dict[str, Any]):
+        mean_total = entry["mean_total"]
+        p50 = entry["latency_ms"]["p50"]
+        return (
+            -mean_total if mean_total is not None else float("inf"),
+            p50 if p50 is not None else float("inf")
+        )
+
+    return sorted(ranked, key=sort_key)
+
+class RollingWindow:
+    """
+    Per-variant stats over the last span seconds, kept in a ring of time slots.
+    Recording touches only the current slot; expired slots are reset on reuse.
+    """
+
+    def __init__(self, span: int, slots: int, relative_accuracy: float):
+        self.slot_width = span / slots
+        self.relative_accuracy = relative_accuracy
+        self._epochs: List[int] = [-1] * slots
+        self._slots: List[Dict[str, VariantStats]] = [{} for _ in range(slots)]
+
+    def stats(self, variant_id: str, now: float) -> VariantStats:
+        """The current slot's stats for a variant, rotating the ring if needed."""
+        epoch = int(now // self.slot_width)
+        index = epoch % len(self._slots)
+        if self._epochs[index] != epoch:
+            self._epochs[index] = epoch
+            self._slots[index] = {}
+
+        slot = self._slots[index]
+        stats = slot.get(variant_id)
+        if stats is None:
+            stats = slot[variant_id] = VariantStats(self.relative_accuracy)
+        return stats
+
+    def snapshot(self, now: float) -> Dict[str, VariantStats]:
+        """Merge the slots still inside the window."""
+        oldest = int(now // self.slot_width) - len(self._slots) + 1
+        merged: Dict[str, VariantStats] = {}
+        for epoch, slot in zip(self._epochs, self._slots):
+            if epoch < oldest:
+                continue
+            for variant_id, stats in slot.items():
+                merged.setdefault(variant_id, VariantStats(self.relative_accuracy)).merge(stats)
+        return merged
+
+class AllTime:
+    """Per-variant stats since startup."""
+
+    def __init__(self, relative_accuracy: float):
+        self.relative_accuracy = relative_accuracy
+        self._stats: Dict[str, VariantStats] = {}
+
+    def stats(self, variant_id: str, now: float) -> VariantStats:
+        """A variant's stats, created on first use."""
+        stats = self._stats.get(variant_id)
+        if stats is None:
+            stats = self._stats[variant_id] = VariantStats(self.relative_accuracy)
+        return stats
+
+    def snapshot(self, now: float) -> Dict[str, VariantStats]:
+        """All variants' stats."""
+        return self._stats
+
+class RunAnalytics:
+    """
+    Rolling win rate, score and latency statistics per variant.
+    Not thread-safe; callers hold the run store lock.
+    """
+
+    def __init__(self, relative_accuracy: float = RELATIVE_ACCURACY, clock: Callable[[], float] = time.time):
+        self._clock = clock
+        self._windows = {
+            name: RollingWindow(*window, relative_accuracy) if window else AllTime(relative_accuracy)
+            for name, window in WINDOWS.items()
+        }
+
+    def _each(self, variant_id: str):
+        """The stats to update for a variant in every window."""
+        now = self._clock()
+        return [window.stats(variant_id, now) for window in self._windows.values()]
+
+    def record_variant(self, variant: Any) -> None:
+        """Count a variant's participation in a run, its latency and prompt size."""
+        for stats in self._each(variant.variant_id):
+            stats.add_variant(variant)
+
+    def record_score(self, score: Any) -> None:
+        """Add a variant's score to its running means."""
+        for stats in self._each(score.variant_id):
+            stats.add_score(score)
+
+    def record_win(self, variant_id: str) -> None:
+        """Count a run won by a variant."""
+        for stats in self._each(variant_id):
+            stats.add_win()
+
+    def get_leaderboard(self, window: str = "all") -> List[Dict[str, Any]]:
+        """
+        Variants in one window, best first: highest mean score, then lowest
+        median latency. Unscored variants rank last.
+
+        Raises:
+            KeyError: If the window name is unknown
+        """
+        return rank_variants(self._windows[window].snapshot(self._clock()))
+
+    def get_analytics(self) -> Dict[str, Any]:
+        """Per-window, per-variant summaries."""
+        now = self._clock()
+        return {
+            name: {
+                variant_id: stats.summary()
+                for variant_id, stats in sorted(window.snapshot(now).items())
+            }
+            for name, window in self._windows.items()
+        }
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Benchmark intent detection as the lexicon grows.
+Compares one regex scan per phrase against the Aho-Corasick automaton.
+"""
+
+import random
+import re
+import string
+import time
+
+from keyword_automaton import KeywordAutomaton, normalize_text
+
+SAMPLE_TEXT = (
+    "This is urgent - my account is locked and I need access now! "
+    "I was double-charged after upgrading my plan and the app keeps crashing."
+)
+
+def build_lexicon(label_count: int, phrases_per_label: int) -> dict:
+    """Build a synthetic lexicon of random one- and two-word trigger phrases."""
+    rng = random.Random(42)
+
+    def word() -> str:
+        return "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 9)))
+
+    lexicon = {}
+    for index in range(label_count):
+        lexicon[f"label_{index}"] = [
+            word() if rng.random() < 0.5 else f"{word()} {word()}"
+            for _ in range(phrases_per_label)
+        ]
+
+    # Keep a few real hits so both approaches do some matching work
+    lexicon["label_0"] += ["urgent", "locked", "double charged", "app"]
+    return lexicon
+
+def time_per_call(fn, repeats: int = 200) -> float:
+    """Average wall time of fn() in microseconds."""
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats * 1e6
+
+def main():
+    print(f"{'labels':>8} {'phrases':>8} {'regex us':>10} {'automaton us':>13}")
+
+    for label_count in [4, 50, 200, 500]:
+        lexicon = build_lexicon(label_count, phrases_per_label=10)
+        phrase_count = sum(len(phrases) for phrases in lexicon.values())
+
+        # Baseline: one compiled regex per phrase, scanned over the text
+        patterns = [
+            (label, re.compile(r"\b" + re.escape(phrase) + r"\b"))
+            for label, phrases in lexicon.items()
+            for phrase in phrases
+        ]
+        text = normalize_text(SAMPLE_TEXT)
+
+        def regex_scan():
+            counts = {}
+            for label, pattern in patterns:
+                hits = len(pattern.findall(text))
+                if hits:
+                    counts[label] = counts.get(label, 0) + hits
+            return counts
+
+        automaton = KeywordAutomaton(lexicon)
+        assert automaton.count(SAMPLE_TEXT) == regex_scan()
+
+        print(
+            f"{label_count:>8} {phrase_count:>8} "
+            f"{time_per_call(regex_scan):>10.1f} {time_per_call(lambda: automaton.count(SAMPLE_TEXT)):>13.1f}"
+        )
+
+if __name__ == "__main__":
+    main()
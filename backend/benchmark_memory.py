@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Benchmark run store memory per run.
+Compares the old layout (a pydantic Run with its Event models per run) with
+the compact records RunStore keeps now, at a large number of stored runs.
+Frozen HTTP bodies of completed runs are excluded from both.
+
+Usage: python benchmark_memory.py [--runs 100000]
+"""
+
+import argparse
+import gc
+import time
+import tracemalloc
+from datetime import datetime
+
+from models import (
+    Run, Event, EventType, RunStatus, TaskConfig, Variant, VariantOutput, Score, ScoreComponents, create_run_id
+)
+from run_store import RunStore
+
+LABELS = ["billing", "technical", "cancellation", "urgent", "other"]
+PROMPT_SPECS = [
+    "Formal approach: Classify the text into one of the provided categories and write a concise summary.",
+    "Conversational approach: Help classify this customer message and summarize what they need.",
+    "Analytical approach: Analyze the text to determine the primary intent category and provide a factual summary."
+]
+
+def typical_run(index: int):
+    """Variants, scores and events of a completed three-variant run."""
+    variants, scores, events = [], [], []
+    for i, prompt_spec in enumerate(PROMPT_SPECS):
+        variant_id = f"v{i + 1}"
+        variant = Variant(
+            variant_id=variant_id,
+            prompt_spec=prompt_spec,
+            output=VariantOutput(category=LABELS[index % len(LABELS)], summary=f"Customer {index} reports a billing problem"),
+            latency_ms=800 + i * 100
+        )
+        score = Score(variant_id=variant_id, total=4.0 + i / 10, components=ScoreComponents(
+            label_valid=1.0, label_match=1.0, summary_len_ok=1.0, no_hedging=1.0, format_ok=0.0 + i / 10
+        ))
+        variants.append(variant)
+        scores.append(score)
+        events += [
+            {"type": EventType.VARIANT_START, "ts": 1.7e12, "payload": {"variant_id": variant_id, "prompt_spec": prompt_spec}},
+            {"type": EventType.VARIANT_OUTPUT, "ts": 1.7e12, "payload": {
+                "variant_id": variant_id, "output": variant.output.model_dump(), "latency_ms": variant.latency_ms
+            }},
+            {"type": EventType.VARIANT_SCORED, "ts": 1.7e12, "payload": {
+                "variant_id": variant_id, "score": score.total, "components": score.components.model_dump()
+            }}
+        ]
+    events.append({"type": EventType.RUN_COMPLETE, "ts": 1.7e12, "payload": {"winner_variant_id": "v3", "total_variants": 3}})
+    return variants, scores, events
+
+def fill_pydantic(runs: int) -> dict:
+    """The previous layout: pydantic models plus the encoded event bytes."""
+    stored = {}
+    for index in range(runs):
+        variants, scores, events = typical_run(index)
+        run = Run(
+            run_id=create_run_id(),
+            input_text=f"I was double-charged after upgrading my plan ({index})",
+            created_at=datetime.utcnow(),
+            status=RunStatus.COMPLETE,
+            task_config=TaskConfig(labels=list(LABELS)),
+            variants=variants,
+            scores=scores,
+            winner_variant_id="v3",
+            event_log=[Event(**event) for event in events]
+        )
+        stored[run.run_id] = (run, [event.model_dump_json().encode("utf-8") for event in run.event_log])
+    return stored
+
+def fill_records(runs: int) -> RunStore:
+    """The current layout, filled through the RunStore API."""
+    store = RunStore()
+    store._max_runs = runs
+    for index in range(runs):
+        variants, scores, events = typical_run(index)
+        run_id = store.create_run(f"I was double-charged after upgrading my plan ({index})")
+        for variant, score in zip(variants, scores):
+            store.add_variant(run_id, variant)
+            store.add_score(run_id, score)
+        for event in events:
+            store.add_event(run_id, event)
+        store.set_winner(run_id, "v3")
+    return store
+
+def measure(fill, runs: int) -> float:
+    """Bytes allocated per run by fill(runs), as measured by tracemalloc."""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    start = time.time()
+    kept = fill(runs)
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    print(f"  filled in {time.time() - start:.1f}s")
+    del kept
+    return used / runs
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=100000, help="Number of stored runs")
+    args = parser.parse_args()
+
+    print(f"📦 Storing {args.runs} runs (3 variants, 10 events each)")
+    print("pydantic models:")
+    before = measure(fill_pydantic, args.runs)
+    print("compact records:")
+    after = measure(fill_records, args.runs)
+
+    print(f"\n{'layout':>16} {'bytes/run':>10}")
+    print(f"{'pydantic':>16} {before:>10.0f}")
+    print(f"{'records':>16} {after:>10.0f}")
+    print(f"{'saved':>16} {1 - after / before:>10.0%}")
+
+if __name__ == "__main__":
+    main()
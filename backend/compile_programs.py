@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Compile each prompt variant into a few-shot DSPy program, once, offline.
+The server loads the latest compiled version at startup instead of
+re-deriving demos on every run.
+
+Usage: python compile_programs.py [--data training_data.yaml] [--max-demos 4]
+"""
+
+import argparse
+import sys
+from pathlib import Path
+from typing import Dict, List, Any
+
+import yaml
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+BACKEND_DIR = Path(__file__).parent
+
+def load_dataset(path: Path) -> List[Dict[str, Any]]:
+    """Load labelled {text, category, summary} examples."""
+    with open(path, 'r') as f:
+        return yaml.safe_load(f)
+
+def compile_variants(optimizer: Any, dataset: List[Dict[str, Any]], max_demos: int = 4) -> Dict[str, Any]:
+    """
+    Bootstrap few-shot demos for every variant of an optimizer.
+
+    Args:
+        optimizer: A configured DSPyOptimizer (its LM is used for bootstrapping)
+        dataset: Labelled examples
+        max_demos: Maximum demos per compiled program
+
+    Returns:
+        variant_id -> compiled ClassifyProgram
+    """
+    import dspy
+    from dspy.teleprompt import BootstrapFewShot
+    from optimizer import ClassifyProgram
+
+    scorer = optimizer.scorer
+
+    def metric(example, prediction, trace=None) -> bool:
+        # Keep demos that get the label right and pass the summary checks the scorer applies
+        summary = getattr(prediction, "summary", "") or ""
+        return (
+            getattr(prediction, "category", "").strip().lower() == example.category
+            and scorer._score_summary_length(summary) == 1.0
+            and scorer._score_no_hedging(summary) == 1.0
+        )
+
+    programs = {}
+    for variant, spec in optimizer.variants:
+        # Demos carry the variant's instruction, without its hand-written examples
+        base_spec = {key: value for key, value in spec.items() if key not in ("examples", "demos")}
+        trainset = [
+            dspy.Example(
+                text=optimizer._build_context(base_spec, item["text"]),
+                category=item["category"],
+                summary=item["summary"]
+            ).with_inputs("text")
+            for item in dataset
+        ]
+
+        teleprompter = BootstrapFewShot(
+            metric=metric,
+            max_bootstrapped_demos=max_demos,
+            max_labeled_demos=max_demos
+        )
+        programs[variant.variant_id] = teleprompter.compile(ClassifyProgram(), trainset=trainset)
+        print(f"✅ Compiled {variant.variant_id} with {len(programs[variant.variant_id].predict.demos)} demos")
+
+    return programs
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--data", default=str(BACKEND_DIR / "training_data.yaml"), help="Labelled training examples")
+    parser.add_argument("--max-demos", type=int, default=4, help="Maximum demos per variant")
+    args = parser.parse_args()
+
+    from config import load_config
+    from optimizer import DSPyOptimizer
+    from program_store import save_compiled_programs
+
+    config = load_config()
+    # Compile from the hand-written variants, not a previously compiled version
+    config["compiled_programs"] = {**config.get("compiled_programs", {}), "version": "none"}
+
+    dataset = load_dataset(Path(args.data))
+    print(f"🔧 Compiling {config['variant_count']} variants on {len(dataset)} examples with {config['provider']['model']}")
+
+    try:
+        optimizer = DSPyOptimizer(config)
+        programs = compile_variants(optimizer, dataset, args.max_demos)
+    except Exception as e:
+        print(f"❌ Compilation failed: {str(e)}")
+        sys.exit(1)
+
+    version_dir = save_compiled_programs(
+        config,
+        programs,
+        dataset,
+        {"name": "BootstrapFewShot", "max_bootstrapped_demos": args.max_demos, "max_labeled_demos": args.max_demos}
+    )
+    print(f"💾 Saved {version_dir}")
+
+if __name__ == "__main__":
+    main()
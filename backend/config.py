@@ -30,6 +30,15 @@ def load_config() -> Dict[str, Any]:
         temps = [float(t.strip()) for t in os.getenv("TEMPERATURE_VARIANTS").split(",")]
         config["provider"]["temperature"] = temps
     
+    if os.getenv("RUN_STORE_BACKEND"):
+        config.setdefault("run_store", {})["backend"] = os.getenv("RUN_STORE_BACKEND")
+    
+    if os.getenv("RUN_STORE_PATH"):
+        config.setdefault("run_store", {})["path"] = os.getenv("RUN_STORE_PATH")
+    
+    if os.getenv("RUN_ARCHIVE_DIR"):
+        config.setdefault("run_store", {})["archive_dir"] = os.getenv("RUN_ARCHIVE_DIR")
+    
     # Validate configuration
     _validate_config(config)
     
@@ -3,67 +3,181 @@ Dungeon Game - DSPy Optimizer Endpoint
 Optimizes three prompts collected from the wise elders
 """
 
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Callable, Tuple
+from collections import OrderedDict
 import asyncio
-import random
+import hashlib
+import time
+
+from models import EventType, Variant, Score, ScoreComponents
+
+# Small built-in dev set the elders' prompts are evaluated against
+DEV_SET = [
+    "I was double-charged after upgrading my plan.",
+    "My internet connection keeps dropping every few minutes.",
+    "I want to cancel my subscription immediately.",
+    "This is urgent - my account is locked and I need access now!",
+    "How do I change my billing address?",
+    "The mobile app crashes when I try to upload files."
+]
 
 
 class DungeonOptimizer:
-    """Simple optimizer for the dungeon game prompts"""
-    
-    def __init__(self):
+    """Evaluates the dungeon game prompts with the real DSPy optimizer"""
+
+    def __init__(self, optimizer: Any, max_concurrency: int = 8, cache_size: int = 256):
+        # optimizer is a LazyResource wrapping DSPyOptimizer
+        self.optimizer = optimizer
+        self.max_concurrency = max_concurrency
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, Tuple[float, Score]]" = OrderedDict()
         self.principles = {
             "clarity": "Be specific and clear in your instructions",
             "context": "Provide context and examples",
             "structure": "Use structured thinking"
         }
     
-    async def optimize_prompts(self, prompts: List[str], task: str = "general_qa") -> Dict[str, Any]:
+    async def optimize_prompts(
+        self,
+        prompts: List[str],
+        task: str = "general_qa",
+        run_id: Optional[str] = None,
+        run_store: Any = None
+    ) -> Dict[str, Any]:
         """
-        Simulate DSPy optimization of the three prompt principles
-        In a real implementation, this would use DSPy's optimization pipeline
+        Score each elder prompt and their combination against the dev set.
+        All candidate x example calls run concurrently; scores are cached by prompt hash.
+        When run_id and run_store are given, every step is emitted as a run event.
         """
+        def emit(event_type: EventType, payload: Dict[str, Any]) -> None:
+            if run_store is not None:
+                run_store.add_event(run_id, {"type": event_type, "ts": time.time() * 1000, "payload": payload})
         
-        # Simulate some processing time
-        await asyncio.sleep(2)
-        
+        optimizer = self.optimizer.get() if self.optimizer.ready else await asyncio.to_thread(self.optimizer.get)
+
         # Combine the three wisdom teachings into an optimized prompt
         combined_prompt = self._combine_wisdoms(prompts)
+        candidates = list(prompts) + [combined_prompt]
+        candidate_ids = [f"c{i + 1}" for i in range(len(candidates))]
+        emit(EventType.PROMPTS_COMBINED, {"candidate_id": candidate_ids[-1], "prompt": combined_prompt})
         
-        # Simulate scoring (in real DSPy, this would be actual metrics)
-        score = random.uniform(90, 99)
+        leader = {"candidate_id": None, "score": -1.0}
         
-        # Generate comparison data
-        individual_scores = [
-            random.uniform(70, 85) for _ in prompts
-        ]
+        async def score_candidate(candidate_id: str, prompt: str) -> float:
+            emit(EventType.CANDIDATE_START, {"candidate_id": candidate_id, "prompt": prompt})
+            
+            def on_evaluated(input_text: str, variant: Variant, score: Score) -> None:
+                emit(EventType.CANDIDATE_EVALUATED, {
+                    "candidate_id": candidate_id,
+                    "input_text": input_text,
+                    "output": variant.output.model_dump() if variant.output else None,
+                    "latency_ms": variant.latency_ms,
+                    "error": variant.error,
+                    "prompt_tokens": variant.prompt_tokens,
+                    "total": score.total
+                })
+            
+            score, mean_score, cached = await self._score_prompt(optimizer, candidate_id, prompt, task, semaphore, on_evaluated)
+            
+            # Record the candidate like a variant so the run reads the same as /api/run runs
+            if run_store is not None:
+                run_store.add_variant(run_id, Variant(variant_id=candidate_id, prompt_spec=prompt))
+                run_store.add_score(run_id, mean_score.model_copy(update={"variant_id": candidate_id}))
+            emit(EventType.CANDIDATE_SCORED, {"candidate_id": candidate_id, "score": score, "cached": cached})
+            
+            if score > leader["score"]:
+                emit(EventType.LEADER_CHANGE, {"new_leader": candidate_id, "previous_leader": leader["candidate_id"]})
+                leader.update(candidate_id=candidate_id, score=score)
+            return score
         
-        return {
-            "best_prompt": combined_prompt,
-            "score": round(score, 1),
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        scores = await asyncio.gather(*[
+            score_candidate(candidate_id, candidate) for candidate_id, candidate in zip(candidate_ids, candidates)
+        ])
+
+        individual_scores = scores[:len(prompts)]
+        best_index = max(range(len(candidates)), key=lambda i: scores[i])
+        best_score = scores[best_index]
+        
+        results = {
+            "best_prompt": candidates[best_index],
+            "score": best_score,
             "individual_prompts": prompts,
             "individual_scores": individual_scores,
-            "improvement": round(score - max(individual_scores), 1),
+            "improvement": round(best_score - max(individual_scores, default=0.0), 1),
             "optimization_steps": [
-                "Analyzed clarity principle",
-                "Integrated contextual framework", 
-                "Applied structured reasoning",
-                "Combined all three wisdoms",
-                "Validated against test cases"
+                *[f"Scored wisdom {i + 1}: {score}" for i, score in enumerate(individual_scores)],
+                f"Combined all three wisdoms: {scores[-1]}",
+                f"Validated against {len(DEV_SET)} test cases"
             ]
         }
+        
+        if run_store is not None:
+            run_store.set_winner(run_id, candidate_ids[best_index])
+        emit(EventType.RUN_COMPLETE, {
+            "winner_variant_id": candidate_ids[best_index],
+            "total_variants": len(candidates),
+            "results": results
+        })
+        
+        return results
     
-    def _combine_wisdoms(self, prompts: List[str]) -> str:
-        """Combine the three elder wisdoms into a unified prompt strategy"""
-        return (
-            "Master Prompt Strategy:\n"
-            "1. Be specific and clear (Clarity)\n"
-            "2. Provide rich context and examples (Context)\n"
-            "3. Break down complex tasks step-by-step (Structure)\n\n"
-            "Example: 'You are a [specific role]. Given [detailed context], "
-            "let's solve this step-by-step: 1) [first step] 2) [second step] 3) [conclusion]'"
+    async def _score_prompt(
+        self,
+        optimizer: Any,
+        candidate_id: str,
+        prompt: str,
+        task: str,
+        semaphore: asyncio.Semaphore,
+        on_evaluated: Callable[[str, Variant, Score], None]
+    ) -> Tuple[float, Score, bool]:
+        """
+        Evaluate a prompt on the dev set.
+        Returns (percentage of the maximum score, mean Score, whether it was cached).
+        Scores are only cached when every dev-set call produced output, so a
+        timeout or provider error is retried on the next submission.
+        """
+        key = self._prompt_hash(prompt, task)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            score, mean_score = self._cache[key]
+            return score, mean_score, True
+        
+        async def evaluate(input_text: str) -> Tuple[Variant, Score]:
+            async with semaphore:
+                variant, score = await optimizer.run_instruction(prompt, input_text, variant_id=candidate_id)
+            on_evaluated(input_text, variant, score)
+            return variant, score
+        
+        results = await asyncio.gather(*[evaluate(input_text) for input_text in DEV_SET])
+        dev_scores = [score for _, score in results]
+        mean_score = Score(
+            variant_id=candidate_id,
+            total=sum(s.total for s in dev_scores) / len(dev_scores),
+            components=ScoreComponents(**{
+                name: sum(getattr(s.components, name) for s in dev_scores) / len(dev_scores)
+                for name in ScoreComponents.model_fields
+            }),
+            metrics={
+                name: sum(s.metrics.get(name, 0.0) for s in dev_scores) / len(dev_scores)
+                for name in dev_scores[0].metrics
+            }
         )
+        max_total = optimizer.scorer.max_total or 1.0
+        score = round(mean_score.total / max_total * 100, 1)
+        
+        if all(variant.output and not variant.error for variant, _ in results):
+            self._cache[key] = (score, mean_score)
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        
+        return score, mean_score, False
+    
+    def _prompt_hash(self, prompt: str, task: str) -> str:
+        """Cache key for a prompt's dev-set score."""
+        return hashlib.sha256(f"{task}\0{prompt}".encode("utf-8")).hexdigest()
 
-
-# Global instance
-dungeon_optimizer = DungeonOptimizer()
+    def _combine_wisdoms(self, prompts: List[str]) -> str:
+        """Combine the three elder wisdoms into a unified prompt strategy"""
+        steps = "\n".join(f"{i + 1}. {prompt.strip()}" for i, prompt in enumerate(prompts))
+        return f"Master Prompt Strategy:\n{steps}"
@@ -0,0 +1,93 @@
+"""
+Fan-out of every run's events to firehose subscribers.
+Publishing never blocks on, or buffers without bound for, a slow subscriber.
+"""
+
+from typing import Dict, List, Optional
+from collections import deque
+import json
+import threading
+
+class Subscriber:
+    """
+    A fixed-size ring buffer of (run_id, encoded event) pairs.
+    When full, the oldest event is dropped and counted; the next drain
+    reports the count as a gap before the surviving events.
+    """
+
+    def __init__(self, buffer_size: int):
+        self._buffer = deque(maxlen=buffer_size)
+        self._lock = threading.Lock()
+        self.dropped = 0  # Not yet reported
+        self.dropped_total = 0
+
+    def push(self, run_id: str, encoded: bytes) -> None:
+        """Buffer an event, evicting the oldest if the buffer is full."""
+        with self._lock:
+            if len(self._buffer) == self._buffer.maxlen:
+                self.dropped += 1
+                self.dropped_total += 1
+            self._buffer.append((run_id, encoded))
+
+    def drain(self) -> List[bytes]:
+        """
+        Take everything buffered as SSE messages, oldest first.
+        A "gap" event precedes them if anything was dropped since the last drain.
+        """
+        with self._lock:
+            items = list(self._buffer)
+            self._buffer.clear()
+            dropped, self.dropped = self.dropped, 0
+
+        messages = []
+        if dropped:
+            messages.append(b"event: gap\ndata: " + json.dumps({"dropped": dropped}).encode("utf-8") + b"\n\n")
+        for run_id, encoded in items:
+            messages.append(
+                b'data: {"run_id":' + json.dumps(run_id).encode("utf-8") + b',"event":' + encoded + b"}\n\n"
+            )
+        return messages
+
+class EventBus:
+    """Publishes each added event to every current subscriber's ring buffer."""
+
+    def __init__(self):
+        self._subscribers: Dict[int, Subscriber] = {}
+        self._lock = threading.Lock()
+        self._next_id = 0
+
+    def subscribe(self, buffer_size: int = 1000, max_subscribers: Optional[int] = None) -> Optional[int]:
+        """Register a subscriber; returns its ID, or None if max_subscribers is reached."""
+        with self._lock:
+            if max_subscribers is not None and len(self._subscribers) >= max_subscribers:
+                return None
+
+            subscriber_id = self._next_id
+            self._next_id += 1
+            self._subscribers[subscriber_id] = Subscriber(buffer_size)
+            return subscriber_id
+
+    def unsubscribe(self, subscriber_id: int) -> None:
+        """Remove a subscriber and its buffer."""
+        with self._lock:
+            self._subscribers.pop(subscriber_id, None)
+
+    def get(self, subscriber_id: int) -> Optional[Subscriber]:
+        """Look up a subscriber."""
+        with self._lock:
+            return self._subscribers.get(subscriber_id)
+
+    def publish(self, run_id: str, encoded: bytes) -> None:
+        """Hand an encoded event to every subscriber. O(subscribers), never waits on readers."""
+        with self._lock:
+            subscribers = list(self._subscribers.values())
+        for subscriber in subscribers:
+            subscriber.push(run_id, encoded)
+
+    def get_stats(self) -> Dict[str, int]:
+        """Subscriber count and events dropped for slow readers."""
+        with self._lock:
+            return {
+                "subscribers": len(self._subscribers),
+                "dropped_total": sum(subscriber.dropped_total for subscriber in self._subscribers.values())
+            }
@@ -0,0 +1,102 @@
+"""
+Hedged requests for tail-latency control.
+Fires a duplicate provider call when the first one is slower than usual.
+"""
+
+from typing import Dict, Any, Awaitable, Callable, Optional, TypeVar
+from collections import deque
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+class HedgePolicy:
+    """
+    Issues a backup request once a call exceeds a latency percentile learned
+    from recent calls, and returns whichever request finishes first.
+    Extra spend is capped at budget_ratio hedges per call.
+    """
+
+    def __init__(self, hedge_config: Dict[str, Any]):
+        self.enabled = hedge_config.get("enabled", False)
+        self.percentile = hedge_config.get("percentile", 95)
+        self.min_samples = hedge_config.get("min_samples", 20)
+        self.budget_ratio = hedge_config.get("budget_ratio", 0.1)
+        self._latencies = deque(maxlen=hedge_config.get("window", 200))
+
+        # Counters exposed through get_stats
+        self.calls = 0
+        self.hedges_fired = 0
+        self.hedge_wins = 0
+
+    def hedge_delay(self) -> Optional[float]:
+        """Seconds to wait before hedging, or None until enough latencies are known."""
+        if len(self._latencies) < self.min_samples:
+            return None
+
+        ordered = sorted(self._latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+        return ordered[index]
+
+    def _within_budget(self) -> bool:
+        """Check that one more hedge keeps extra calls under the budget."""
+        return self.hedges_fired + 1 <= self.budget_ratio * self.calls
+
+    async def run(self, make_call: Callable[[], Awaitable[T]], timeout: Optional[float] = None) -> T:
+        """
+        Await make_call(), hedging it with a second call if it runs long.
+        The losing request is cancelled.
+
+        The learned latencies are the primary call's elapsed time whatever its
+        outcome, capped at timeout (the caller's deadline). Sampling only the
+        winner would drop the slow calls the hedge delay is meant to catch.
+        """
+        self.calls += 1
+        start_time = time.time()
+        delay = self.hedge_delay() if self.enabled else None
+        cap = timeout if timeout is not None else float("inf")
+
+        primary = asyncio.ensure_future(make_call())
+        primary.add_done_callback(lambda _: self._latencies.append(min(time.time() - start_time, cap)))
+        tasks = [primary]
+
+        try:
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done and self._within_budget():
+                    self.hedges_fired += 1
+                    logger.info(f"Hedging call after {delay * 1000:.0f}ms")
+                    tasks.append(asyncio.ensure_future(make_call()))
+
+            # Take the first success; only surface an error once every request failed
+            pending = set(tasks)
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                succeeded = [task for task in done if task.exception() is None]
+                if succeeded or not pending:
+                    winner = succeeded[0] if succeeded else done.pop()
+                    break
+
+            if winner is not primary and winner.exception() is None:
+                self.hedge_wins += 1
+
+            return winner.result()
+
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get hedging counters and the current hedge delay."""
+        delay = self.hedge_delay()
+        return {
+            "enabled": self.enabled,
+            "calls": self.calls,
+            "hedges_fired": self.hedges_fired,
+            "hedge_wins": self.hedge_wins,
+            "hedge_delay_ms": round(delay * 1000) if delay is not None else None
+        }
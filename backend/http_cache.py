@@ -0,0 +1,69 @@
+"""
+HTTP caching helpers for immutable response bodies.
+Completed runs never change, so their bodies are compressed and hashed once.
+"""
+
+from typing import Dict, Optional
+import gzip
+import hashlib
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+class FrozenBody:
+    """
+    A response body precomputed in every supported content encoding.
+    The ETag is strong because it hashes the exact identity bytes.
+    """
+
+    __slots__ = ("etag", "encodings")
+
+    def __init__(self, body: bytes):
+        self.etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        self.encodings: Dict[str, bytes] = {
+            "identity": body,
+            "gzip": gzip.compress(body, compresslevel=9, mtime=0)
+        }
+        if brotli is not None:
+            self.encodings["br"] = brotli.compress(body)
+
+    def select(self, accept_encoding: Optional[str]) -> str:
+        """Pick the smallest encoding the client accepts."""
+        accepted = _parse_accept_encoding(accept_encoding or "")
+        candidates = [
+            name for name in self.encodings
+            if name == "identity" or name in accepted or "*" in accepted
+        ]
+        return min(candidates, key=lambda name: len(self.encodings[name]))
+
+    def matches(self, if_none_match: Optional[str]) -> bool:
+        """Check an If-None-Match header against this body's ETag."""
+        if not if_none_match:
+            return False
+
+        if if_none_match.strip() == "*":
+            return True
+
+        # If-None-Match uses weak comparison, so ignore any W/ prefix
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return any(tag.removeprefix("W/") == self.etag for tag in tags)
+
+def _parse_accept_encoding(header: str) -> set:
+    """Return the content codings a client accepts, skipping any with q=0."""
+    accepted = set()
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        params = params.replace(" ", "")
+        if params.startswith("q="):
+            try:
+                if float(params[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        if name:
+            accepted.add(name.lower())
+    return accepted
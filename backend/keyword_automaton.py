@@ -0,0 +1,78 @@
+"""
+Aho-Corasick keyword automaton for multi-label phrase counting.
+Counts every label's trigger phrases in one linear pass over the text.
+"""
+
+from typing import Dict, List
+from collections import deque
+import re
+
+def normalize_text(text: str) -> str:
+    """
+    Lowercase, collapse non-alphanumerics to single spaces and pad with spaces.
+    Padding lets whole-word phrase matching work as plain substring matching.
+    """
+    return " " + re.sub(r"[^a-z0-9]+", " ", text.lower()).strip() + " "
+
+class KeywordAutomaton:
+    """
+    Aho-Corasick automaton over normalized trigger phrases.
+    Scan cost depends on text length and match count, not lexicon size.
+    """
+
+    def __init__(self, lexicon: Dict[str, List[str]]):
+        self.labels = list(lexicon)
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._outputs: List[List[int]] = [[]]
+
+        for label_index, label in enumerate(self.labels):
+            for phrase in lexicon[label]:
+                normalized = normalize_text(phrase)
+                if normalized.strip():
+                    self._add_phrase(normalized, label_index)
+
+        self._build_failure_links()
+
+    def _add_phrase(self, phrase: str, label_index: int) -> None:
+        """Insert a phrase into the trie."""
+        state = 0
+        for char in phrase:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._outputs.append([])
+            state = next_state
+        self._outputs[state].append(label_index)
+
+    def _build_failure_links(self) -> None:
+        """Breadth-first pass setting failure links and merging outputs along them."""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                self._outputs[next_state] = self._outputs[next_state] + self._outputs[self._fail[next_state]]
+
+    def count(self, text: str) -> Dict[str, int]:
+        """Count phrase matches per label in a single pass over the text."""
+        goto, fail, outputs = self._goto, self._fail, self._outputs
+        counts = [0] * len(self.labels)
+
+        state = 0
+        for char in normalize_text(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for label_index in outputs[state]:
+                counts[label_index] += 1
+
+        return {self.labels[index]: hits for index, hits in enumerate(counts) if hits}
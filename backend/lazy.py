@@ -0,0 +1,71 @@
+"""
+Deferred initialization for expensive resources.
+Lets the server start listening before heavy imports and provider setup finish.
+"""
+
+from typing import Any, Callable, Dict, Generic, Optional, TypeVar
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+class LazyResource(Generic[T]):
+    """
+    Builds a resource once, on first use or when warmed in the background.
+    Concurrent callers wait for the single in-progress build.
+    """
+
+    def __init__(self, name: str, factory: Callable[[], T]):
+        self.name = name
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._value: Optional[T] = None
+        self._error: Optional[Exception] = None
+        self._build_ms: Optional[int] = None
+
+    @property
+    def ready(self) -> bool:
+        """Whether the resource has been built."""
+        return self._value is not None
+
+    def get(self) -> T:
+        """Return the resource, building it first if needed. Blocks while building."""
+        if self._value is not None:
+            return self._value
+
+        with self._lock:
+            if self._value is None:
+                start_time = time.time()
+                try:
+                    self._value = self._factory()
+                    self._error = None
+                except Exception as e:
+                    # Keep the error for readiness checks; the next get() retries
+                    self._error = e
+                    raise
+                finally:
+                    self._build_ms = int((time.time() - start_time) * 1000)
+                logger.info(f"Initialized {self.name} in {self._build_ms}ms")
+
+        return self._value
+
+    def warm(self) -> None:
+        """Start building the resource in a background thread."""
+        def build():
+            try:
+                self.get()
+            except Exception as e:
+                logger.error(f"Failed to initialize {self.name}: {str(e)}")
+
+        threading.Thread(target=build, name=f"warm-{self.name}", daemon=True).start()
+
+    def status(self) -> Dict[str, Any]:
+        """Readiness details for health endpoints."""
+        return {
+            "ready": self.ready,
+            "build_ms": self._build_ms,
+            "error": str(self._error) if self._error and not self.ready else None
+        }
@@ -3,22 +3,30 @@ Live Optimizing Classifier - FastAPI Backend
 Main application entry point with API routes and SSE streaming.
 """
 
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Request, Query, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import Response, JSONResponse
+from contextlib import asynccontextmanager
 import asyncio
 import json
 import logging
-from typing import Dict, Any, List
+import math
+import time
+from typing import Dict, Any, List, Optional
+from datetime import datetime, timezone
 import os
 from dotenv import load_dotenv
 from pydantic import BaseModel
 
-from models import RunRequest, RunResponse, RunStatus
-from optimizer import DSPyOptimizer
-from run_store import RunStore
+from models import RunRequest, RunResponse, RunStatus, TERMINAL_STATUSES
+from lazy import LazyResource
+from run_store import create_run_store
 from config import load_config
-from dungeon_optimizer import dungeon_optimizer
+from http_cache import FrozenBody, IMMUTABLE_CACHE_CONTROL
+from dungeon_optimizer import DungeonOptimizer
+from run_multiplexer import RunSubscriptions
+from rate_limiter import RateLimiter
+from stream_slots import StreamTracker, ReleasingStreamingResponse, SlotStreamingResponse
 
 # Load environment variables
 load_dotenv()
@@ -27,11 +35,21 @@ load_dotenv()
 logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start building the optimizer in the background so startup doesn't wait for it."""
+    optimizer.warm()
+    yield
+    run_store.flush_archive()
+    if optimizer.ready:
+        optimizer.get().scorer.metrics.shutdown()
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Live Optimizing Classifier",
     description="DSPy prompt optimization demo with live visualization",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Configure CORS
@@ -45,22 +63,64 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+def build_optimizer():
+    """Import DSPy and configure the LM provider (the slow part of startup)."""
+    from optimizer import DSPyOptimizer
+    return DSPyOptimizer(config)
+
 # Global instances
 config = load_config()
-optimizer = DSPyOptimizer(config)
-run_store = RunStore()
+optimizer = LazyResource("optimizer", build_optimizer)
+dungeon_optimizer = DungeonOptimizer(optimizer)
+run_store = create_run_store(config.get("run_store", {}))
+rate_limiter = RateLimiter(config.get("rate_limit", {}))
+stream_tracker = StreamTracker(config.get("sse", {}).get("max_streams", 500))
+
+def client_key(request: Request) -> str:
+    """Identify the client for rate limiting: its allow-listed API key, else its IP."""
+    return rate_limiter.client_key(
+        request.client.host if request.client else "unknown",
+        request.headers.get("X-Forwarded-For"),
+        request.headers.get("X-API-Key")
+    )
+
+def enforce_rate_limit(request: Request, route: str) -> None:
+    """Reject the request with 429 if the client has no tokens left for the route."""
+    retry_after = rate_limiter.check(route, client_key(request))
+    if retry_after:
+        raise HTTPException(
+            status_code=429,
+            detail="Rate limit exceeded",
+            headers={"Retry-After": str(math.ceil(retry_after))}
+        )
 
 @app.get("/")
 async def root():
     """Health check endpoint."""
     return {"status": "ok", "message": "Live Optimizing Classifier API"}
 
+@app.get("/healthz/live")
+async def liveness():
+    """Liveness probe: the process is up and serving requests."""
+    return {"status": "ok"}
+
+@app.get("/healthz/ready")
+async def readiness():
+    """Readiness probe: DSPy and the LM provider are initialized."""
+    status = optimizer.status()
+    if not status["ready"]:
+        return JSONResponse(status_code=503, content={"status": "starting", **status})
+    
+    return {"status": "ready", **status}
+
 @app.post("/api/run", response_model=RunResponse)
-async def create_run(request: RunRequest, background_tasks: BackgroundTasks):
+async def create_run(request: RunRequest, background_tasks: BackgroundTasks, http_request: Request):
     """
     Create a new optimization run.
     Returns run_id immediately and processes in background.
     """
+    enforce_rate_limit(http_request, "run")
+    
     try:
         # Validate input length
         if len(request.input_text) > config["max_input_chars"]:
@@ -83,72 +143,318 @@ async def create_run(request: RunRequest, background_tasks: BackgroundTasks):
         logger.error(f"Error creating run: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to create run")
 
+def sse_event(seq: int, event: bytes) -> bytes:
+    """Frame a pre-encoded event as an SSE message whose id is its position in the run's log."""
+    return b"id: " + str(seq).encode("ascii") + b"\ndata: " + event + b"\n\n"
+
+def resume_position(last_event_id: Optional[str]) -> int:
+    """Index of the first event to send after a Last-Event-ID; 0 if absent or malformed."""
+    try:
+        return max(0, int(last_event_id) + 1) if last_event_id is not None else 0
+    except ValueError:
+        return 0
+
 @app.get("/api/run/{run_id}/stream")
-async def stream_run(run_id: str):
+async def stream_run(run_id: str, request: Request, last_event_id: Optional[str] = None):
     """
     Stream run events via Server-Sent Events (SSE).
+    
+    Each event's id is its sequence number in the run's event log. A client
+    reconnecting with a Last-Event-ID header (or last_event_id query parameter)
+    resumes after that event instead of replaying the log. Comment heartbeats
+    keep idle connections open through proxies.
+    
+    The stream ends when the run completes or errors, is evicted, the client
+    disconnects, or no event arrives for sse.idle_timeout_s. At most
+    sse.max_streams streams are open at once; beyond that the request gets 503.
     """
+    await run_store.prefetch(run_id)
     if not run_store.run_exists(run_id):
         raise HTTPException(status_code=404, detail="Run not found")
     
+    slot = stream_tracker.acquire()
+    if slot is None:
+        raise HTTPException(status_code=503, detail="Too many open streams")
+    
+    sse_config = config.get("sse", {})
+    heartbeat = sse_config.get("heartbeat_s", 15)
+    retry_ms = sse_config.get("retry_ms", 2000)
+    idle_timeout = sse_config.get("idle_timeout_s", 300)
+    position = resume_position(request.headers.get("Last-Event-ID", last_event_id))
+    
     async def event_generator():
-        """Generate SSE events for the run."""
+        """Generate SSE events for the run from pre-encoded event bytes."""
         try:
-            # Send any existing events first
-            events = run_store.get_events(run_id)
-            for event in events:
-                yield f"data: {json.dumps(event)}\n\n"
+            # Tell EventSource how long to wait before reconnecting
+            yield f"retry: {retry_ms}\n\n".encode("ascii")
             
-            # Stream new events as they arrive
-            last_event_count = len(events)
+            # Stream events after the client's last seen one, then new ones as they arrive
+            last_event_count = position
+            last_sent = last_event = time.monotonic()
             while True:
-                await asyncio.sleep(0.1)  # Poll every 100ms
-                
-                current_events = run_store.get_events(run_id)
+                # Read status first so no event added after it can be missed
+                status = run_store.get_status(run_id)
+                new_events = run_store.get_encoded_events(run_id, last_event_count)
+                if new_events is None:
+                    yield f"data: {json.dumps({'error': 'Run evicted'})}\n\n".encode("utf-8")
+                    slot.close("evicted")
+                    break
                 
                 # Send new events
-                for event in current_events[last_event_count:]:
-                    yield f"data: {json.dumps(event)}\n\n"
+                for seq, event in enumerate(new_events, last_event_count):
+                    yield sse_event(seq, event)
+                
+                last_event_count += len(new_events)
                 
-                last_event_count = len(current_events)
+                # Stop once the run is finished, whether it completed or failed
+                if status in TERMINAL_STATUSES:
+                    slot.close(status.value)
+                    break
                 
-                # Check if run is complete
-                run_data = run_store.get_run(run_id)
-                if run_data and run_data.get("status") == RunStatus.COMPLETE:
+                now = time.monotonic()
+                if new_events:
+                    last_sent = last_event = now
+                elif now - last_event >= idle_timeout:
+                    slot.close("idle_timeout")
+                    break
+                elif now - last_sent >= heartbeat:
+                    yield b": heartbeat\n\n"
+                    last_sent = now
+                
+                await asyncio.sleep(0.1)  # Poll every 100ms
+                if await request.is_disconnected():
+                    slot.close("disconnected")
                     break
                     
         except Exception as e:
             logger.error(f"Error streaming run {run_id}: {str(e)}")
-            yield f"data: {json.dumps({'error': str(e)})}\n\n"
+            slot.close("exception")
+            yield f"data: {json.dumps({'error': str(e)})}\n\n".encode("utf-8")
     
-    return StreamingResponse(
+    return SlotStreamingResponse(
         event_generator(),
+        slot,
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
             "Connection": "keep-alive",
             "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Headers": "Cache-Control",
+            "Access-Control-Allow-Headers": "Cache-Control, Last-Event-ID",
         }
     )
 
+@app.get("/api/events")
+async def stream_all_events(request: Request):
+    """
+    Stream every event from every run via Server-Sent Events.
+    Each subscriber gets a fixed-size buffer; if it falls behind, the oldest
+    events are dropped and an "event: gap" message reports how many.
+    With the sqlite backend, events added by other workers are picked up from
+    the shared database on each poll.
+    """
+    firehose_config = config.get("firehose", {})
+    # Catch up first, so a new subscriber only gets events from now on
+    run_store.sync_firehose()
+    subscriber_id = run_store.firehose.subscribe(
+        firehose_config.get("buffer_size", 1000),
+        firehose_config.get("max_subscribers", 32)
+    )
+    if subscriber_id is None:
+        raise HTTPException(status_code=503, detail="Too many event stream subscribers")
+    
+    async def event_generator():
+        """Drain this subscriber's buffer every poll interval."""
+        subscriber = run_store.firehose.get(subscriber_id)
+        try:
+            while not await request.is_disconnected():
+                run_store.sync_firehose()
+                for message in subscriber.drain():
+                    yield message
+                await asyncio.sleep(0.1)
+        finally:
+            run_store.firehose.unsubscribe(subscriber_id)
+    
+    # Also unsubscribes if the client disconnects before the generator starts
+    return ReleasingStreamingResponse(
+        event_generator(),
+        lambda: run_store.firehose.unsubscribe(subscriber_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "Connection": "keep-alive"}
+    )
+
+@app.websocket("/api/runs/ws")
+async def stream_runs(websocket: WebSocket):
+    """
+    Stream events for many runs over one WebSocket.
+    Clients send {"action": "subscribe" | "unsubscribe", "run_ids": [...]} at any
+    time; the server sends at most one {"runs": [...]} frame per tick, with each
+    run's new events framed by its run_id.
+    """
+    await websocket.accept()
+    
+    multiplex_config = config.get("multiplex", {})
+    subscriptions = RunSubscriptions(multiplex_config.get("max_subscriptions", 100))
+    tick = multiplex_config.get("tick_ms", 100) / 1000.0
+    outbox: List[bytes] = []  # Replies to client messages, sent by the tick loop
+    
+    async def receive_messages():
+        """Apply subscription changes as the client sends them."""
+        while True:
+            text = await websocket.receive_text()
+            try:
+                message = json.loads(text)
+            except json.JSONDecodeError:
+                outbox.append(b'{"error":"Invalid JSON"}')
+                continue
+            
+            # Read archived runs off the event loop before the tick loop polls them
+            if isinstance(message, dict) and message.get("action") == "subscribe" and isinstance(message.get("run_ids"), list):
+                for run_id in message["run_ids"]:
+                    await run_store.prefetch(str(run_id))
+            
+            error = subscriptions.handle_message(message)
+            if error:
+                outbox.append(error)
+    
+    receiver = asyncio.create_task(receive_messages())
+    try:
+        while not receiver.done():
+            frame = subscriptions.poll(run_store)
+            for message in outbox + ([frame] if frame else []):
+                await websocket.send_text(message.decode("utf-8"))
+            outbox.clear()
+            await asyncio.sleep(tick)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+        try:
+            await receiver
+        except (asyncio.CancelledError, WebSocketDisconnect):
+            pass
+
+def cached_response(request: Request, frozen: FrozenBody) -> Response:
+    """
+    Serve a completed run's precomputed body.
+    Returns 304 for a matching If-None-Match, else the smallest accepted encoding.
+    """
+    headers = {
+        "ETag": frozen.etag,
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL,
+        "Vary": "Accept-Encoding"
+    }
+    
+    if frozen.matches(request.headers.get("if-none-match")):
+        return Response(status_code=304, headers=headers)
+    
+    encoding = frozen.select(request.headers.get("accept-encoding"))
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    
+    return Response(content=frozen.encodings[encoding], media_type="application/json", headers=headers)
+
+def as_utc_naive(value: Optional[datetime]) -> Optional[datetime]:
+    """Convert a query timestamp to the naive UTC datetimes runs are stored with."""
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+@app.get("/api/runs")
+async def list_runs(
+    status: Optional[RunStatus] = None,
+    winner_variant_id: Optional[str] = None,
+    winning_category: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100)
+):
+    """
+    Page through run history, newest first.
+    Pass the returned next_cursor back as cursor to fetch the following page.
+    """
+    try:
+        return run_store.query_runs(
+            status=status.value if status else None,
+            winner_variant_id=winner_variant_id,
+            winning_category=winning_category,
+            since=as_utc_naive(since),
+            until=as_utc_naive(until),
+            cursor=cursor,
+            limit=limit
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 @app.get("/api/run/{run_id}")
-async def get_run(run_id: str):
+async def get_run(run_id: str, request: Request):
     """Get complete run data including results and event log."""
-    run_data = run_store.get_run(run_id)
-    if not run_data:
+    await run_store.prefetch(run_id)
+    frozen = run_store.get_frozen(run_id, "run")
+    if frozen:
+        return cached_response(request, frozen)
+    
+    run_json = run_store.get_run_json(run_id)
+    if run_json is None:
         raise HTTPException(status_code=404, detail="Run not found")
     
-    return run_data
+    return Response(content=run_json, media_type="application/json", headers={"Cache-Control": "no-cache"})
 
 @app.get("/api/run/{run_id}/replay")
-async def get_replay_data(run_id: str):
+async def get_replay_data(run_id: str, request: Request):
     """Get event log for client-side replay."""
-    events = run_store.get_events(run_id)
+    await run_store.prefetch(run_id)
+    frozen = run_store.get_frozen(run_id, "replay")
+    if frozen:
+        return cached_response(request, frozen)
+    
+    events = run_store.get_encoded_events(run_id)
     if not events:
         raise HTTPException(status_code=404, detail="Run not found")
     
-    return {"events": events}
+    return Response(content=run_store.get_replay_json(run_id), media_type="application/json", headers={"Cache-Control": "no-cache"})
+
+@app.get("/api/metrics")
+async def get_metrics():
+    """Get operational counters for the run store and provider calls."""
+    metrics = {
+        "runs": run_store.get_stats(),
+        "optimizer": optimizer.status(),
+        "firehose": run_store.firehose.get_stats(),
+        "rate_limit": rate_limiter.get_stats(),
+        "streams": stream_tracker.get_stats()
+    }
+    
+    if optimizer.ready:
+        metrics["hedging"] = optimizer.get().hedging.get_stats()
+        metrics["lm_calls"] = optimizer.get().calls.get_stats()
+        metrics["input_cache"] = optimizer.get().input_cache.get_stats()
+        metrics["score_metrics"] = optimizer.get().scorer.metrics.get_stats()
+    
+    return metrics
+
+@app.get("/api/analytics")
+async def get_analytics():
+    """Get rolling per-variant win rate, score and latency statistics."""
+    return run_store.get_analytics()
+
+@app.get("/api/leaderboard")
+async def get_leaderboard(window: str = "all"):
+    """Rank variants across runs by mean score, then median latency (window: 5m, 1h or all)."""
+    try:
+        return {"window": window, "variants": run_store.get_variant_leaderboard(window)}
+    except KeyError:
+        raise HTTPException(status_code=400, detail="Unknown window")
+
+@app.get("/api/run/{run_id}/leaderboard")
+async def get_run_leaderboard(run_id: str):
+    """Get a run's scored variants ordered by score, then latency."""
+    await run_store.prefetch(run_id)
+    leaderboard = run_store.get_leaderboard(run_id)
+    if leaderboard is None:
+        raise HTTPException(status_code=404, detail="Run not found")
+    
+    return {"run_id": run_id, "variants": leaderboard}
 
 @app.get("/api/config")
 async def get_config():
@@ -165,27 +471,50 @@ class OptimizeRequest(BaseModel):
     prompts: List[str]
     task: str = "general_qa"
 
-@app.post("/api/optimize")
-async def optimize_prompts(request: OptimizeRequest):
+@app.post("/api/optimize", response_model=RunResponse)
+async def optimize_prompts(request: OptimizeRequest, background_tasks: BackgroundTasks, http_request: Request):
     """
     Optimize three prompt principles from the wise elders.
-    Used by the dungeon game.
+    Used by the dungeon game. Returns run_id immediately; progress streams
+    from /api/run/{run_id}/stream like any other run.
     """
+    enforce_rate_limit(http_request, "optimize")
+    
     try:
-        logger.info(f"Optimizing prompts for dungeon game: {len(request.prompts)} prompts")
+        run_id = run_store.create_run("\n".join(request.prompts), kind="dungeon")
         
-        # Run optimization
-        results = await dungeon_optimizer.optimize_prompts(
-            request.prompts, 
-            request.task
-        )
+        # Start background processing
+        background_tasks.add_task(process_dungeon_run, run_id, request.prompts, request.task)
         
-        logger.info(f"Optimization complete. Score: {results['score']}")
-        return results
+        logger.info(f"Created dungeon run {run_id} for {len(request.prompts)} prompts")
+        
+        return RunResponse(run_id=run_id)
         
     except Exception as e:
-        logger.error(f"Error optimizing prompts: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Optimization failed: {str(e)}")
+        logger.error(f"Error creating dungeon run: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to create run")
+
+async def process_dungeon_run(run_id: str, prompts: List[str], task: str):
+    """
+    Background task to evaluate the dungeon game prompts.
+    """
+    try:
+        run_store.update_run_status(run_id, RunStatus.PROCESSING)
+        
+        results = await dungeon_optimizer.optimize_prompts(prompts, task, run_id=run_id, run_store=run_store)
+        
+        run_store.update_run_status(run_id, RunStatus.COMPLETE)
+        logger.info(f"Completed dungeon run {run_id}. Score: {results['score']}")
+        
+    except Exception as e:
+        logger.error(f"Error optimizing prompts for run {run_id}: {str(e)}", exc_info=True)
+        # Event first: streams stop at the status change and must not miss it
+        run_store.add_event(run_id, {
+            "type": "Error",
+            "ts": time.time() * 1000,
+            "payload": {"error": str(e)}
+        })
+        run_store.update_run_status(run_id, RunStatus.ERROR)
 
 async def process_run(run_id: str):
     """
@@ -206,9 +535,10 @@ async def process_run(run_id: str):
         run_store.update_run_status(run_id, RunStatus.PROCESSING)
         logger.info(f"Updated run {run_id} status to PROCESSING")
         
-        # Run optimization
+        # Run optimization (waits for background initialization if still warming)
         logger.info(f"Starting optimization for run {run_id}")
-        await optimizer.optimize(run_id, input_text, run_store)
+        run_optimizer = optimizer.get() if optimizer.ready else await asyncio.to_thread(optimizer.get)
+        await run_optimizer.optimize(run_id, input_text, run_store)
         logger.info(f"Optimization completed for run {run_id}")
         
         # Mark as complete
@@ -217,12 +547,13 @@ async def process_run(run_id: str):
         
     except Exception as e:
         logger.error(f"Error processing run {run_id}: {str(e)}", exc_info=True)
-        run_store.update_run_status(run_id, RunStatus.ERROR)
+        # Event first: streams stop at the status change and must not miss it
         run_store.add_event(run_id, {
             "type": "Error",
             "ts": asyncio.get_event_loop().time() * 1000,
             "payload": {"error": str(e)}
         })
+        run_store.update_run_status(run_id, RunStatus.ERROR)
 
 if __name__ == "__main__":
     import uvicorn
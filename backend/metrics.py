@@ -0,0 +1,232 @@
+"""
+Registry of extra scoring metrics declared in config.yaml.
+Each metric runs inline, on a thread pool or on a process pool, and its cost
+is measured per call.
+"""
+
+from typing import Dict, Any, Callable, List, Tuple
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from difflib import SequenceMatcher
+from functools import lru_cache
+from pathlib import Path
+import asyncio
+import importlib
+import logging
+import multiprocessing
+import re
+import time
+
+logger = logging.getLogger(__name__)
+
+EXECUTORS = ("inline", "thread", "process")
+
+# Declaration keys that configure the runner rather than the metric itself
+RESERVED_KEYS = ("name", "executor", "weight")
+
+# Metric functions: (category, summary, input_text, params) -> value in [0, 1]
+METRICS: Dict[str, Callable[[str, str, str, Dict[str, Any]], float]] = {}
+
+def register_metric(name: str) -> Callable:
+    """Decorator adding a metric function to the registry under name."""
+    def decorator(fn: Callable) -> Callable:
+        METRICS[name] = fn
+        return fn
+    return decorator
+
+def resolve_metric(name: str) -> Callable:
+    """
+    Look up a registered metric, or import one given as "module:function".
+
+    Raises:
+        KeyError: If the metric is neither registered nor importable by path
+    """
+    if name in METRICS:
+        return METRICS[name]
+    if ":" in name:
+        module_name, attr = name.split(":", 1)
+        return getattr(importlib.import_module(module_name), attr)
+    raise KeyError(f"Unknown metric: {name}")
+
+def run_metric(name: str, category: str, summary: str, input_text: str, params: Dict[str, Any]) -> Tuple[float, float]:
+    """Evaluate a metric, returning (value, seconds spent). Runs in pool workers too."""
+    start = time.perf_counter()
+    value = float(resolve_metric(name)(category, summary, input_text, params))
+    return value, time.perf_counter() - start
+
+def _syllables(word: str) -> int:
+    """Vowel-group syllable estimate, ignoring a silent final e."""
+    groups = re.findall(r"[aeiouy]+", word.lower())
+    count = len(groups) - (1 if word.lower().endswith("e") and len(groups) > 1 else 0)
+    return max(1, count)
+
+@register_metric("readability")
+def readability(category: str, summary: str, input_text: str, params: Dict[str, Any]) -> float:
+    """Flesch reading ease of the summary, scaled from 0-100 to 0-1."""
+    words = re.findall(r"[A-Za-z']+", summary)
+    if not words:
+        return 0.0
+    sentences = max(1, len(re.findall(r"[.!?]+", summary)))
+    syllables = sum(_syllables(word) for word in words)
+    ease = 206.835 - 1.015 * len(words) / sentences - 84.6 * syllables / len(words)
+    return min(100.0, max(0.0, ease)) / 100.0
+
+@register_metric("reference_similarity")
+def reference_similarity(category: str, summary: str, input_text: str, params: Dict[str, Any]) -> float:
+    """
+    Best fuzzy match ratio between the summary and the reference summaries of
+    the predicted category (all references if the category has none).
+    references is a list, or a YAML path loaded once per process.
+    """
+    references = params.get("references") or []
+    if isinstance(references, str):
+        references = load_references(references)
+    candidates = [ref["summary"] for ref in references if ref["category"] == category.lower()]
+    candidates = candidates or [ref["summary"] for ref in references]
+    if not candidates:
+        return 0.0
+    text = summary.lower()
+    return max(SequenceMatcher(None, text, candidate.lower()).ratio() for candidate in candidates)
+
+@lru_cache(maxsize=None)
+def load_references(path: str) -> List[Dict[str, str]]:
+    """
+    Category and summary of each labelled example in a YAML file (relative to
+    backend/). Cached, so each process reads a file once; don't mutate the result.
+    """
+    import yaml
+
+    references_path = Path(path)
+    if not references_path.is_absolute():
+        references_path = Path(__file__).parent / references_path
+
+    with open(references_path, 'r') as f:
+        examples = yaml.safe_load(f) or []
+    return [{"category": example["category"].lower(), "summary": example["summary"]} for example in examples]
+
+def _load_worker_references(paths: Tuple[str, ...]) -> None:
+    """Process pool initializer: load reference files once per worker, not per call."""
+    for path in paths:
+        load_references(path)
+
+class MetricCost:
+    """Call counts and time spent for one metric."""
+
+    __slots__ = ("calls", "errors", "run_seconds", "wall_seconds")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.run_seconds = 0.0  # Executing the metric
+        self.wall_seconds = 0.0  # Including pool queueing and transfer
+
+class MetricRunner:
+    """
+    Evaluates the metrics declared under custom_metrics.metrics.
+
+    Inline metrics run on the calling thread (the event loop), so they should
+    be cheap. Thread and process metrics are submitted to lazily created pools
+    and awaited, so the event loop keeps serving streams while they run; all
+    of a variant's metrics run concurrently.
+
+    Metric names must be unique. Reference files are passed to workers by
+    path and loaded once per process, so calls don't pickle the references.
+    """
+
+    def __init__(self, metrics_config: Dict[str, Any]):
+        self.thread_workers = metrics_config.get("thread_workers", 4)
+        self.process_workers = metrics_config.get("process_workers", 2)
+        self.declarations: List[Tuple[str, str, Dict[str, Any]]] = []
+        self.weights: Dict[str, float] = {}
+
+        self._reference_paths: List[str] = []
+
+        for declaration in metrics_config.get("metrics") or []:
+            name = declaration["name"]
+            resolve_metric(name)
+            if name in self.weights:
+                raise ValueError(f"Metric {name} is declared more than once")
+            executor = declaration.get("executor", "inline")
+            if executor not in EXECUTORS:
+                raise ValueError(f"Metric {name}: executor must be one of {EXECUTORS}, got {executor!r}")
+
+            params = {key: value for key, value in declaration.items() if key not in RESERVED_KEYS}
+            if isinstance(params.get("references"), str):
+                # Load now so a bad path fails at startup; workers load it in their initializer
+                load_references(params["references"])
+                self._reference_paths.append(params["references"])
+
+            self.declarations.append((name, executor, params))
+            self.weights[name] = float(declaration.get("weight", 1.0))
+
+        self._costs = {name: MetricCost() for name in self.weights}
+        self._pools: Dict[str, Executor] = {}
+
+    def _pool(self, executor: str) -> Executor:
+        """The thread or process pool, created on first use."""
+        pool = self._pools.get(executor)
+        if pool is None:
+            if executor == "thread":
+                pool = ThreadPoolExecutor(max_workers=self.thread_workers, thread_name_prefix="metric")
+            else:
+                # spawn: forking a process that runs an event loop and threads is unsafe
+                pool = ProcessPoolExecutor(
+                    max_workers=self.process_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_load_worker_references,
+                    initargs=(tuple(self._reference_paths),)
+                )
+            self._pools[executor] = pool
+        return pool
+
+    async def evaluate(self, category: str, summary: str, input_text: str) -> Dict[str, float]:
+        """
+        Run every declared metric on one output.
+        A metric that raises scores 0.0 and is counted as an error.
+        """
+        loop = asyncio.get_running_loop()
+
+        async def evaluate_one(name: str, executor: str, params: Dict[str, Any]) -> float:
+            cost = self._costs[name]
+            start = time.perf_counter()
+            try:
+                if executor == "inline":
+                    value, run_seconds = run_metric(name, category, summary, input_text, params)
+                else:
+                    value, run_seconds = await loop.run_in_executor(
+                        self._pool(executor), run_metric, name, category, summary, input_text, params
+                    )
+            except Exception as e:
+                logger.warning(f"Metric {name} failed: {str(e)}")
+                cost.errors += 1
+                value, run_seconds = 0.0, time.perf_counter() - start
+
+            cost.calls += 1
+            cost.run_seconds += run_seconds
+            cost.wall_seconds += time.perf_counter() - start
+            return value
+
+        values = await asyncio.gather(*[
+            evaluate_one(name, executor, params) for name, executor, params in self.declarations
+        ])
+        return {name: value for (name, _, _), value in zip(self.declarations, values)}
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per-metric executor, weight, calls, errors and mean cost."""
+        stats = {}
+        for name, executor, _ in self.declarations:
+            cost = self._costs[name]
+            stats[name] = {
+                "executor": executor,
+                "weight": self.weights[name],
+                "calls": cost.calls,
+                "errors": cost.errors,
+                "mean_run_ms": cost.run_seconds * 1000 / cost.calls if cost.calls else None,
+                "mean_wall_ms": cost.wall_seconds * 1000 / cost.calls if cost.calls else None
+            }
+        return stats
+
+    def shutdown(self) -> None:
+        """Stop the worker pools."""
+        for pool in self._pools.values():
+            pool.shutdown(wait=False, cancel_futures=True)
+        self._pools.clear()
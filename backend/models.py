@@ -16,12 +16,20 @@ class RunStatus(str, Enum):
     COMPLETE = "complete"
     ERROR = "error"
 
+# Runs in these states produce no more events
+TERMINAL_STATUSES = (RunStatus.COMPLETE, RunStatus.ERROR)
+
 class EventType(str, Enum):
     """Types of events that can occur during a run."""
     VARIANT_START = "VariantStart"
+    VARIANT_PARTIAL = "VariantPartial"
     VARIANT_OUTPUT = "VariantOutput"
     VARIANT_SCORED = "VariantScored"
     LEADER_CHANGE = "LeaderChange"
+    CANDIDATE_START = "CandidateStart"
+    CANDIDATE_EVALUATED = "CandidateEvaluated"
+    CANDIDATE_SCORED = "CandidateScored"
+    PROMPTS_COMBINED = "PromptsCombined"
     RUN_COMPLETE = "RunComplete"
     ERROR = "Error"
 
@@ -50,6 +58,8 @@ class Variant(BaseModel):
     output: Optional[VariantOutput] = Field(None, description="Model output")
     latency_ms: Optional[int] = Field(None, description="Response latency in milliseconds")
     error: Optional[str] = Field(None, description="Error message if variant failed")
+    prompt_tokens: Optional[int] = Field(None, description="Tokens in the rendered prompt")
+    examples_dropped: Optional[int] = Field(None, description="Few-shot examples trimmed to fit the prompt budget")
 
 class ScoreComponents(BaseModel):
     """Individual scoring components."""
@@ -64,6 +74,7 @@ class Score(BaseModel):
     variant_id: str = Field(..., description="Variant this score belongs to")
     total: float = Field(..., description="Total weighted score")
     components: ScoreComponents = Field(..., description="Individual score components")
+    metrics: Dict[str, float] = Field(default_factory=dict, description="Values of registered custom metrics")
 
 class Event(BaseModel):
     """An event that occurred during optimization."""
@@ -74,6 +85,7 @@ class Event(BaseModel):
 class Run(BaseModel):
     """Complete run data."""
     run_id: str = Field(..., description="Unique identifier")
+    kind: str = Field("classify", description="Run type: classify (/api/run) or dungeon (/api/optimize)")
     input_text: str = Field(..., description="Original input text")
     created_at: datetime = Field(..., description="When the run was created")
     status: RunStatus = Field(RunStatus.PENDING, description="Current status")
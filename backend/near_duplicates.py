@@ -0,0 +1,161 @@
+"""
+Near-duplicate input lookup for reusing recent runs.
+MinHash signatures of character shingles of the normalized text, bucketed
+with LSH so a lookup only compares against inputs that share a band.
+"""
+
+from typing import Dict, Any, FrozenSet, List, Optional, Set, Tuple
+from collections import OrderedDict
+import threading
+import zlib
+
+import numpy as np
+
+from keyword_automaton import normalize_text
+
+# Modulus of the MinHash permutations; a * hash + b stays below 2**64
+PRIME = (1 << 31) - 1
+
+MODES = ("off", "shadow", "reuse")
+
+def shingles(text: str, size: int = 4) -> FrozenSet[int]:
+    """crc32 hashes of the character size-grams of the normalized text."""
+    normalized = normalize_text(text).strip()
+    if len(normalized) <= size:
+        grams = {normalized}
+    else:
+        grams = {normalized[i:i + size] for i in range(len(normalized) - size + 1)}
+    return frozenset(zlib.crc32(gram.encode("utf-8")) for gram in grams)
+
+def jaccard(a: FrozenSet[int], b: FrozenSet[int]) -> float:
+    """Exact Jaccard similarity of two shingle sets."""
+    return len(a & b) / len(a | b)
+
+class MinHasher:
+    """num_perm seeded universal hash permutations, so signatures are stable across processes."""
+
+    def __init__(self, num_perm: int = 64, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, PRIME, num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, PRIME, num_perm, dtype=np.uint64)
+
+    def signature(self, hashes: FrozenSet[int]) -> np.ndarray:
+        """Minimum of each permutation over the shingle hashes."""
+        values = np.fromiter(hashes, dtype=np.uint64, count=len(hashes))
+        return ((np.outer(self._a, values) + self._b[:, None]) % PRIME).min(axis=1)
+
+class NearDuplicateCache:
+    """
+    The most recent inputs, each with a cached value, looked up by Jaccard
+    similarity of their character shingles.
+
+    Signatures are split into bands of rows; inputs sharing any band are
+    candidates, and candidates are compared exactly on their shingle sets.
+    With 16 bands of 4 rows, pairs above ~0.6 similarity are almost always
+    candidates. Every lookup also counts whether it would have hit at each of
+    report_thresholds, so the threshold can be tuned from live traffic.
+
+    Modes: "off" skips lookups, "shadow" looks up and reports without reusing
+    anything, "reuse" lets callers reuse the matched value.
+    """
+
+    def __init__(self, cache_config: Dict[str, Any]):
+        self.mode = cache_config.get("mode", "off")
+        if self.mode not in MODES:
+            raise ValueError(f"input_cache.mode must be one of {MODES}, got {self.mode!r}")
+
+        self.threshold = cache_config.get("threshold", 0.8)
+        self.capacity = cache_config.get("capacity", 1000)
+        self.shingle_size = cache_config.get("shingle_size", 4)
+        self.report_thresholds = list(cache_config.get("report_thresholds", [0.5, 0.6, 0.7, 0.8, 0.9, 1.0]))
+
+        num_perm = cache_config.get("num_perm", 64)
+        self.bands = cache_config.get("bands", 16)
+        if num_perm % self.bands:
+            raise ValueError("input_cache.num_perm must be a multiple of input_cache.bands")
+        self.rows = num_perm // self.bands
+        self._hasher = MinHasher(num_perm)
+
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[int, Tuple[FrozenSet[int], List[bytes], Any]]" = OrderedDict()
+        self._buckets: List[Dict[bytes, Set[int]]] = [{} for _ in range(self.bands)]
+        self._next_id = 0
+
+        # Counters exposed through get_stats
+        self.lookups = 0
+        self.hits = 0
+        self._hits_at = [0] * len(self.report_thresholds)
+
+    def _keys(self, text: str) -> Tuple[FrozenSet[int], List[bytes]]:
+        """A text's shingle set and its LSH band keys."""
+        hashes = shingles(text, self.shingle_size)
+        signature = self._hasher.signature(hashes)
+        return hashes, [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def lookup(self, text: str) -> Tuple[float, Optional[Any]]:
+        """
+        Find the most similar recent input.
+
+        Returns:
+            (similarity of the best candidate, or 0.0 if no recent input
+            shares a band; its value if the similarity reaches threshold, else None)
+        """
+        hashes, keys = self._keys(text)
+
+        with self._lock:
+            candidates = set()
+            for bucket, key in zip(self._buckets, keys):
+                candidates.update(bucket.get(key, ()))
+
+            best_id, similarity = None, 0.0
+            for entry_id in candidates:
+                candidate_similarity = jaccard(hashes, self._entries[entry_id][0])
+                if candidate_similarity > similarity:
+                    best_id, similarity = entry_id, candidate_similarity
+
+            self.lookups += 1
+            for i, threshold in enumerate(self.report_thresholds):
+                if similarity >= threshold:
+                    self._hits_at[i] += 1
+
+            if best_id is None or similarity < self.threshold:
+                return similarity, None
+
+            self.hits += 1
+            self._entries.move_to_end(best_id)
+            return similarity, self._entries[best_id][2]
+
+    def add(self, text: str, value: Any) -> None:
+        """Remember an input and its value, evicting the least recently used input if full."""
+        hashes, keys = self._keys(text)
+
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (hashes, keys, value)
+            for bucket, key in zip(self._buckets, keys):
+                bucket.setdefault(key, set()).add(entry_id)
+
+            if len(self._entries) > self.capacity:
+                evicted_id, (_, evicted_keys, _) = self._entries.popitem(last=False)
+                for bucket, key in zip(self._buckets, evicted_keys):
+                    members = bucket[key]
+                    members.discard(evicted_id)
+                    if not members:
+                        del bucket[key]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Lookup counters, with the hit rate each reporting threshold would give."""
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "entries": len(self._entries),
+                "threshold": self.threshold,
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": self.hits / self.lookups if self.lookups else None,
+                "hit_rate_by_threshold": {
+                    str(threshold): (hits / self.lookups if self.lookups else None)
+                    for threshold, hits in zip(self.report_thresholds, self._hits_at)
+                }
+            }
@@ -3,11 +3,13 @@ DSPy-based prompt optimizer for the Live Optimizing Classifier.
 Manages multiple prompt variants and orchestrates the optimization process.
 """
 
+import dsp
 import dspy
+from dspy.signatures.signature import signature_to_template
 import asyncio
 import json
 import time
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Callable
 import logging
 
 from models import (
@@ -16,6 +18,10 @@ from models import (
 )
 from scoring import VariantScorer
 from config import get_api_key
+from providers import ProviderClient, LMCallTracker, split_completion
+from hedging import HedgePolicy
+from tokens import TokenCounter
+from near_duplicates import NearDuplicateCache
 
 logger = logging.getLogger(__name__)
 
@@ -25,6 +31,16 @@ class ClassifyAndSummarize(dspy.Signature):
     category: str = dspy.OutputField(desc="Classification category from allowed labels")
     summary: str = dspy.OutputField(desc="One-sentence summary (≤20 words, declarative)")
 
+class ClassifyProgram(dspy.Module):
+    """Single-step DSPy program over ClassifyAndSummarize; the unit that gets compiled."""
+    
+    def __init__(self):
+        super().__init__()
+        self.predict = dspy.Predict(ClassifyAndSummarize)
+    
+    def forward(self, text: str):
+        return self.predict(text=text)
+
 class DSPyOptimizer:
     """
     Manages DSPy prompt optimization with multiple variants.
@@ -34,8 +50,22 @@ class DSPyOptimizer:
     def __init__(self, config: Dict[str, Any]):
         self.config = config
         self.scorer = VariantScorer(config)
+        self.streaming = config.get("streaming", {})
+        self.provider_client = ProviderClient(config["provider"])
+        self.calls = LMCallTracker(config["provider"].get("max_thread_calls", 8))
+        self.hedging = HedgePolicy(config.get("hedging", {}))
+        self.tokens = TokenCounter(config["provider"]["model"])
+        self.prompt_budget = config.get("prompt_budget", {})
+        self.input_cache = NearDuplicateCache(config.get("input_cache", {}))
         self._setup_dspy()
         self._create_variants()
+        self._load_compiled_programs()
+        
+        # Few-shot examples double as labelled data for similarity-based label_match
+        if self.scorer.label_match_method == "similarity":
+            self.scorer.fit_label_similarity([
+                (text, category) for _, spec in self.variants for text, category, _ in spec["examples"]
+            ])
     
     def _setup_dspy(self) -> None:
         """Initialize DSPy with the configured LLM provider."""
@@ -120,6 +150,27 @@ class DSPyOptimizer:
             )
             self.variants.append((variant, spec))
     
+    def _load_compiled_programs(self) -> None:
+        """
+        Swap in compiled few-shot demos for variants that have a compiled artifact.
+        Compiled demos replace the variant's hand-written examples in the prompt.
+        """
+        from program_store import load_compiled_programs
+        
+        compiled = load_compiled_programs(self.config, ClassifyProgram)
+        if not compiled:
+            return
+        
+        version = compiled["manifest"]["version"]
+        for i, (variant, spec) in enumerate(self.variants):
+            program = compiled["programs"].get(variant.variant_id)
+            if program is None:
+                continue
+            
+            spec = {**spec, "demos": program.predict.demos, "compiled_version": version}
+            variant = variant.model_copy(update={"prompt_spec": f"{variant.prompt_spec} [compiled {version}]"})
+            self.variants[i] = (variant, spec)
+    
     async def optimize(self, run_id: str, input_text: str, run_store: Any) -> None:
         """
         Run the optimization process for a given input.
@@ -128,24 +179,52 @@ class DSPyOptimizer:
         logger.info(f"Starting optimization for run {run_id} with {len(self.variants)} variants")
         
         try:
+            # A near-duplicate of a recent input can reuse that run's variant outputs
+            similarity, reuse = None, None
+            if self.input_cache.mode != "off":
+                similarity, match = self.input_cache.lookup(input_text)
+                if match is not None and self.input_cache.mode == "reuse":
+                    reuse = match
+                    logger.info(f"Run {run_id} reuses outputs of run {match['run_id']} (similarity {similarity:.2f})")
+            
             # Process each variant
             variant_results = []
             
             for variant, spec in self.variants:
+                prompt = self._prepare_prompt(spec, input_text)
+                
                 # Emit variant start event
                 run_store.add_event(run_id, {
                     "type": EventType.VARIANT_START,
                     "ts": time.time() * 1000,
                     "payload": {
                         "variant_id": variant.variant_id,
-                        "prompt_spec": variant.prompt_spec
+                        "prompt_spec": variant.prompt_spec,
+                        "prompt_tokens": prompt["prompt_tokens"]
                     }
                 })
                 
+                # Stream partial outputs into the event log as they fill in
+                def on_partial(category: str, summary: Optional[str], variant_id: str = variant.variant_id) -> None:
+                    run_store.add_event(run_id, {
+                        "type": EventType.VARIANT_PARTIAL,
+                        "ts": time.time() * 1000,
+                        "payload": {
+                            "variant_id": variant_id,
+                            "category": category,
+                            "summary": summary
+                        }
+                    })
+                
                 # Execute variant with timeout
                 try:
-                    logger.info(f"Executing variant {variant.variant_id} for run {run_id}")
-                    result = await self._execute_variant(variant, spec, input_text)
+                    cached = reuse["variants"].get(variant.variant_id) if reuse else None
+                    if cached is not None:
+                        # No call was made, so there is no latency to record or rank by
+                        result = cached.model_copy(update={"latency_ms": None})
+                    else:
+                        logger.info(f"Executing variant {variant.variant_id} for run {run_id}")
+                        result = await self._execute_variant(variant, spec, input_text, on_partial=on_partial, prompt=prompt)
                     variant_results.append(result)
                     logger.info(f"Variant {variant.variant_id} completed with result: {result.output is not None}")
                     
@@ -160,13 +239,17 @@ class DSPyOptimizer:
                             "variant_id": variant.variant_id,
                             "output": result.output.model_dump() if result.output else None,
                             "latency_ms": result.latency_ms,
-                            "error": result.error
+                            "error": result.error,
+                            "prompt_tokens": result.prompt_tokens,
+                            "examples_dropped": result.examples_dropped,
+                            "cached": cached is not None
                         }
                     })
                     
                     # Score the variant if we got output
                     if result.output:
-                        score = self.scorer.score_variant(result, input_text)
+                        score = await self.scorer.score_variant_async(result, input_text)
+                        previous_leader = run_store.get_leader(run_id)
                         run_store.add_score(run_id, score)
                         
                         # Emit scoring event
@@ -180,14 +263,14 @@ class DSPyOptimizer:
                         })
                         
                         # Check if this is the new leader
-                        current_leader = self._get_current_leader(run_store, run_id)
-                        if current_leader != variant.variant_id:
+                        current_leader = run_store.get_leader(run_id)
+                        if current_leader != previous_leader:
                             run_store.add_event(run_id, {
                                 "type": EventType.LEADER_CHANGE,
                                 "ts": time.time() * 1000,
                                 "payload": {
-                                    "new_leader": variant.variant_id,
-                                    "previous_leader": current_leader
+                                    "new_leader": current_leader,
+                                    "previous_leader": previous_leader
                                 }
                             })
                 
@@ -196,7 +279,9 @@ class DSPyOptimizer:
                     result = Variant(
                         variant_id=variant.variant_id,
                         prompt_spec=variant.prompt_spec,
-                        error="Timeout"
+                        error="Timeout",
+                        prompt_tokens=prompt["prompt_tokens"],
+                        examples_dropped=prompt["examples_dropped"]
                     )
                     variant_results.append(result)
                     run_store.add_variant(run_id, result)
@@ -206,23 +291,33 @@ class DSPyOptimizer:
                     result = Variant(
                         variant_id=variant.variant_id,
                         prompt_spec=variant.prompt_spec,
-                        error=str(e)
+                        error=str(e),
+                        prompt_tokens=prompt["prompt_tokens"],
+                        examples_dropped=prompt["examples_dropped"]
                     )
                     variant_results.append(result)
                     run_store.add_variant(run_id, result)
             
-            # Determine winner
-            winner_id = self._select_winner(run_store, run_id)
+            # Determine winner: the leaderboard is ordered by score, then latency
+            winner_id = run_store.get_leader(run_id)
             if winner_id:
                 run_store.set_winner(run_id, winner_id)
             
+            # Remember freshly computed outputs for later near-duplicates
+            if self.input_cache.mode != "off" and reuse is None:
+                outputs = {result.variant_id: result for result in variant_results if result.output}
+                if outputs:
+                    self.input_cache.add(input_text, {"run_id": run_id, "variants": outputs})
+            
             # Emit completion event
             run_store.add_event(run_id, {
                 "type": EventType.RUN_COMPLETE,
                 "ts": time.time() * 1000,
                 "payload": {
                     "winner_variant_id": winner_id,
-                    "total_variants": len(variant_results)
+                    "total_variants": len(variant_results),
+                    "input_similarity": similarity,
+                    "reused_run_id": reuse["run_id"] if reuse else None
                 }
             })
             
@@ -237,57 +332,145 @@ class DSPyOptimizer:
             })
             raise
     
-    async def _execute_variant(self, variant: Variant, spec: Dict[str, Any], input_text: str) -> Variant:
-        """Execute a single variant with the given specification."""
+    async def run_instruction(self, instruction: str, input_text: str, variant_id: str = "custom") -> tuple:
+        """
+        Run a free-form instruction through the same LM path as the variants.
+        Returns the resulting (Variant, Score); timeouts become a zero score.
+        """
+        spec = {
+            "instruction": instruction,
+            "style": "custom",
+            "temperature": self.config["provider"]["temperature"][0]
+        }
+        variant = Variant(variant_id=variant_id, prompt_spec=instruction)
+        
+        try:
+            result = await self._execute_variant(variant, spec, input_text)
+        except asyncio.TimeoutError:
+            result = Variant(variant_id=variant_id, prompt_spec=instruction, error="Timeout")
+        
+        return result, await self.scorer.score_variant_async(result, input_text)
+    
+    def _build_context(self, spec: Dict[str, Any], input_text: str) -> str:
+        """Build the prompt context for a variant: labels, examples and instruction."""
+        labels_str = ", ".join(self.config["labels"])
+        context = f"Available categories: {labels_str}\n\n"
+        
+        # Add examples if specified (compiled demos take their place)
+        if spec.get("examples") and "demos" not in spec:
+            context += "Examples:\n"
+            for text, cat, summ in spec["examples"]:
+                context += f"Text: {text}\nCategory: {cat}\nSummary: {summ}\n\n"
+        
+        # Add instruction
+        context += f"Instructions: {spec['instruction']}\n\n"
+        context += f"Text to classify: {input_text}"
+        
+        return context
+    
+    def _prepare_prompt(self, spec: Dict[str, Any], input_text: str) -> Dict[str, Any]:
+        """
+        Build a variant's prompt context and count the tokens of the rendered prompt.
+        
+        With prompt_budget enabled, few-shot examples (or the compiled demos that
+        replace them) are dropped from the end of the list until the prompt fits
+        max_prompt_tokens. The instruction and input text are never trimmed.
+        
+        Args:
+            spec: Variant specification
+            input_text: Text to classify
+        
+        Returns:
+            Dict with the trimmed spec, its context, prompt_tokens and examples_dropped
+        """
+        key = "demos" if "demos" in spec else "examples"
+        shots = list(spec.get(key) or [])
+        max_tokens = self.prompt_budget.get("max_prompt_tokens") if self.prompt_budget.get("enabled") else None
+        
+        kept = len(shots)
+        while True:
+            trimmed = {**spec, key: shots[:kept]} if shots else spec
+            context = self._build_context(trimmed, input_text)
+            prompt_tokens = self.tokens.count(self._render_prompt(context, trimmed.get("demos")))
+            if max_tokens is None or prompt_tokens <= max_tokens or kept == 0:
+                break
+            kept -= 1
+        
+        return {
+            "spec": trimmed,
+            "context": context,
+            "prompt_tokens": prompt_tokens,
+            "examples_dropped": len(shots) - kept
+        }
+    
+    async def _execute_variant(
+        self,
+        variant: Variant,
+        spec: Dict[str, Any],
+        input_text: str,
+        on_partial: Optional[Callable[[str, Optional[str]], None]] = None,
+        prompt: Optional[Dict[str, Any]] = None
+    ) -> Variant:
+        """
+        Execute a single variant with the given specification.
+        
+        When streaming is enabled and on_partial is given, the provider's token
+        stream is consumed directly and on_partial receives (category, summary)
+        as the fields fill in. prompt is a _prepare_prompt result to reuse;
+        it is prepared here when not given.
+        """
         start_time = time.time()
+        usage = {}
         
         try:
-            logger.info(f"Creating predictor for variant {variant.variant_id}")
-            # Create a predictor with the variant's configuration
-            predictor = dspy.Predict(ClassifyAndSummarize)
-            
-            # Build the prompt context
-            labels_str = ", ".join(self.config["labels"])
-            context = f"Available categories: {labels_str}\n\n"
-            
-            # Add examples if specified
-            if "examples" in spec:
-                context += "Examples:\n"
-                for text, cat, summ in spec["examples"]:
-                    context += f"Text: {text}\nCategory: {cat}\nSummary: {summ}\n\n"
-            
-            # Add instruction
-            context += f"Instructions: {spec['instruction']}\n\n"
-            context += f"Text to classify: {input_text}"
-            
+            prompt = prompt or self._prepare_prompt(spec, input_text)
+            spec, context = prompt["spec"], prompt["context"]
+            usage = {"prompt_tokens": prompt["prompt_tokens"], "examples_dropped": prompt["examples_dropped"]}
             logger.info(f"Built context for variant {variant.variant_id}: {context[:100]}...")
             
             # Execute with timeout
             timeout = self.config["timeouts_ms"]["per_variant"] / 1000.0
             logger.info(f"Executing variant {variant.variant_id} with timeout {timeout}s")
             
-            result = await asyncio.wait_for(
-                asyncio.to_thread(predictor, text=context),
-                timeout=timeout
-            )
+            if self.streaming.get("enabled") and on_partial is not None:
+                output = await asyncio.wait_for(
+                    self.calls.track(self._stream_variant(context, spec, on_partial)),
+                    timeout=timeout
+                )
+            elif self.config["provider"].get("cancellable_calls", False):
+                # Async request: a timeout aborts the HTTP call instead of leaving it running
+                output = await asyncio.wait_for(
+                    self.hedging.run(lambda: self.calls.track(self._complete_variant(context, spec)), timeout),
+                    timeout=timeout
+                )
+            else:
+                logger.info(f"Creating predictor for variant {variant.variant_id}")
+                predictor = dspy.Predict(ClassifyAndSummarize)
+                predictor.demos = spec.get("demos", [])
+                
+                # Hedging (when enabled) races a backup call against a slow one
+                result = await asyncio.wait_for(
+                    self.hedging.run(lambda: self.calls.run_in_thread(predictor, text=context), timeout),
+                    timeout=timeout
+                )
+                logger.info(f"Raw result for variant {variant.variant_id}: {result}")
+                
+                # Parse the output
+                output = VariantOutput(
+                    category=result.category.strip(),
+                    summary=result.summary.strip()
+                )
             
             latency_ms = int((time.time() - start_time) * 1000)
             logger.info(f"Variant {variant.variant_id} completed in {latency_ms}ms")
-            logger.info(f"Raw result for variant {variant.variant_id}: {result}")
-            
-            # Parse the output
-            output = VariantOutput(
-                category=result.category.strip(),
-                summary=result.summary.strip()
-            )
-            
             logger.info(f"Parsed output for variant {variant.variant_id}: category={output.category}, summary={output.summary[:50]}...")
             
             return Variant(
                 variant_id=variant.variant_id,
                 prompt_spec=variant.prompt_spec,
                 output=output,
-                latency_ms=latency_ms
+                latency_ms=latency_ms,
+                **usage
             )
             
         except asyncio.TimeoutError:
@@ -300,34 +483,48 @@ class DSPyOptimizer:
                 variant_id=variant.variant_id,
                 prompt_spec=variant.prompt_spec,
                 latency_ms=latency_ms,
-                error=str(e)
+                error=str(e),
+                **usage
             )
     
-    def _get_current_leader(self, run_store: Any, run_id: str) -> Optional[str]:
-        """Get the current leading variant based on scores."""
-        scores = run_store.get_run(run_id).get("scores", [])
-        if not scores:
-            return None
-        
-        # Find highest scoring variant
-        best_score = max(scores, key=lambda s: s["total"])
-        return best_score["variant_id"]
+    def _render_prompt(self, context: str, demos: Optional[List[Any]] = None) -> str:
+        """Render the ClassifyAndSummarize prompt exactly as dspy.Predict would."""
+        template = signature_to_template(ClassifyAndSummarize)
+        return template(dsp.Example(demos=demos or [], text=context))
+    
+    async def _complete_variant(self, context: str, spec: Dict[str, Any]) -> VariantOutput:
+        """Run the variant as a single cancellable provider request."""
+        completion = await self.provider_client.complete(
+            self._render_prompt(context, spec.get("demos")),
+            spec["temperature"]
+        )
+        category, summary = split_completion(completion)
+        return VariantOutput(category=category, summary=summary or "")
     
-    def _select_winner(self, run_store: Any, run_id: str) -> Optional[str]:
-        """Select the winning variant based on scores and latency."""
-        run_data = run_store.get_run(run_id)
-        scores = run_data.get("scores", [])
-        variants = run_data.get("variants", [])
+    async def _stream_variant(
+        self,
+        context: str,
+        spec: Dict[str, Any],
+        on_partial: Callable[[str, Optional[str]], None]
+    ) -> VariantOutput:
+        """Consume the provider token stream, reporting partial fields as they change."""
+        prompt = self._render_prompt(context, spec.get("demos"))
+        interval = self.streaming.get("partial_interval_ms", 50) / 1000.0
         
-        if not scores:
-            return None
+        completion = ""
+        last_emitted = None
+        last_emit_time = 0.0
         
-        # Sort by score (descending), then by latency (ascending)
-        def sort_key(score_data):
-            variant_id = score_data["variant_id"]
-            variant = next((v for v in variants if v["variant_id"] == variant_id), None)
-            latency = variant.get("latency_ms", float('inf')) if variant else float('inf')
-            return (-score_data["total"], latency)
+        async for delta in self.provider_client.stream(prompt, spec["temperature"]):
+            completion += delta
+            partial = split_completion(completion)
+            
+            # Throttle partial events so a fast stream doesn't flood the event log
+            now = time.time()
+            if partial[0] and partial != last_emitted and now - last_emit_time >= interval:
+                on_partial(*partial)
+                last_emitted = partial
+                last_emit_time = now
         
-        sorted_scores = sorted(scores, key=sort_key)
-        return sorted_scores[0]["variant_id"] if sorted_scores else None
\ No newline at end of file
+        category, summary = split_completion(completion)
+        return VariantOutput(category=category, summary=summary or "")
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Profile backend cold start.
+Reports import time of main (what uvicorn waits for before listening),
+its slowest imports, and how long the deferred optimizer takes to build.
+"""
+
+import subprocess
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).parent
+
+def profile_imports(top: int = 10):
+    """Run `python -X importtime -c "import main"` and summarize the result."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=BACKEND_DIR, capture_output=True, text=True
+    )
+
+    # Lines look like: "import time:   self [us] | cumulative | imported package"
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if len(name) - len(name.lstrip()) <= 3:  # main and its direct imports
+            imports.append((int(cumulative), name.strip()))
+
+    imports.sort(reverse=True)
+    print("⏱  import main (server can't listen before this finishes)")
+    for cumulative, name in imports[:top]:
+        print(f"  {cumulative / 1000:8.1f} ms  {name}")
+
+def profile_optimizer_build():
+    """Time the deferred DSPy + provider setup in a fresh process."""
+    script = (
+        "import time, main\n"
+        "start = time.time()\n"
+        "main.optimizer.get()\n"
+        "print(f'{(time.time() - start) * 1000:.1f}')\n"
+    )
+    result = subprocess.run([sys.executable, "-c", script], cwd=BACKEND_DIR, capture_output=True, text=True)
+    if result.returncode != 0:
+        print(f"\n❌ Optimizer build failed:\n{result.stderr.strip().splitlines()[-1]}")
+        return
+    print(f"\n🧠 Deferred optimizer build (runs in the background after startup): {result.stdout.strip()} ms")
+
+if __name__ == "__main__":
+    profile_imports()
+    profile_optimizer_build()
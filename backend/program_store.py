@@ -0,0 +1,119 @@
+"""
+Versioned on-disk artifacts for compiled DSPy programs.
+Written once by compile_programs.py, loaded by DSPyOptimizer at startup.
+"""
+
+from typing import Dict, Any, List, Optional
+from datetime import datetime
+from pathlib import Path
+import hashlib
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+
+def _artifact_root(config: Dict[str, Any]) -> Path:
+    """Resolve the artifact directory (relative paths are relative to the backend)."""
+    root = Path(config.get("compiled_programs", {}).get("dir", "compiled"))
+    return root if root.is_absolute() else Path(__file__).parent / root
+
+def dataset_hash(dataset: List[Dict[str, Any]]) -> str:
+    """Stable hash of a training dataset, recorded in the manifest."""
+    return hashlib.sha256(json.dumps(dataset, sort_keys=True).encode("utf-8")).hexdigest()
+
+def save_compiled_programs(
+    config: Dict[str, Any],
+    programs: Dict[str, Any],
+    dataset: List[Dict[str, Any]],
+    teleprompter: Dict[str, Any]
+) -> Path:
+    """
+    Save compiled programs as a new version directory.
+
+    Args:
+        config: Application config (provider and artifact settings)
+        programs: variant_id -> compiled dspy.Module
+        dataset: The training examples the programs were compiled on
+        teleprompter: Name and parameters of the DSPy optimizer used
+
+    Returns:
+        Path of the new version directory
+    """
+    digest = dataset_hash(dataset)
+    created_at = datetime.utcnow()
+    version = f"{created_at.strftime('%Y%m%dT%H%M%S')}-{digest[:8]}"
+
+    version_dir = _artifact_root(config) / version
+    version_dir.mkdir(parents=True, exist_ok=False)
+
+    for variant_id, program in programs.items():
+        program.save(str(version_dir / f"{variant_id}.json"))
+
+    manifest = {
+        "version": version,
+        "created_at": created_at.isoformat(),
+        "provider": config["provider"]["name"],
+        "model": config["provider"]["model"],
+        "dataset_sha256": digest,
+        "dataset_size": len(dataset),
+        "teleprompter": teleprompter,
+        "variants": sorted(programs)
+    }
+    with open(version_dir / MANIFEST_NAME, 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    return version_dir
+
+def find_version(config: Dict[str, Any]) -> Optional[Path]:
+    """
+    Find the configured artifact version directory.
+    "latest" picks the most recently created version that has a manifest.
+    """
+    root = _artifact_root(config)
+    version = config.get("compiled_programs", {}).get("version", "latest")
+
+    if version != "latest":
+        version_dir = root / version
+        return version_dir if (version_dir / MANIFEST_NAME).exists() else None
+
+    if not root.exists():
+        return None
+
+    versions = sorted(path.parent for path in root.glob(f"*/{MANIFEST_NAME}"))
+    return versions[-1] if versions else None
+
+def load_compiled_programs(config: Dict[str, Any], program_factory: Any) -> Dict[str, Any]:
+    """
+    Load compiled programs from the configured version.
+
+    Args:
+        config: Application config
+        program_factory: Callable returning a fresh, uncompiled program to load state into
+
+    Returns:
+        Dict with "manifest" and "programs" (variant_id -> program), or {} if none exist
+    """
+    version_dir = find_version(config)
+    if version_dir is None:
+        logger.info("No compiled programs found; using hand-written variant examples")
+        return {}
+
+    with open(version_dir / MANIFEST_NAME, 'r') as f:
+        manifest = json.load(f)
+
+    if manifest["model"] != config["provider"]["model"]:
+        logger.warning(
+            f"Compiled programs {manifest['version']} were built for {manifest['model']}, "
+            f"running with {config['provider']['model']}"
+        )
+
+    programs = {}
+    for variant_id in manifest["variants"]:
+        program = program_factory()
+        program.load(str(version_dir / f"{variant_id}.json"))
+        programs[variant_id] = program
+
+    logger.info(f"Loaded compiled programs {manifest['version']} for variants {manifest['variants']}")
+    return {"manifest": manifest, "programs": programs}
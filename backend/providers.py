@@ -0,0 +1,174 @@
+"""
+Async provider clients for direct LM calls.
+Used where the blocking DSPy predictor falls short: token streaming and
+requests that must be aborted on timeout.
+"""
+
+from typing import Dict, Any, AsyncIterator, Awaitable, Callable, TypeVar
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import logging
+import threading
+
+from config import get_api_key
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+class ProviderClient:
+    """
+    Thin async wrapper around the configured provider SDK.
+    Sends an already rendered prompt and yields the completion text.
+    """
+
+    def __init__(self, provider_config: Dict[str, Any], max_tokens: int = 200):
+        self.name = provider_config["name"].lower()
+        self.model = provider_config["model"]
+        self.max_tokens = max_tokens
+        self._client = None
+
+    def _get_client(self) -> Any:
+        """Create the async SDK client on first use."""
+        if self._client is None:
+            if self.name == "openai":
+                from openai import AsyncOpenAI
+                self._client = AsyncOpenAI(api_key=get_api_key("openai"))
+            elif self.name == "anthropic":
+                from anthropic import AsyncAnthropic
+                self._client = AsyncAnthropic(api_key=get_api_key("anthropic"))
+            else:
+                raise ValueError(f"Unsupported provider: {self.name}")
+
+        return self._client
+
+    async def stream(self, prompt: str, temperature: float) -> AsyncIterator[str]:
+        """Yield completion text deltas as the provider produces them."""
+        client = self._get_client()
+        messages = [{"role": "user", "content": prompt}]
+
+        if self.name == "openai":
+            response = await client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=self.max_tokens,
+                stream=True
+            )
+            async for chunk in response:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        else:
+            response = await client.completions.create(
+                model=self.model,
+                prompt=self._anthropic_prompt(prompt),
+                temperature=temperature,
+                max_tokens_to_sample=self.max_tokens,
+                stream=True
+            )
+            async for chunk in response:
+                if chunk.completion:
+                    yield chunk.completion
+
+    async def complete(self, prompt: str, temperature: float) -> str:
+        """
+        Request a full completion.
+        Cancelling the awaiting task closes the HTTP request, so nothing keeps running.
+        """
+        client = self._get_client()
+        messages = [{"role": "user", "content": prompt}]
+        
+        if self.name == "openai":
+            response = await client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=self.max_tokens
+            )
+            return response.choices[0].message.content or ""
+        
+        response = await client.completions.create(
+            model=self.model,
+            prompt=self._anthropic_prompt(prompt),
+            temperature=temperature,
+            max_tokens_to_sample=self.max_tokens
+        )
+        return response.completion
+
+    @staticmethod
+    def _anthropic_prompt(prompt: str) -> str:
+        """Wrap a prompt in the Human/Assistant turns of the Text Completions API (anthropic 0.7.x has no Messages API)."""
+        from anthropic import HUMAN_PROMPT, AI_PROMPT
+        return f"{HUMAN_PROMPT} {prompt}{AI_PROMPT}"
+
+class LMCallTracker:
+    """
+    Tracks in-flight LM calls and what happens to them on timeout.
+    
+    Async calls are truly cancelled. Blocking calls run on a dedicated executor:
+    queued ones are cancelled before they start, but one already running in a
+    thread can't be interrupted and is counted as orphaned until it returns.
+    """
+    
+    def __init__(self, max_threads: int = 8):
+        self._executor = ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix="lm-call")
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.cancelled = 0
+        self.orphaned = 0
+        self.orphaned_total = 0
+    
+    async def track(self, call: Awaitable[T]) -> T:
+        """Await a cancellable async call, counting it while in flight."""
+        with self._lock:
+            self.in_flight += 1
+        try:
+            return await call
+        except asyncio.CancelledError:
+            with self._lock:
+                self.cancelled += 1
+            raise
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+    
+    async def run_in_thread(self, fn: Callable[..., T], **kwargs: Any) -> T:
+        """Run a blocking call on the LM executor, releasing it if cancelled."""
+        future = self._executor.submit(fn, **kwargs)
+        try:
+            return await self.track(asyncio.wrap_future(future))
+        except asyncio.CancelledError:
+            # A queued call never starts; a running one is left to finish on its own
+            if not future.cancel():
+                with self._lock:
+                    self.orphaned += 1
+                    self.orphaned_total += 1
+                future.add_done_callback(self._orphan_finished)
+            raise
+    
+    def _orphan_finished(self, _future: Any) -> None:
+        with self._lock:
+            self.orphaned -= 1
+    
+    def get_stats(self) -> Dict[str, int]:
+        """Get call counters."""
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "cancelled": self.cancelled,
+                "orphaned": self.orphaned,
+                "orphaned_total": self.orphaned_total
+            }
+
+def split_completion(completion: str) -> tuple:
+    """
+    Split a (possibly partial) DSPy-format completion into category and summary.
+
+    The rendered prompt ends with "Category:", so the completion starts with the
+    category value and continues with a "Summary:" field. Summary is None until
+    that field has started.
+    """
+    head, separator, tail = completion.partition("Summary:")
+    category = head.strip().split("\n", 1)[0].strip()
+    summary = tail.strip() if separator else None
+    return category, summary
@@ -0,0 +1,124 @@
+"""
+Per-client rate limiting for expensive endpoints.
+Token buckets checked in O(1), with idle buckets expired lazily.
+"""
+
+from typing import Dict, Any, Callable, Optional, Tuple
+from collections import Counter, OrderedDict
+import ipaddress
+import os
+import threading
+import time
+
+class RateLimiter:
+    """
+    One token bucket per (route, client). A bucket holds up to burst tokens
+    and refills at per_minute / 60 tokens a second; each request takes one.
+
+    Buckets are kept in least recently used order. A bucket idle long enough
+    to refill completely is the same as a new one, so each check drops such
+    buckets from the idle end, and memory is bounded by the clients seen
+    within one refill period. Limits are per process.
+
+    Clients are keyed by IP, or by API key when key is "api_key" and the key
+    is in the allow-list read from the api_keys_env environment variable
+    (comma-separated). Behind a reverse proxy, list it in trusted_proxies so
+    the client IP is taken from X-Forwarded-For instead of the proxy's address.
+    """
+
+    def __init__(self, limit_config: Dict[str, Any], clock: Callable[[], float] = time.monotonic):
+        self.enabled = limit_config.get("enabled", False)
+        self.key = limit_config.get("key", "ip")
+        api_keys = os.environ.get(limit_config.get("api_keys_env", "RATE_LIMIT_API_KEYS"), "")
+        self.api_keys = frozenset(key.strip() for key in api_keys.split(",") if key.strip())
+        self.trusted_proxies = [ipaddress.ip_network(proxy) for proxy in limit_config.get("trusted_proxies", [])]
+        self._limits: Dict[str, Tuple[float, float]] = {
+            route: (limit["per_minute"] / 60.0, float(limit.get("burst", 1)))
+            for route, limit in limit_config.get("routes", {}).items()
+        }
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._buckets: "OrderedDict[Tuple[str, str], Tuple[float, float]]" = OrderedDict()
+
+        # Counters exposed through get_stats
+        self.allowed = Counter()
+        self.limited = Counter()
+        self.expired = 0
+
+    def _trusted(self, address: str) -> bool:
+        """Whether an address belongs to a trusted proxy."""
+        try:
+            ip = ipaddress.ip_address(address)
+        except ValueError:
+            return False
+        return any(ip in network for network in self.trusted_proxies)
+
+    def client_ip(self, peer: str, forwarded_for: Optional[str]) -> str:
+        """
+        The client's address. Requests from trusted proxies are attributed to
+        the last X-Forwarded-For hop that isn't itself a trusted proxy; earlier
+        hops were written by the client and can't be trusted.
+        """
+        if not forwarded_for or not self._trusted(peer):
+            return peer
+        hops = [hop.strip() for hop in forwarded_for.split(",") if hop.strip()]
+        for hop in reversed(hops):
+            if not self._trusted(hop):
+                return hop
+        return hops[0] if hops else peer
+
+    def client_key(self, peer: str, forwarded_for: Optional[str] = None, api_key: Optional[str] = None) -> str:
+        """Bucket key for a request: its API key if keyed by allow-listed API keys, else its IP."""
+        if self.key == "api_key" and api_key and api_key in self.api_keys:
+            return f"key:{api_key}"
+        return f"ip:{self.client_ip(peer, forwarded_for)}"
+
+    def check(self, route: str, client: str) -> float:
+        """
+        Take a token for one request.
+
+        Returns:
+            0.0 if the request is allowed, else seconds until a token is available
+        """
+        limit = self._limits.get(route)
+        if not self.enabled or limit is None:
+            return 0.0
+
+        rate, burst = limit
+        now = self._clock()
+        key = (route, client)
+
+        with self._lock:
+            self._expire_idle(now)
+
+            tokens, updated = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                self.allowed[route] += 1
+                return 0.0
+
+            self._buckets[key] = (tokens, now)
+            self.limited[route] += 1
+            return (1 - tokens) / rate
+
+    def _expire_idle(self, now: float) -> None:
+        """Drop least recently used buckets that have refilled to burst."""
+        while self._buckets:
+            (route, _), (tokens, updated) = next(iter(self._buckets.items()))
+            rate, burst = self._limits[route]
+            if tokens + (now - updated) * rate < burst:
+                break
+            self._buckets.popitem(last=False)
+            self.expired += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Allowed and limited request counts per route, and live buckets."""
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "clients": len(self._buckets),
+                "allowed": dict(self.allowed),
+                "limited": dict(self.limited),
+                "expired_buckets": self.expired
+            }
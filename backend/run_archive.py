@@ -0,0 +1,103 @@
+"""
+Append-only on-disk archive for runs evicted from memory.
+Each run is stored as a gzip-compressed JSON body in a segment file, with an
+offset index so any archived run can be read back with a single seek.
+"""
+
+from typing import Dict, Optional, Tuple
+from pathlib import Path
+import gzip
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+INDEX_NAME = "index.tsv"
+
+class RunArchive:
+    """
+    Segmented archive of completed runs.
+
+    Segments are append-only files rolled over at segment_bytes. index.tsv
+    holds one "run_id, segment, offset, length" line per run and is loaded
+    into memory on startup; data is written before its index line, so a crash
+    can only lose the last run, never corrupt earlier ones. Segments are
+    flushed but not fsynced; the archive is a cache of history, not a ledger.
+    """
+
+    def __init__(self, directory: str, segment_bytes: int = 64 * 1024 * 1024):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.segment_bytes = segment_bytes
+        self._lock = threading.Lock()
+        self._offsets: Dict[str, Tuple[int, int, int]] = {}
+        self._segment = 0
+        self._load_index()
+
+    def _segment_path(self, segment: int) -> Path:
+        """Path of a numbered segment file."""
+        return self.directory / f"segment-{segment:06d}.log"
+
+    def _load_index(self) -> None:
+        """Read the offset index written by previous processes."""
+        index_path = self.directory / INDEX_NAME
+        if index_path.exists():
+            with open(index_path, 'r') as f:
+                for line in f:
+                    parts = line.rstrip("\n").split("\t")
+                    if len(parts) != 4:
+                        continue  # Torn final line after a crash
+                    run_id, segment, offset, length = parts
+                    self._offsets[run_id] = (int(segment), int(offset), int(length))
+                    self._segment = max(self._segment, int(segment))
+
+        logger.info(f"Run archive at {self.directory} holds {len(self._offsets)} runs")
+
+    def __contains__(self, run_id: str) -> bool:
+        """Whether a run is archived (no disk access)."""
+        return run_id in self._offsets
+
+    def __len__(self) -> int:
+        """Number of archived runs."""
+        return len(self._offsets)
+
+    def append(self, run_id: str, body: bytes) -> None:
+        """Compress and append a run's JSON body."""
+        data = gzip.compress(body, mtime=0)
+
+        with self._lock:
+            if run_id in self._offsets:
+                return
+
+            path = self._segment_path(self._segment)
+            if path.exists() and path.stat().st_size + len(data) > self.segment_bytes:
+                self._segment += 1
+                path = self._segment_path(self._segment)
+
+            with open(path, 'ab') as f:
+                offset = f.tell()
+                f.write(data)
+
+            with open(self.directory / INDEX_NAME, 'a') as f:
+                f.write(f"{run_id}\t{self._segment}\t{offset}\t{len(data)}\n")
+
+            self._offsets[run_id] = (self._segment, offset, len(data))
+
+    def read(self, run_id: str) -> Optional[bytes]:
+        """Read and decompress an archived run's JSON body, or None if absent."""
+        location = self._offsets.get(run_id)
+        if location is None:
+            return None
+
+        segment, offset, length = location
+        with open(self._segment_path(segment), 'rb') as f:
+            f.seek(offset)
+            return gzip.decompress(f.read(length))
+
+    def get_stats(self) -> Dict[str, int]:
+        """Archive size for metrics."""
+        with self._lock:
+            return {
+                "archived_runs": len(self._offsets),
+                "segments": self._segment + 1 if self._offsets else 0
+            }
@@ -0,0 +1,137 @@
+"""
+Secondary indexes over stored runs for filtered, cursor-paginated history queries.
+"""
+
+from typing import Dict, List, Optional, Any, Tuple
+from array import array
+from bisect import bisect_left, insort
+from datetime import datetime
+
+from run_records import to_micros
+
+# Fields that can be filtered on, as stored in the index
+INDEXED_FIELDS = ("status", "winner_variant_id", "winning_category")
+
+class RunIndex:
+    """
+    Posting lists of run sequence numbers, kept sorted, per (field, value).
+
+    Runs get an increasing sequence number on creation, so sequence order is
+    creation order and doubles as the pagination cursor. A query bisects to the
+    cursor in the smallest matching posting list and walks backwards, so it
+    touches roughly one page of runs instead of the whole store.
+    Not thread-safe; callers hold the run store lock.
+    """
+
+    def __init__(self):
+        self._next_seq = 0
+        self._seq: Dict[str, int] = {}
+        self._run_ids: Dict[int, str] = {}
+        self._all: List[int] = []
+        self._created = array("q")  # Parallel to _all: creation time in microseconds, monotonic
+        self._values: Dict[str, Dict[str, Any]] = {}
+        self._postings: Dict[Tuple[str, Any], List[int]] = {}
+
+    def add(self, run_id: str, created_us: int) -> None:
+        """Index a newly created run."""
+        seq = self._next_seq
+        self._next_seq += 1
+
+        self._seq[run_id] = seq
+        self._run_ids[seq] = run_id
+        self._all.append(seq)
+        self._created.append(created_us)
+        self._values[run_id] = {}
+
+    def set(self, run_id: str, field: str, value: Any) -> None:
+        """Move a run to the posting list of its new field value."""
+        values = self._values.get(run_id)
+        if values is None or values.get(field) == value:
+            return
+
+        seq = self._seq[run_id]
+        if field in values:
+            self._discard((field, values[field]), seq)
+        values[field] = value
+        if value is not None:
+            insort(self._postings.setdefault((field, value), []), seq)
+
+    def remove(self, run_id: str) -> None:
+        """Drop an evicted run from every index."""
+        seq = self._seq.pop(run_id, None)
+        if seq is None:
+            return
+
+        del self._run_ids[seq]
+        position = bisect_left(self._all, seq)
+        del self._all[position]
+        del self._created[position]
+        for field, value in self._values.pop(run_id).items():
+            self._discard((field, value), seq)
+
+    def _first_seq_at(self, when: datetime) -> int:
+        """Sequence number of the first run created at or after a time."""
+        position = bisect_left(self._created, to_micros(when))
+        return self._all[position] if position < len(self._all) else self._next_seq
+
+    def _discard(self, key: Tuple[str, Any], seq: int) -> None:
+        """Remove a sequence number from a posting list."""
+        postings = self._postings.get(key)
+        if not postings:
+            return
+
+        position = bisect_left(postings, seq)
+        if position < len(postings) and postings[position] == seq:
+            del postings[position]
+        if not postings:
+            del self._postings[key]
+
+    def query(
+        self,
+        filters: Dict[str, Any],
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        cursor: Optional[int] = None,
+        limit: int = 20
+    ) -> Tuple[List[str], Optional[int]]:
+        """
+        Find runs matching every filter, newest first.
+
+        Args:
+            filters: field -> required value, for fields in INDEXED_FIELDS
+            since: Only runs created at or after this time
+            until: Only runs created before this time
+            cursor: Only runs older than this cursor (from a previous page)
+            limit: Page size
+
+        Returns:
+            (run IDs, cursor for the next page or None when exhausted)
+        """
+        filters = {field: value for field, value in filters.items() if value is not None}
+
+        # Time range and cursor both become bounds on the sequence number
+        low = 0 if since is None else self._first_seq_at(since)
+        high = self._next_seq if until is None else self._first_seq_at(until)
+        if cursor is not None:
+            high = min(high, cursor)
+
+        # Walk the most selective posting list, checking the remaining filters per run
+        candidates = self._all
+        for field, value in filters.items():
+            postings = self._postings.get((field, value), [])
+            if len(postings) < len(candidates):
+                candidates = postings
+
+        run_ids = []
+        position = bisect_left(candidates, high) - 1
+        while position >= 0 and candidates[position] >= low:
+            seq = candidates[position]
+            run_id = self._run_ids[seq]
+            values = self._values[run_id]
+            if all(values.get(field) == value for field, value in filters.items()):
+                if len(run_ids) == limit:
+                    return run_ids, self._seq[run_ids[-1]]
+                run_ids.append(run_id)
+            position -= 1
+
+        return run_ids, None
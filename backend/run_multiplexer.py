@@ -0,0 +1,98 @@
+"""
+Multiplexed run event streaming.
+Tracks one connection's subscriptions to many runs and batches their new
+events into a single frame per tick.
+"""
+
+from typing import Dict, Any, Iterable, List, Optional
+import json
+
+from models import TERMINAL_STATUSES
+
+class RunSubscriptions:
+    """
+    A connection's run subscriptions and how many events of each it has sent.
+
+    poll() builds one frame for everything new since the previous tick:
+    {"runs": [{"run_id": ..., "events": [...], "done": bool}, ...]}.
+    Events are spliced in from the store's pre-encoded bytes.
+    """
+
+    def __init__(self, max_subscriptions: int = 100):
+        self.max_subscriptions = max_subscriptions
+        self._cursors: Dict[str, int] = {}
+
+    @property
+    def run_ids(self) -> List[str]:
+        """Currently subscribed run IDs."""
+        return list(self._cursors)
+
+    def subscribe(self, run_ids: Iterable[str]) -> List[str]:
+        """
+        Start following runs from their first event.
+        Returns the run IDs rejected because the subscription limit was reached.
+        """
+        rejected = []
+        for run_id in run_ids:
+            if run_id in self._cursors:
+                continue
+            if len(self._cursors) >= self.max_subscriptions:
+                rejected.append(run_id)
+                continue
+            self._cursors[run_id] = 0
+        return rejected
+
+    def unsubscribe(self, run_ids: Iterable[str]) -> None:
+        """Stop following runs."""
+        for run_id in run_ids:
+            self._cursors.pop(run_id, None)
+
+    def handle_message(self, message: Any) -> Optional[bytes]:
+        """
+        Apply a client message ({"action": "subscribe" | "unsubscribe", "run_ids": [...]}).
+        Returns an error frame for invalid messages or rejected subscriptions.
+        """
+        action = message.get("action") if isinstance(message, dict) else None
+        run_ids = message.get("run_ids") if isinstance(message, dict) else None
+        if action not in ("subscribe", "unsubscribe") or not isinstance(run_ids, list):
+            return json.dumps({"error": "Expected {\"action\": \"subscribe\"|\"unsubscribe\", \"run_ids\": [...]}"}).encode("utf-8")
+
+        if action == "unsubscribe":
+            self.unsubscribe(run_ids)
+            return None
+
+        rejected = self.subscribe(str(run_id) for run_id in run_ids)
+        if rejected:
+            return json.dumps({"error": "Subscription limit reached", "run_ids": rejected}).encode("utf-8")
+        return None
+
+    def poll(self, run_store: Any) -> Optional[bytes]:
+        """
+        Collect new events for every subscribed run into one frame.
+        Finished and unknown runs are reported once with done=true and dropped.
+        Returns None when there is nothing to send.
+        """
+        parts = []
+        for run_id, sent in list(self._cursors.items()):
+            # Read status first so no event added after it can be missed
+            status = run_store.get_status(run_id)
+            events = run_store.get_encoded_events(run_id, sent)
+            prefix = b'{"run_id":' + json.dumps(run_id).encode("utf-8")
+
+            if events is None:
+                parts.append(prefix + b',"events":[],"done":true,"error":"Run not found"}')
+                del self._cursors[run_id]
+                continue
+
+            done = status in TERMINAL_STATUSES
+            if events or done:
+                parts.append(
+                    prefix + b',"events":[' + b",".join(events) + b'],"done":' + (b"true" if done else b"false") + b"}"
+                )
+                self._cursors[run_id] = sent + len(events)
+            if done:
+                del self._cursors[run_id]
+
+        if not parts:
+            return None
+        return b'{"runs":[' + b",".join(parts) + b"]}"
@@ -0,0 +1,248 @@
+"""
+Compact in-memory records for stored runs.
+RunStore keeps these instead of pydantic models; models are built only when
+a run is returned from the API.
+"""
+
+from typing import Dict, List, Optional, Any, Tuple
+from array import array
+from bisect import insort
+from datetime import datetime, timedelta
+import sys
+
+from models import Run, Variant, VariantOutput, Score, ScoreComponents, TaskConfig, RunStatus
+
+COMPONENTS = tuple(ScoreComponents.model_fields)
+
+EPOCH = datetime(1970, 1, 1)
+
+# Label tuples shared by every run created with the same config
+_labels: Dict[Tuple[str, ...], Tuple[str, ...]] = {}
+
+def intern_labels(labels: List[str]) -> Tuple[str, ...]:
+    """One shared tuple per distinct label list."""
+    key = tuple(sys.intern(label) for label in labels)
+    return _labels.setdefault(key, key)
+
+def _intern(value: Optional[str]) -> Optional[str]:
+    """sys.intern that passes None through."""
+    return sys.intern(value) if value is not None else None
+
+def to_micros(when: datetime) -> int:
+    """Naive UTC datetime -> integer microseconds since the epoch."""
+    delta = when - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+def from_micros(micros: int) -> datetime:
+    """Integer microseconds since the epoch -> naive UTC datetime."""
+    return EPOCH + timedelta(microseconds=micros)
+
+class VariantRecord:
+    """A variant's result. Ids, prompt specs and categories are interned."""
+
+    __slots__ = (
+        "variant_id", "prompt_spec", "category", "summary", "latency_ms", "error",
+        "prompt_tokens", "examples_dropped"
+    )
+
+    def __init__(
+        self,
+        variant_id: str,
+        prompt_spec: str,
+        category: Optional[str] = None,
+        summary: Optional[str] = None,
+        latency_ms: Optional[int] = None,
+        error: Optional[str] = None,
+        prompt_tokens: Optional[int] = None,
+        examples_dropped: Optional[int] = None
+    ):
+        self.variant_id = sys.intern(variant_id)
+        self.prompt_spec = sys.intern(prompt_spec)
+        self.category = _intern(category)
+        self.summary = summary
+        self.latency_ms = latency_ms
+        self.error = error
+        self.prompt_tokens = prompt_tokens
+        self.examples_dropped = examples_dropped
+
+    @classmethod
+    def from_model(cls, variant: Variant) -> "VariantRecord":
+        """Compact a pydantic Variant."""
+        output = variant.output
+        return cls(
+            variant.variant_id,
+            variant.prompt_spec,
+            output.category if output else None,
+            output.summary if output else None,
+            variant.latency_ms,
+            variant.error,
+            variant.prompt_tokens,
+            variant.examples_dropped
+        )
+
+    def to_model(self) -> Variant:
+        """Rebuild the pydantic Variant."""
+        output = VariantOutput(category=self.category, summary=self.summary) if self.category is not None else None
+        return Variant(
+            variant_id=self.variant_id,
+            prompt_spec=self.prompt_spec,
+            output=output,
+            latency_ms=self.latency_ms,
+            error=self.error,
+            prompt_tokens=self.prompt_tokens,
+            examples_dropped=self.examples_dropped
+        )
+
+class ScoreColumns:
+    """
+    A run's scores as columns: interned variant ids, and totals and
+    components packed into double arrays.
+    """
+
+    __slots__ = ("variant_ids", "totals", "components", "metrics")
+
+    def __init__(self):
+        self.variant_ids: List[str] = []
+        self.totals = array("d")
+        self.components = array("d")  # len(COMPONENTS) values per score
+        self.metrics: List[Optional[Dict[str, float]]] = []  # None unless custom metrics are configured
+
+    def __len__(self) -> int:
+        return len(self.variant_ids)
+
+    def append(self, score: Score) -> None:
+        """Add a pydantic Score as a row."""
+        self.variant_ids.append(sys.intern(score.variant_id))
+        self.totals.append(score.total)
+        self.components.extend(getattr(score.components, name) for name in COMPONENTS)
+        self.metrics.append(score.metrics or None)
+
+    def to_models(self) -> List[Score]:
+        """Rebuild the pydantic Scores, in insertion order."""
+        width = len(COMPONENTS)
+        return [
+            Score(
+                variant_id=variant_id,
+                total=self.totals[i],
+                components=ScoreComponents(**dict(zip(COMPONENTS, self.components[i * width:(i + 1) * width]))),
+                metrics=self.metrics[i] or {}
+            )
+            for i, variant_id in enumerate(self.variant_ids)
+        ]
+
+class RunRecord:
+    """Everything RunStore keeps about a run except its encoded event log."""
+
+    __slots__ = (
+        "run_id", "kind", "input_text", "created_us", "status",
+        "variants", "scores", "leaderboard", "winner_variant_id", "labels", "summary_required"
+    )
+
+    def __init__(
+        self,
+        run_id: str,
+        kind: str,
+        input_text: str,
+        created_us: int,
+        status: RunStatus,
+        labels: Tuple[str, ...],
+        summary_required: bool = True
+    ):
+        self.run_id = run_id
+        self.kind = sys.intern(kind)
+        self.input_text = input_text
+        self.created_us = created_us
+        self.status = status
+        self.variants: List[VariantRecord] = []
+        self.scores = ScoreColumns()
+        # (-total, latency_ms, score index, variant_id), best first
+        self.leaderboard: List[Tuple[float, float, int, str]] = []
+        self.winner_variant_id: Optional[str] = None
+        self.labels = labels
+        self.summary_required = summary_required
+
+    @property
+    def created_at(self) -> datetime:
+        """Creation time as a naive UTC datetime."""
+        return from_micros(self.created_us)
+
+    @classmethod
+    def from_model(cls, run: Run) -> "RunRecord":
+        """Compact a pydantic Run (its event log is not kept)."""
+        record = cls(
+            run.run_id,
+            run.kind,
+            run.input_text,
+            to_micros(run.created_at),
+            run.status,
+            intern_labels(run.task_config.labels),
+            run.task_config.summary_required
+        )
+        record.variants = [VariantRecord.from_model(variant) for variant in run.variants]
+        for score in run.scores:
+            record.add_score(score)
+        record.winner_variant_id = _intern(run.winner_variant_id)
+        return record
+
+    def to_model(self) -> Run:
+        """Pydantic Run without its event log (which is stored pre-encoded)."""
+        return Run(
+            run_id=self.run_id,
+            kind=self.kind,
+            input_text=self.input_text,
+            created_at=self.created_at,
+            status=self.status,
+            variants=[variant.to_model() for variant in self.variants],
+            scores=self.scores.to_models(),
+            winner_variant_id=self.winner_variant_id,
+            task_config=TaskConfig(labels=list(self.labels), summary_required=self.summary_required)
+        )
+
+    def add_score(self, score: Score) -> None:
+        """Store a score and rank it by (score desc, latency asc)."""
+        # The scored variant was normally added last, so this finds it immediately
+        latency = next(
+            (variant.latency_ms for variant in reversed(self.variants) if variant.variant_id == score.variant_id),
+            None
+        )
+        insort(self.leaderboard, (
+            -score.total,
+            latency if latency is not None else float("inf"),
+            len(self.scores),
+            sys.intern(score.variant_id)
+        ))
+        self.scores.append(score)
+
+    def leader(self) -> Optional[str]:
+        """The best-ranked variant so far."""
+        return self.leaderboard[0][3] if self.leaderboard else None
+
+    def ranking(self) -> List[Dict[str, Any]]:
+        """The leaderboard, best first."""
+        return [
+            {
+                "variant_id": variant_id,
+                "total": -negative_total,
+                "latency_ms": latency if latency != float("inf") else None
+            }
+            for negative_total, latency, _, variant_id in self.leaderboard
+        ]
+
+    def winning_category(self) -> Optional[str]:
+        """Category output by the winning variant, if any."""
+        for variant in self.variants:
+            if variant.variant_id == self.winner_variant_id:
+                return variant.category
+        return None
+
+    def summary(self) -> Dict[str, Any]:
+        """Lightweight run listing entry (no variants or event log)."""
+        return {
+            "run_id": self.run_id,
+            "kind": self.kind,
+            "input_text": self.input_text,
+            "created_at": self.created_at.isoformat(),
+            "status": self.status.value,
+            "winner_variant_id": self.winner_variant_id,
+            "winning_category": self.winning_category()
+        }
@@ -1,12 +1,35 @@
 """
 In-memory storage for optimization runs.
 Manages run data, events, and provides thread-safe access.
+Runs are kept as compact records (run_records.py); pydantic models are only
+built when a run is returned from the API.
 """
 
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Tuple
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import asyncio
+import logging
+import sys
 import threading
 from datetime import datetime
-from models import Run, Event, RunStatus, TaskConfig, create_run_id, create_event, EventType
+from analytics import RunAnalytics
+from event_bus import EventBus
+from http_cache import FrozenBody
+from run_index import RunIndex
+from run_archive import RunArchive
+from run_records import RunRecord, VariantRecord, intern_labels, to_micros
+from models import Run, Event, RunStatus, create_run_id
+
+logger = logging.getLogger(__name__)
+
+# Evicted runs in these states are spilled to the archive; others are dropped
+ARCHIVED_STATUSES = (RunStatus.COMPLETE, RunStatus.ERROR)
+
+# Run kinds whose variants feed the cross-run analytics and leaderboard;
+# dungeon candidates (c1...c4) aren't comparable with the classifier variants
+ANALYTICS_KINDS = ("classify",)
 
 class RunStore:
     """
@@ -14,34 +37,118 @@ class RunStore:
     Stores run data and events with efficient access patterns.
     """
     
-    def __init__(self):
-        self._runs: Dict[str, Run] = {}
+    def __init__(self, archive: Optional[RunArchive] = None, faulted_cache_size: int = 16):
+        self._runs: Dict[str, RunRecord] = {}
+        self._encoded_events: Dict[str, List[bytes]] = {}  # Wire bytes, encoded once per event
+        self._frozen: Dict[str, Dict[str, FrozenBody]] = {}  # Cached bodies of completed runs
+        self._index = RunIndex()  # Secondary indexes for query_runs
+        self._status_counts: Counter = Counter()
+        self.analytics = RunAnalytics()  # Rolling per-variant stats
+        self.firehose = EventBus()  # Every run's events, for /api/events
+        self._labels = None  # Task labels, read from config on first use
+        self._archive = archive  # Where evicted runs go, if configured
+        self._faulted: "OrderedDict[str, Tuple[RunRecord, List[bytes], Optional[Dict[str, FrozenBody]]]]" = OrderedDict()
+        self._faulted_cache_size = faulted_cache_size
+        # Evicted runs waiting to be written to the archive, readable meanwhile
+        self._spilling: Dict[str, Tuple[RunRecord, List[bytes], Optional[Dict[str, FrozenBody]]]] = {}
+        # Archive writes happen on one background thread, in eviction order
+        self._spill_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="run-archive") if archive is not None else None
         self._lock = threading.RLock()
         self._max_runs = 100  # Keep last 100 runs in memory
     
-    def create_run(self, input_text: str) -> str:
+    def _new_record(self, input_text: str, kind: str = "classify") -> RunRecord:
+        """Build a fresh pending run record for the given input."""
+        # Task config (could be made configurable per run)
+        if self._labels is None:
+            from config import load_config
+            self._labels = intern_labels(load_config()["labels"])
+        
+        return RunRecord(
+            run_id=create_run_id(),
+            kind=kind,
+            input_text=input_text,
+            created_us=to_micros(datetime.utcnow()),
+            status=RunStatus.PENDING,
+            labels=self._labels
+        )
+    
+    def _new_run(self, input_text: str, kind: str = "classify") -> Run:
+        """Build a fresh pending Run for the given input."""
+        return self._new_record(input_text, kind).to_model()
+    
+    def _lookup(
+        self,
+        run_id: str,
+        archived: Optional[Tuple[RunRecord, List[bytes], Optional[Dict[str, FrozenBody]]]] = None
+    ) -> Optional[Tuple[RunRecord, List[bytes]]]:
+        """
+        Find a run and its encoded events in memory. Call with the lock held;
+        archived is the _fault_in result fetched before taking it.
+        """
+        run = self._runs.get(run_id)
+        if run:
+            return run, self._encoded_events[run_id]
+        
+        entry = self._spilling.get(run_id) or archived
+        return entry[:2] if entry else None
+    
+    def _fault_in(self, run_id: str) -> Optional[Tuple[RunRecord, List[bytes], Optional[Dict[str, FrozenBody]]]]:
+        """
+        Get an evicted run: one still being written to the archive, or one read
+        back into a small LRU cache that sits beside the hot runs.
+        Call without the lock held; disk reads and decompression happen outside it.
+        """
+        with self._lock:
+            if run_id in self._runs:
+                return None
+            if run_id in self._spilling:
+                return self._spilling[run_id]
+            if run_id in self._faulted:
+                self._faulted.move_to_end(run_id)
+                return self._faulted[run_id]
+            if self._archive is None or run_id not in self._archive:
+                return None
+        
+        body = self._archive.read(run_id)
+        model = Run.model_validate_json(body)
+        encoded = [event.model_dump_json().encode("utf-8") for event in model.event_log]
+        frozen = None
+        if model.status == RunStatus.COMPLETE:
+            frozen = {
+                "run": FrozenBody(body),
+                "replay": FrozenBody(b'{"events":[' + b",".join(encoded) + b"]}")
+            }
+        
+        entry = (RunRecord.from_model(model), encoded, frozen)
+        
+        with self._lock:
+            self._faulted[run_id] = entry
+            if len(self._faulted) > self._faulted_cache_size:
+                self._faulted.popitem(last=False)
+        return entry
+    
+    async def prefetch(self, run_id: str) -> None:
+        """Fault an evicted run in from the archive on a worker thread, so later reads stay in memory."""
+        if self._archive is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self._fault_in, run_id)
+    
+    def _to_model(self, run: RunRecord, encoded: List[bytes]) -> Run:
+        """Build the pydantic Run, including its decoded event log."""
+        model = run.to_model()
+        model.event_log = [Event.model_validate_json(event) for event in encoded]
+        return model
+    
+    def create_run(self, input_text: str, kind: str = "classify") -> str:
         """Create a new run and return its ID."""
         with self._lock:
-            run_id = create_run_id()
-            
-            # Create task config (could be made configurable per run)
-            from config import load_config
-            config = load_config()
-            
-            task_config = TaskConfig(
-                labels=config["labels"],
-                summary_required=True
-            )
-            
-            run = Run(
-                run_id=run_id,
-                input_text=input_text,
-                created_at=datetime.utcnow(),
-                status=RunStatus.PENDING,
-                task_config=task_config
-            )
+            run = self._new_record(input_text, kind)
+            run_id = run.run_id
             
             self._runs[run_id] = run
+            self._encoded_events[run_id] = []
+            self._index.add(run_id, run.created_us)
+            self._index.set(run_id, "status", run.status.value)
+            self._status_counts[run.status.value] += 1
             
             # Clean up old runs if we exceed max
             self._cleanup_old_runs()
@@ -50,93 +157,291 @@ class RunStore:
     
     def get_run(self, run_id: str) -> Optional[Dict[str, Any]]:
         """Get complete run data as dictionary."""
+        archived = self._fault_in(run_id)
         with self._lock:
-            run = self._runs.get(run_id)
-            if not run:
+            found = self._lookup(run_id, archived)
+            if not found:
+                return None
+            
+            return self._to_model(*found).model_dump()
+    
+    def get_run_json(self, run_id: str) -> Optional[bytes]:
+        """
+        Get complete run data as JSON bytes.
+        The event log is spliced in from the pre-encoded events instead of re-serialized.
+        """
+        archived = self._fault_in(run_id)
+        with self._lock:
+            found = self._lookup(run_id, archived)
+            if not found:
                 return None
             
-            return run.model_dump()
+            return self._run_json(*found)
+    
+    @staticmethod
+    def _run_json(run: RunRecord, encoded: List[bytes]) -> bytes:
+        """A run's JSON body with its pre-encoded event log spliced in."""
+        head = run.to_model().model_dump_json(exclude={"event_log"}).encode("utf-8")
+        return head[:-1] + b',"event_log":[' + b",".join(encoded) + b"]}"
+    
+    def get_replay_json(self, run_id: str) -> Optional[bytes]:
+        """Get the replay body ({"events": [...]}) as JSON bytes."""
+        encoded = self.get_encoded_events(run_id)
+        if encoded is None:
+            return None
+        
+        return b'{"events":[' + b",".join(encoded) + b"]}"
+    
+    def get_frozen(self, run_id: str, view: str) -> Optional[FrozenBody]:
+        """
+        Get the precomputed body of a completed run.
+        view is "run" or "replay"; returns None until the run is COMPLETE.
+        """
+        archived = self._fault_in(run_id)
+        with self._lock:
+            frozen = self._frozen.get(run_id)
+            if frozen is None and run_id not in self._runs:
+                entry = self._spilling.get(run_id) or archived
+                frozen = entry[2] if entry else None
+            return frozen[view] if frozen else None
+    
+    def get_status(self, run_id: str) -> Optional[RunStatus]:
+        """Get the status of a run without serializing it."""
+        archived = self._fault_in(run_id)
+        with self._lock:
+            found = self._lookup(run_id, archived)
+            return found[0].status if found else None
     
     def run_exists(self, run_id: str) -> bool:
         """Check if a run exists."""
         with self._lock:
-            return run_id in self._runs
+            return (
+                run_id in self._runs
+                or run_id in self._spilling
+                or (self._archive is not None and run_id in self._archive)
+            )
     
     def update_run_status(self, run_id: str, status: RunStatus) -> None:
         """Update the status of a run."""
         with self._lock:
             if run_id in self._runs:
+                self._status_counts[self._runs[run_id].status.value] -= 1
+                self._status_counts[status.value] += 1
                 self._runs[run_id].status = status
+                self._index.set(run_id, "status", status.value)
+                
+                # Completed runs are immutable: encode, compress and hash them once
+                if status == RunStatus.COMPLETE:
+                    self._frozen[run_id] = {
+                        "run": FrozenBody(self.get_run_json(run_id)),
+                        "replay": FrozenBody(self.get_replay_json(run_id))
+                    }
     
     def add_variant(self, run_id: str, variant: Any) -> None:
         """Add a variant to a run."""
         with self._lock:
             if run_id in self._runs:
-                self._runs[run_id].variants.append(variant)
+                self._runs[run_id].variants.append(VariantRecord.from_model(variant))
+                if self._runs[run_id].kind in ANALYTICS_KINDS:
+                    self.analytics.record_variant(variant)
     
     def add_score(self, run_id: str, score: Any) -> None:
         """Add a score to a run."""
         with self._lock:
             if run_id in self._runs:
-                self._runs[run_id].scores.append(score)
+                self._runs[run_id].add_score(score)
+                if self._runs[run_id].kind in ANALYTICS_KINDS:
+                    self.analytics.record_score(score)
+                self._index_winner(self._runs[run_id])
+    
+    def get_leader(self, run_id: str) -> Optional[str]:
+        """Get the best variant so far by (score desc, latency asc), in O(1)."""
+        with self._lock:
+            run = self._runs.get(run_id)
+            return run.leader() if run else None
+    
+    def get_leaderboard(self, run_id: str) -> Optional[List[Dict[str, Any]]]:
+        """Get a run's scored variants, best first. Returns None if the run doesn't exist."""
+        archived = self._fault_in(run_id)
+        with self._lock:
+            found = self._lookup(run_id, archived)
+            return found[0].ranking() if found else None
+    
+    def get_variant_leaderboard(self, window: str = "all") -> List[Dict[str, Any]]:
+        """Rank variants across runs by mean score, then median latency."""
+        with self._lock:
+            return self.analytics.get_leaderboard(window)
     
     def set_winner(self, run_id: str, variant_id: str) -> None:
         """Set the winning variant for a run."""
         with self._lock:
             if run_id in self._runs:
-                self._runs[run_id].winner_variant_id = variant_id
+                self._runs[run_id].winner_variant_id = sys.intern(variant_id)
+                if self._runs[run_id].kind in ANALYTICS_KINDS:
+                    self.analytics.record_win(variant_id)
+                self._index_winner(self._runs[run_id])
+    
+    def _index_winner(self, run: RunRecord) -> None:
+        """Keep the winner indexes in step with the run."""
+        self._index.set(run.run_id, "winner_variant_id", run.winner_variant_id)
+        self._index.set(run.run_id, "winning_category", run.winning_category())
     
     def add_event(self, run_id: str, event_data: Dict[str, Any]) -> None:
         """Add an event to a run's event log."""
         with self._lock:
             if run_id in self._runs:
-                event = Event(**event_data)
-                self._runs[run_id].event_log.append(event)
+                # Validated once on the way in and kept only as wire bytes
+                encoded = Event(**event_data).model_dump_json().encode("utf-8")
+                self._encoded_events[run_id].append(encoded)
+                self.firehose.publish(run_id, encoded)
+    
+    def sync_firehose(self) -> None:
+        """Publish events added by other workers to the firehose; this store publishes in add_event."""
     
     def get_events(self, run_id: str) -> List[Dict[str, Any]]:
         """Get all events for a run."""
+        archived = self._fault_in(run_id)
         with self._lock:
-            run = self._runs.get(run_id)
-            if not run:
+            found = self._lookup(run_id, archived)
+            if not found:
                 return []
             
-            return [event.model_dump() for event in run.event_log]
+            return [Event.model_validate_json(event).model_dump() for event in found[1]]
+    
+    def get_encoded_events(self, run_id: str, start: int = 0) -> Optional[List[bytes]]:
+        """
+        Get pre-encoded JSON bytes for a run's events from index start onwards.
+        Returns None if the run doesn't exist.
+        """
+        archived = self._fault_in(run_id)
+        with self._lock:
+            found = self._lookup(run_id, archived)
+            if not found:
+                return None
+            
+            return found[1][start:]
     
     def get_latest_runs(self, limit: int = 10) -> List[Dict[str, Any]]:
         """Get the most recent runs."""
         with self._lock:
-            runs = list(self._runs.values())
-            runs.sort(key=lambda r: r.created_at, reverse=True)
-            return [run.model_dump() for run in runs[:limit]]
+            run_ids, _ = self._index.query({}, limit=limit)
+            return [self._to_model(self._runs[run_id], self._encoded_events[run_id]).model_dump() for run_id in run_ids]
     
-    def _cleanup_old_runs(self) -> None:
-        """Remove old runs if we exceed the maximum."""
-        if len(self._runs) <= self._max_runs:
-            return
+    def query_runs(
+        self,
+        status: Optional[str] = None,
+        winner_variant_id: Optional[str] = None,
+        winning_category: Optional[str] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        cursor: Optional[str] = None,
+        limit: int = 20
+    ) -> Dict[str, Any]:
+        """
+        Page through run history, newest first.
+        
+        Args:
+            status: Only runs with this status
+            winner_variant_id: Only runs won by this variant
+            winning_category: Only runs whose winning output has this category
+            since: Only runs created at or after this time
+            until: Only runs created before this time
+            cursor: next_cursor from the previous page
+            limit: Page size
         
-        # Sort by creation time and keep only the most recent
-        runs = list(self._runs.values())
-        runs.sort(key=lambda r: r.created_at, reverse=True)
+        Returns:
+            {"runs": [run summaries], "next_cursor": str or None}
         
-        # Keep only the most recent runs
-        to_keep = runs[:self._max_runs]
-        keep_ids = {run.run_id for run in to_keep}
+        Raises:
+            ValueError: If the cursor is malformed
+        """
+        filters = {
+            "status": status,
+            "winner_variant_id": winner_variant_id,
+            "winning_category": winning_category
+        }
         
-        # Remove old runs
-        self._runs = {run_id: run for run_id, run in self._runs.items() if run_id in keep_ids}
+        with self._lock:
+            run_ids, next_cursor = self._index.query(
+                filters, since, until, int(cursor) if cursor else None, limit
+            )
+            return {
+                "runs": [self._runs[run_id].summary() for run_id in run_ids],
+                "next_cursor": str(next_cursor) if next_cursor is not None else None
+            }
+    
+    def _cleanup_old_runs(self) -> None:
+        """
+        Remove old runs if we exceed the maximum.
+        Finished runs are handed to the archive thread; they stay readable from
+        _spilling until written, so no disk I/O happens under the lock.
+        """
+        # Runs are inserted in creation order, so the oldest is always first
+        while len(self._runs) > self._max_runs:
+            run_id = next(iter(self._runs))
+            run = self._runs.pop(run_id)
+            encoded = self._encoded_events.pop(run_id)
+            frozen = self._frozen.pop(run_id, None)
+            self._index.remove(run_id)
+            self._status_counts[run.status.value] -= 1
+            
+            if self._archive is not None and run.status in ARCHIVED_STATUSES:
+                self._spilling[run_id] = (run, encoded, frozen)
+                self._spill_executor.submit(self._spill, run_id)
+    
+    def _spill(self, run_id: str) -> None:
+        """Serialize, compress and append an evicted run to the archive (archive thread)."""
+        run, encoded, frozen = self._spilling[run_id]
+        try:
+            body = frozen["run"].encodings["identity"] if frozen else self._run_json(run, encoded)
+            self._archive.append(run_id, body)
+        except Exception as e:
+            logger.error(f"Failed to archive run {run_id}: {str(e)}")
+        finally:
+            with self._lock:
+                del self._spilling[run_id]
+    
+    def flush_archive(self) -> None:
+        """Wait until every evicted run handed to the archive thread has been written."""
+        if self._spill_executor is not None:
+            self._spill_executor.submit(lambda: None).result()
+    
+    def get_analytics(self) -> Dict[str, Any]:
+        """Get rolling per-variant statistics (5m, 1h and all time)."""
+        with self._lock:
+            return self.analytics.get_analytics()
     
     def get_stats(self) -> Dict[str, Any]:
         """Get statistics about stored runs."""
         with self._lock:
-            total_runs = len(self._runs)
-            status_counts = {}
-            
-            for run in self._runs.values():
-                status = run.status.value
-                status_counts[status] = status_counts.get(status, 0) + 1
-            
-            return {
-                "total_runs": total_runs,
-                "status_counts": status_counts,
+            stats = {
+                "total_runs": len(self._runs),
+                "status_counts": {status: count for status, count in self._status_counts.items() if count},
                 "max_runs": self._max_runs
-            }
\ No newline at end of file
+            }
+            if self._archive is not None:
+                stats["archive"] = self._archive.get_stats()
+            return stats
+
+def create_run_store(store_config: Dict[str, Any]) -> RunStore:
+    """
+    Create the configured run store.
+    The sqlite backend lets several uvicorn workers share runs and event streams.
+    """
+    backend = store_config.get("backend", "memory")
+    
+    if backend == "memory":
+        archive_dir = store_config.get("archive_dir")
+        archive = None
+        if archive_dir:
+            # Relative paths are relative to the backend, not the working directory
+            archive_path = Path(archive_dir)
+            if not archive_path.is_absolute():
+                archive_path = Path(__file__).parent / archive_path
+            archive = RunArchive(str(archive_path), store_config.get("archive_segment_mb", 64) * 1024 * 1024)
+        return RunStore(archive)
+    if backend == "sqlite":
+        from sqlite_run_store import SqliteRunStore
+        return SqliteRunStore(store_config["path"], store_config.get("retention_runs", 100000))
+    
+    raise ValueError(f"Unsupported run store backend: {backend}")
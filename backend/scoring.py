@@ -5,13 +5,57 @@ Implements rule-based scoring without LLM calls for fast, consistent evaluation.
 
 import re
 import json
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Tuple
 import logging
 
 from models import Variant, Score, ScoreComponents
+from keyword_automaton import KeywordAutomaton
+from metrics import MetricRunner
 
 logger = logging.getLogger(__name__)
 
+# Trigger phrases per intent, matched as whole words after normalization
+# (lowercase, punctuation collapsed to spaces). "other" is the fallback.
+DEFAULT_INTENT_LEXICON = {
+    "billing": [
+        "bill", "billing", "charge", "payment", "invoice", "refund", "cost", "price", "fee",
+        "double charge", "double charged", "doublecharge", "doublecharged",
+        "money", "dollar", "amount", "subscription", "plan"
+    ],
+    "technical": [
+        "bug", "error", "crash", "broken", "not work", "notwork", "issue", "problem",
+        "login", "app", "website", "connection",
+        "technical", "tech", "system", "server", "down", "slow"
+    ],
+    "cancellation": [
+        "cancel", "stop", "end", "terminate", "quit", "unsubscribe", "delete account", "deleteaccount",
+        "don t want", "dont want", "no longer", "nolonger", "remove"
+    ],
+    "urgent": [
+        "urgent", "emergency", "asap", "immediately", "now", "critical", "important",
+        "help me", "helpme", "need help", "needhelp", "stuck", "locked out", "lockedout"
+    ]
+}
+
+def load_intent_lexicon(config: Dict[str, Any]) -> Dict[str, List[str]]:
+    """
+    Load the intent lexicon: intent_lexicon_path (a YAML file of label -> phrases)
+    takes precedence over an inline intent_lexicon, then the built-in default.
+    """
+    path = config.get("intent_lexicon_path")
+    if path:
+        import yaml
+        from pathlib import Path
+        
+        lexicon_path = Path(path)
+        if not lexicon_path.is_absolute():
+            lexicon_path = Path(__file__).parent / lexicon_path
+        
+        with open(lexicon_path, 'r') as f:
+            return yaml.safe_load(f)
+    
+    return config.get("intent_lexicon") or DEFAULT_INTENT_LEXICON
+
 class VariantScorer:
     """
     Deterministic scorer for variant outputs.
@@ -23,26 +67,18 @@ class VariantScorer:
         self.weights = config["weights"]
         self.labels = set(config["labels"])
         
-        # Intent detection patterns
-        self.intent_patterns = {
-            "billing": [
-                r"\b(bill|billing|charge|payment|invoice|refund|double.?charged?|cost|price|fee)\b",
-                r"\b(money|dollar|amount|subscription|plan)\b"
-            ],
-            "technical": [
-                r"\b(bug|error|crash|broken|not.?work|issue|problem|login|app|website|connection)\b",
-                r"\b(technical|tech|system|server|down|slow)\b"
-            ],
-            "cancellation": [
-                r"\b(cancel|stop|end|terminate|quit|unsubscribe|delete.?account)\b",
-                r"\b(don.?t.?want|no.?longer|remove)\b"
-            ],
-            "urgent": [
-                r"\b(urgent|emergency|asap|immediately|now|critical|important)\b",
-                r"\b(help.?me|need.?help|stuck|locked.?out)\b"
-            ],
-            "other": []  # Fallback category
-        }
+        # Intent lexicon compiled into a single multi-pattern automaton
+        self.intent_lexicon = load_intent_lexicon(config)
+        self.intent_automaton = KeywordAutomaton(self.intent_lexicon)
+        
+        # label_match method: "keyword" (detected intent) or "similarity" (label centroids)
+        label_match_config = config.get("label_match", {})
+        self.label_match_method = label_match_config.get("method", "keyword")
+        self.min_similarity = label_match_config.get("min_similarity", 0.05)
+        self.similarity_dimensions = label_match_config.get("dimensions", 4096)
+        self.label_similarity = None
+        if self.label_match_method == "similarity":
+            self.fit_label_similarity([])
         
         # Hedging phrases to penalize
         self.hedging_patterns = [
@@ -50,6 +86,14 @@ class VariantScorer:
             r"\b(as an ai|i'm an ai|i cannot|i don't know|uncertain)\b",
             r"\b(probably|likely|appears to|suggests)\b"
         ]
+        
+        # Registered metrics added on top of the built-in components
+        self.metrics = MetricRunner(config.get("custom_metrics", {}))
+    
+    @property
+    def max_total(self) -> float:
+        """Highest possible total: every component and metric at 1.0."""
+        return sum(self.weights.values()) + sum(self.metrics.weights.values())
     
     def score_variant(self, variant: Variant, input_text: str) -> Score:
         """
@@ -110,12 +154,54 @@ class VariantScorer:
             components=components
         )
     
+    async def score_variant_async(self, variant: Variant, input_text: str) -> Score:
+        """
+        Score a variant with the built-in components plus the registered metrics.
+        Thread- and process-pool metrics run concurrently off the event loop.
+        
+        Args:
+            variant: The variant to score
+            input_text: Original input text
+            
+        Returns:
+            Score whose total includes the weighted metric values
+        """
+        score = self.score_variant(variant, input_text)
+        if not self.metrics.declarations:
+            return score
+        
+        if variant.output:
+            values = await self.metrics.evaluate(variant.output.category, variant.output.summary, input_text)
+        else:
+            values = {name: 0.0 for name in self.metrics.weights}
+        
+        total = score.total + sum(self.metrics.weights[name] * value for name, value in values.items())
+        return score.model_copy(update={"total": total, "metrics": values})
+    
     def _score_label_valid(self, category: str) -> float:
         """Score whether the category is in the allowed labels."""
         return 1.0 if category.lower() in {label.lower() for label in self.labels} else 0.0
     
+    def fit_label_similarity(self, examples: List[Tuple[str, str]]) -> None:
+        """
+        Build label centroids for similarity-based label_match.
+        Centroids combine the intent lexicon with labelled (text, label) examples,
+        such as the variants' few-shot examples.
+        """
+        from similarity import LabelSimilarity, lexicon_examples
+        
+        self.label_similarity = LabelSimilarity(
+            sorted(self.labels),
+            lexicon_examples(self.intent_lexicon) + list(examples),
+            self.similarity_dimensions
+        )
+    
     def _score_label_match(self, category: str, input_text: str) -> float:
         """Score whether the category matches the detected intent from input."""
+        if self.label_similarity is not None:
+            scores = self.label_similarity.label_scores([input_text], [category], self.min_similarity)
+            return float(scores[0])
+        
         detected_intent = self._detect_intent(input_text)
         
         # If we couldn't detect intent, give partial credit
@@ -161,7 +247,7 @@ class VariantScorer:
     
     def _detect_intent(self, input_text: str) -> str:
         """
-        Detect the most likely intent from input text using pattern matching.
+        Detect the most likely intent from input text using the keyword automaton.
         
         Args:
             input_text: The input text to analyze
@@ -169,21 +255,8 @@ class VariantScorer:
         Returns:
             The detected intent category
         """
-        text_lower = input_text.lower()
-        intent_scores = {}
-        
-        # Score each intent based on pattern matches
-        for intent, patterns in self.intent_patterns.items():
-            if intent == "other":
-                continue
-                
-            score = 0
-            for pattern in patterns:
-                matches = len(re.findall(pattern, text_lower, re.IGNORECASE))
-                score += matches
-            
-            if score > 0:
-                intent_scores[intent] = score
+        intent_scores = self.intent_automaton.count(input_text)
+        intent_scores.pop("other", None)
         
         # Return the intent with the highest score, or "other" if no matches
         if intent_scores:
@@ -215,11 +288,16 @@ class VariantScorer:
             explanations.append(f"✗ Invalid category '{variant.output.category}'")
         
         # Label match
-        detected_intent = self._detect_intent(input_text)
+        if self.label_similarity is not None:
+            detected_intent = self.label_similarity.closest_label(input_text)
+        else:
+            detected_intent = self._detect_intent(input_text)
         if score.components.label_match == 1.0:
             explanations.append(f"✓ Category matches detected intent ({detected_intent})")
         elif score.components.label_match == 0.5:
             explanations.append("~ No clear intent detected")
+        elif score.components.label_match > 0.0:
+            explanations.append(f"~ Category is close to detected intent ({detected_intent})")
         else:
             explanations.append(f"✗ Category doesn't match detected intent ({detected_intent})")
         
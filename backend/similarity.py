@@ -0,0 +1,98 @@
+"""
+Offline text similarity for label matching.
+Hashing TF-IDF vectors compared against per-label centroids with NumPy.
+"""
+
+from typing import Dict, List, Tuple
+import zlib
+
+import numpy as np
+
+from keyword_automaton import normalize_text
+
+def _features(text: str) -> List[str]:
+    """Word unigrams and bigrams of the normalized text."""
+    words = normalize_text(text).split()
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+class HashingVectorizer:
+    """
+    Stateless feature hashing into a fixed number of dimensions.
+    Uses crc32 so vectors are identical across processes.
+    """
+
+    def __init__(self, dimensions: int = 4096):
+        self.dimensions = dimensions
+        self.idf = np.ones(dimensions)
+
+    def _counts(self, texts: List[str]) -> np.ndarray:
+        """Sublinear term frequencies, one row per text."""
+        matrix = np.zeros((len(texts), self.dimensions))
+        for row, text in enumerate(texts):
+            for feature in _features(text):
+                matrix[row, zlib.crc32(feature.encode("utf-8")) % self.dimensions] += 1
+        np.log1p(matrix, out=matrix)
+        return matrix
+
+    def fit(self, texts: List[str]) -> "HashingVectorizer":
+        """Learn smoothed inverse document frequencies from a corpus."""
+        document_frequency = (self._counts(texts) > 0).sum(axis=0)
+        self.idf = np.log((1 + len(texts)) / (1 + document_frequency)) + 1
+        return self
+
+    def transform(self, texts: List[str]) -> np.ndarray:
+        """Vectorize texts into L2-normalized TF-IDF rows."""
+        matrix = self._counts(texts) * self.idf
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.where(norms == 0, 1, norms)
+
+class LabelSimilarity:
+    """
+    Cosine similarity of inputs to precomputed label centroids.
+    Scoring a batch of inputs is a single (inputs x dims) @ (dims x labels) multiply.
+    """
+
+    def __init__(self, labels: List[str], examples: List[Tuple[str, str]], dimensions: int = 4096):
+        self.labels = list(labels)
+        self._label_index = {label.lower(): index for index, label in enumerate(self.labels)}
+        self.vectorizer = HashingVectorizer(dimensions).fit([text for text, _ in examples])
+
+        # Centroid per label: mean of its example vectors, re-normalized
+        vectors = self.vectorizer.transform([text for text, _ in examples])
+        centroids = np.zeros((len(self.labels), dimensions))
+        for vector, (_, label) in zip(vectors, examples):
+            index = self._label_index.get(label.lower())
+            if index is not None:
+                centroids[index] += vector
+        norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+        self.centroids = centroids / np.where(norms == 0, 1, norms)
+
+    def similarities(self, texts: List[str]) -> np.ndarray:
+        """Cosine similarity of every text to every label centroid."""
+        return self.vectorizer.transform(texts) @ self.centroids.T
+
+    def label_scores(self, texts: List[str], categories: List[str], min_similarity: float) -> np.ndarray:
+        """
+        Score each predicted category by its similarity relative to the best label.
+        1.0 means the category is the closest label; 0.5 when no label is similar
+        enough to judge, and 0.0 for categories outside the label set.
+        """
+        similarities = self.similarities(texts)
+        best = similarities.max(axis=1)
+
+        scores = np.zeros(len(texts))
+        for row, category in enumerate(categories):
+            index = self._label_index.get(category.strip().lower())
+            if best[row] < min_similarity:
+                scores[row] = 0.5
+            elif index is not None:
+                scores[row] = similarities[row, index] / best[row]
+        return scores
+
+    def closest_label(self, text: str) -> str:
+        """The label whose centroid is most similar to the text."""
+        return self.labels[int(self.similarities([text])[0].argmax())]
+
+def lexicon_examples(lexicon: Dict[str, List[str]]) -> List[Tuple[str, str]]:
+    """Treat each lexicon phrase as a labelled example of its intent."""
+    return [(phrase, label) for label, phrases in lexicon.items() for phrase in phrases]
@@ -0,0 +1,447 @@
+"""
+SQLite-backed storage for optimization runs.
+Shares runs and event logs between uvicorn worker processes on one node.
+"""
+
+from typing import Dict, List, Optional, Any, Callable
+from contextlib import contextmanager
+from datetime import datetime
+import sqlite3
+import threading
+import time
+
+from analytics import RELATIVE_ACCURACY, VariantStats, WINDOWS, rank_variants, window_epochs
+from http_cache import FrozenBody
+from models import Run, Event, RunStatus
+from run_store import ANALYTICS_KINDS, RunStore
+from run_records import RunRecord
+
+SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS runs (
+        run_id TEXT PRIMARY KEY,
+        seq INTEGER,
+        created_at TEXT NOT NULL,
+        status TEXT NOT NULL,
+        winner_variant_id TEXT,
+        winning_category TEXT,
+        data BLOB NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS runs_created_at ON runs (created_at)",
+    """CREATE TABLE IF NOT EXISTS events (
+        run_id TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        data BLOB NOT NULL,
+        PRIMARY KEY (run_id, seq)
+    )""",
+    # Rolling analytics shared by all workers: one row per counter of a
+    # variant's stats in one time slot of one window (see VariantStats.counters)
+    """CREATE TABLE IF NOT EXISTS analytics (
+        window_name TEXT NOT NULL,
+        epoch INTEGER NOT NULL,
+        variant_id TEXT NOT NULL,
+        counter TEXT NOT NULL,
+        value REAL NOT NULL,
+        PRIMARY KEY (window_name, epoch, variant_id, counter)
+    )"""
+)
+
+# History query columns, ALTERed into databases created before they existed
+QUERY_COLUMNS = {
+    "seq": "INTEGER",
+    "winner_variant_id": "TEXT",
+    "winning_category": "TEXT"
+}
+
+QUERY_INDEXES = (
+    "CREATE UNIQUE INDEX IF NOT EXISTS runs_seq ON runs (seq)",
+    "CREATE INDEX IF NOT EXISTS runs_status_seq ON runs (status, seq)",
+    "CREATE INDEX IF NOT EXISTS runs_winner_seq ON runs (winner_variant_id, seq)",
+    "CREATE INDEX IF NOT EXISTS runs_category_seq ON runs (winning_category, seq)"
+)
+
+class SqliteRunStore(RunStore):
+    """
+    Multi-process run store backed by a shared SQLite database in WAL mode.
+
+    Any worker can create, process and stream any run. Rolling analytics are
+    kept as counter rows in the database, written in the same transaction as the
+    run, so every worker reports the same figures. Events appended by the
+    worker processing a run become visible to SSE pollers in every other worker
+    through the indexed (run_id, seq) lookup in get_encoded_events, and to each
+    worker's firehose through sync_firehose, which tails the events table by rowid.
+    """
+
+    def __init__(self, path: str, retention_runs: int = 100000):
+        super().__init__()
+        self.path = path
+        self.retention_runs = retention_runs  # Runs kept on disk; _max_runs bounds the in-memory caches
+        self._clock = time.time
+        self._conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._migrate()
+
+        # Last events rowid published to this worker's firehose
+        self._firehose_rowid = 0
+        self._firehose_lock = threading.Lock()
+
+    def _migrate(self) -> None:
+        """
+        Create the schema, adding the history query columns and their indexes
+        to older databases. Every worker runs this at startup, so it runs as one
+        write transaction and re-checks the columns inside it.
+        """
+        with self._transaction() as conn:
+            for statement in SCHEMA:
+                conn.execute(statement)
+
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(runs)")}
+            for name, column_type in QUERY_COLUMNS.items():
+                if name in columns:
+                    continue
+                try:
+                    conn.execute(f"ALTER TABLE runs ADD COLUMN {name} {column_type}")
+                except sqlite3.OperationalError as e:
+                    # Another worker added it first
+                    if "duplicate column" not in str(e):
+                        raise
+
+            conn.execute("UPDATE runs SET seq = rowid WHERE seq IS NULL")
+            for statement in QUERY_INDEXES:
+                conn.execute(statement)
+
+    @contextmanager
+    def _transaction(self):
+        """Run a write transaction, taking the database write lock up front."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _load(self, run_id: str) -> Optional[Run]:
+        """Load a run (without its event log) from the database."""
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+        return Run.model_validate_json(row[0]) if row else None
+
+    def _update(
+        self,
+        run_id: str,
+        mutate: Callable[[Run], None],
+        record: Optional[Callable[[VariantStats], None]] = None,
+        variant_id: Optional[str] = None
+    ) -> Optional[Run]:
+        """
+        Apply mutate to a stored run inside a write transaction. For classify
+        runs, record (applied to an empty VariantStats) is added to variant_id's
+        analytics in the same transaction.
+        """
+        with self._transaction() as conn:
+            run = self._load(run_id)
+            if not run:
+                return None
+
+            mutate(run)
+            if record is not None and run.kind in ANALYTICS_KINDS:
+                delta = VariantStats(RELATIVE_ACCURACY)
+                record(delta)
+                self._record_analytics(conn, variant_id, delta.counters())
+            conn.execute(
+                "UPDATE runs SET status = ?, winner_variant_id = ?, winning_category = ?, data = ? WHERE run_id = ?",
+                (
+                    run.status.value,
+                    run.winner_variant_id,
+                    RunRecord.from_model(run).winning_category(),
+                    run.model_dump_json(exclude={"event_log"}),
+                    run_id
+                )
+            )
+            return run
+
+    def create_run(self, input_text: str, kind: str = "classify") -> str:
+        """Create a new run and return its ID."""
+        run = self._new_run(input_text, kind)
+
+        with self._transaction() as conn:
+            seq = conn.execute("SELECT COALESCE(MAX(seq), -1) + 1 FROM runs").fetchone()[0]
+            conn.execute(
+                "INSERT INTO runs (run_id, seq, created_at, status, data) VALUES (?, ?, ?, ?, ?)",
+                (run.run_id, seq, run.created_at.isoformat(), run.status.value, run.model_dump_json(exclude={"event_log"}))
+            )
+
+            # Delete runs older than the retention window through the seq index, then their events by key
+            trimmed = conn.execute(
+                "SELECT run_id FROM runs WHERE seq <= ?", (seq - self.retention_runs,)
+            ).fetchall()
+            conn.executemany("DELETE FROM runs WHERE run_id = ?", trimmed)
+            conn.executemany("DELETE FROM events WHERE run_id = ?", trimmed)
+
+        return run.run_id
+
+    def get_run(self, run_id: str) -> Optional[Dict[str, Any]]:
+        """Get complete run data as dictionary."""
+        run = self._load(run_id)
+        if not run:
+            return None
+
+        run.event_log = [Event.model_validate_json(event) for event in self.get_encoded_events(run_id) or []]
+        return run.model_dump()
+
+    def get_run_json(self, run_id: str) -> Optional[bytes]:
+        """Get complete run data as JSON bytes, splicing in the stored event bytes."""
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+            if not row:
+                return None
+
+            events = b",".join(self.get_encoded_events(run_id) or [])
+
+        head = row[0] if isinstance(row[0], bytes) else row[0].encode("utf-8")
+        return head[:-1] + b',"event_log":[' + events + b"]}"
+
+    def get_status(self, run_id: str) -> Optional[RunStatus]:
+        """Get the status of a run without loading it."""
+        with self._lock:
+            row = self._conn.execute("SELECT status FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+        return RunStatus(row[0]) if row else None
+
+    def run_exists(self, run_id: str) -> bool:
+        """Check if a run exists."""
+        return self.get_status(run_id) is not None
+
+    def update_run_status(self, run_id: str, status: RunStatus) -> None:
+        """Update the status of a run."""
+        self._update(run_id, lambda run: setattr(run, "status", status))
+
+        # Warm this worker's cache; other workers freeze lazily in get_frozen
+        if status == RunStatus.COMPLETE:
+            self.get_frozen(run_id, "run")
+
+    def add_variant(self, run_id: str, variant: Any) -> None:
+        """Add a variant to a run."""
+        self._update(
+            run_id, lambda run: run.variants.append(variant),
+            lambda stats: stats.add_variant(variant), variant.variant_id
+        )
+
+    def add_score(self, run_id: str, score: Any) -> None:
+        """Add a score to a run."""
+        self._update(
+            run_id, lambda run: run.scores.append(score),
+            lambda stats: stats.add_score(score), score.variant_id
+        )
+
+    def get_leader(self, run_id: str) -> Optional[str]:
+        """Get the best variant so far by (score desc, latency asc)."""
+        run = self._load(run_id)
+        return RunRecord.from_model(run).leader() if run else None
+
+    def get_leaderboard(self, run_id: str) -> Optional[List[Dict[str, Any]]]:
+        """Get a run's scored variants, best first. Returns None if the run doesn't exist."""
+        run = self._load(run_id)
+        return RunRecord.from_model(run).ranking() if run else None
+
+    def set_winner(self, run_id: str, variant_id: str) -> None:
+        """Set the winning variant for a run."""
+        self._update(
+            run_id, lambda run: setattr(run, "winner_variant_id", variant_id),
+            lambda stats: setattr(stats, "wins", 1), variant_id
+        )
+
+    def _record_analytics(self, conn: sqlite3.Connection, variant_id: str, counters: Dict[str, float]) -> None:
+        """Add counters to the current slot of every window, dropping slots that have left their window."""
+        rows = []
+        for window, (epoch, oldest) in window_epochs(self._clock()).items():
+            conn.execute("DELETE FROM analytics WHERE window_name = ? AND epoch < ?", (window, oldest))
+            rows.extend((window, epoch, variant_id, counter, value) for counter, value in counters.items())
+
+        conn.executemany(
+            "INSERT INTO analytics (window_name, epoch, variant_id, counter, value) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (window_name, epoch, variant_id, counter) DO UPDATE SET value = value + excluded.value",
+            rows
+        )
+
+    def _analytics_snapshot(self, window: str) -> Dict[str, VariantStats]:
+        """Merge the stored slots still inside a window into per-variant stats."""
+        _, oldest = window_epochs(self._clock())[window]
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT variant_id, counter, SUM(value) FROM analytics "
+                "WHERE window_name = ? AND epoch >= ? GROUP BY variant_id, counter",
+                (window, oldest)
+            ).fetchall()
+
+        counters: Dict[str, Dict[str, float]] = {}
+        for variant_id, counter, value in rows:
+            counters.setdefault(variant_id, {})[counter] = value
+
+        snapshot = {}
+        for variant_id, variant_counters in counters.items():
+            stats = snapshot[variant_id] = VariantStats(RELATIVE_ACCURACY)
+            stats.add_counters(variant_counters)
+        return snapshot
+
+    def get_variant_leaderboard(self, window: str = "all") -> List[Dict[str, Any]]:
+        """Rank variants across every worker's runs by mean score, then median latency."""
+        if window not in WINDOWS:
+            raise KeyError(window)
+        return rank_variants(self._analytics_snapshot(window))
+
+    def get_analytics(self) -> Dict[str, Any]:
+        """Per-window, per-variant summaries across every worker's runs."""
+        return {
+            window: {variant_id: stats.summary() for variant_id, stats in sorted(self._analytics_snapshot(window).items())}
+            for window in WINDOWS
+        }
+
+    def add_event(self, run_id: str, event_data: Dict[str, Any]) -> None:
+        """Append an event, encoded once, to a run's event log."""
+        encoded = Event(**event_data).model_dump_json().encode("utf-8")
+
+        with self._transaction() as conn:
+            if not conn.execute("SELECT 1 FROM runs WHERE run_id = ?", (run_id,)).fetchone():
+                return
+
+            conn.execute(
+                "INSERT INTO events (run_id, seq, data) VALUES "
+                "(?, (SELECT COUNT(*) FROM events WHERE run_id = ?), ?)",
+                (run_id, run_id, encoded)
+            )
+
+    def sync_firehose(self, batch_size: int = 1000) -> None:
+        """
+        Publish events added since the last call, by any worker, to this worker's
+        firehose. Writes are serialized by BEGIN IMMEDIATE, so rowids commit in order.
+        With no subscribers the backlog is skipped rather than published.
+        """
+        with self._firehose_lock:
+            if not self.firehose.get_stats()["subscribers"]:
+                with self._lock:
+                    self._firehose_rowid = self._conn.execute(
+                        "SELECT COALESCE(MAX(rowid), ?) FROM events", (self._firehose_rowid,)
+                    ).fetchone()[0]
+                return
+
+            while True:
+                with self._lock:
+                    rows = self._conn.execute(
+                        "SELECT rowid, run_id, data FROM events WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                        (self._firehose_rowid, batch_size)
+                    ).fetchall()
+                for rowid, run_id, data in rows:
+                    self.firehose.publish(run_id, data)
+                    self._firehose_rowid = rowid
+                if len(rows) < batch_size:
+                    break
+
+    def get_events(self, run_id: str) -> List[Dict[str, Any]]:
+        """Get all events for a run."""
+        return [Event.model_validate_json(event).model_dump() for event in self.get_encoded_events(run_id) or []]
+
+    def get_encoded_events(self, run_id: str, start: int = 0) -> Optional[List[bytes]]:
+        """
+        Get pre-encoded JSON bytes for a run's events from index start onwards.
+        Returns None if the run doesn't exist.
+        """
+        with self._lock:
+            if not self._conn.execute("SELECT 1 FROM runs WHERE run_id = ?", (run_id,)).fetchone():
+                return None
+
+            rows = self._conn.execute(
+                "SELECT data FROM events WHERE run_id = ? AND seq >= ? ORDER BY seq",
+                (run_id, start)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def get_frozen(self, run_id: str, view: str) -> Optional[FrozenBody]:
+        """
+        Get the precomputed body of a completed run.
+        Each worker builds it once on first request and keeps it in memory.
+        """
+        with self._lock:
+            frozen = self._frozen.get(run_id)
+            if frozen:
+                return frozen[view]
+
+            if self.get_status(run_id) != RunStatus.COMPLETE:
+                return None
+
+            frozen = {
+                "run": FrozenBody(self.get_run_json(run_id)),
+                "replay": FrozenBody(self.get_replay_json(run_id))
+            }
+            self._frozen[run_id] = frozen
+
+            # Bound the per-worker cache like the in-memory store
+            while len(self._frozen) > self._max_runs:
+                self._frozen.pop(next(iter(self._frozen)))
+
+            return frozen[view]
+
+    def get_latest_runs(self, limit: int = 10) -> List[Dict[str, Any]]:
+        """Get the most recent runs."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT run_id FROM runs ORDER BY seq DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [run for run in (self.get_run(row[0]) for row in rows) if run]
+
+    def query_runs(
+        self,
+        status: Optional[str] = None,
+        winner_variant_id: Optional[str] = None,
+        winning_category: Optional[str] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        cursor: Optional[str] = None,
+        limit: int = 20
+    ) -> Dict[str, Any]:
+        """Page through run history, newest first, using the (column, seq) indexes."""
+        clauses, params = [], []
+        for column, value in (
+            ("status", status),
+            ("winner_variant_id", winner_variant_id),
+            ("winning_category", winning_category)
+        ):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if since is not None:
+            clauses.append("created_at >= ?")
+            params.append(since.isoformat())
+        if until is not None:
+            clauses.append("created_at < ?")
+            params.append(until.isoformat())
+        if cursor:
+            clauses.append("seq < ?")
+            params.append(int(cursor))
+
+        where = f"WHERE {' AND '.join(clauses)} " if clauses else ""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT seq, data FROM runs {where}ORDER BY seq DESC LIMIT ?",
+                (*params, limit + 1)
+            ).fetchall()
+
+        page = rows[:limit]
+        return {
+            "runs": [RunRecord.from_model(Run.model_validate_json(data)).summary() for _, data in page],
+            "next_cursor": str(page[-1][0]) if len(rows) > limit else None
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get statistics about stored runs."""
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM runs GROUP BY status").fetchall()
+
+        status_counts = dict(rows)
+        return {
+            "total_runs": sum(status_counts.values()),
+            "status_counts": status_counts,
+            "max_runs": self._max_runs,
+            "retention_runs": self.retention_runs
+        }
@@ -0,0 +1,88 @@
+"""
+Bookkeeping for long-lived SSE streams.
+Caps how many are open at once and counts why each one closed.
+"""
+
+from typing import Dict, Any, Callable, Optional
+from collections import Counter
+import threading
+
+from fastapi.responses import StreamingResponse
+
+class StreamSlot:
+    """One open stream's claim on the cap; closing it more than once is a no-op."""
+
+    __slots__ = ("_tracker", "closed")
+
+    def __init__(self, tracker: "StreamTracker"):
+        self._tracker = tracker
+        self.closed = False
+
+    def close(self, reason: str) -> None:
+        """Free the slot, recording why the stream ended."""
+        if not self.closed:
+            self.closed = True
+            self._tracker._release(reason)
+
+class StreamTracker:
+    """Global cap on concurrent streams, with an active-stream gauge and close reasons."""
+
+    def __init__(self, max_streams: int = 500):
+        self.max_streams = max_streams
+        self._lock = threading.Lock()
+        self.active = 0
+        self.peak = 0
+        self.rejected = 0
+        self.closed = Counter()
+
+    def acquire(self) -> Optional[StreamSlot]:
+        """Claim a slot for a new stream, or None if max_streams are already open."""
+        with self._lock:
+            if self.active >= self.max_streams:
+                self.rejected += 1
+                return None
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        return StreamSlot(self)
+
+    def _release(self, reason: str) -> None:
+        """Called by StreamSlot.close."""
+        with self._lock:
+            self.active -= 1
+            self.closed[reason] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Active streams, the cap, and counts of rejected and closed streams."""
+        with self._lock:
+            return {
+                "active": self.active,
+                "max_streams": self.max_streams,
+                "peak": self.peak,
+                "rejected": self.rejected,
+                "closed": dict(self.closed)
+            }
+
+class ReleasingStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse that calls release however the response ends, including
+    when the client disconnects before the body generator starts (an
+    unstarted generator never runs its finally block). release must be safe
+    to call more than once.
+    """
+
+    def __init__(self, content: Any, release: Callable[[], None], **kwargs: Any):
+        super().__init__(content, **kwargs)
+        self.release = release
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.release()
+
+class SlotStreamingResponse(ReleasingStreamingResponse):
+    """ReleasingStreamingResponse that frees a stream slot."""
+
+    def __init__(self, content: Any, slot: StreamSlot, **kwargs: Any):
+        super().__init__(content, lambda: slot.close("disconnected"), **kwargs)
+        self.slot = slot
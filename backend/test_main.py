@@ -3,13 +3,18 @@ Basic tests for the Live Optimizing Classifier backend.
 Tests core functionality without requiring LLM API calls.
 """
 
+import os
 import pytest
 import asyncio
+import tempfile
 from unittest.mock import Mock, patch
 from fastapi.testclient import TestClient
 
+# The module-level run store archives evicted runs; keep that out of the working tree
+os.environ["RUN_ARCHIVE_DIR"] = tempfile.mkdtemp(prefix="run-archive-")
+
 from main import app
-from models import RunRequest, EventType
+from models import RunRequest, EventType, RunStatus
 from scoring import VariantScorer
 from run_store import RunStore
 from config import load_config
@@ -24,6 +29,31 @@ def test_health_check():
     assert data["status"] == "ok"
     assert "message" in data
 
+def test_liveness_and_readiness():
+    """Test the liveness and readiness probes."""
+    from main import optimizer
+    
+    assert client.get("/healthz/live").status_code == 200
+    
+    optimizer.get()
+    response = client.get("/healthz/ready")
+    assert response.status_code == 200
+    assert response.json()["ready"] is True
+
+def test_lazy_resource():
+    """Test that lazy resources build once and report readiness."""
+    from lazy import LazyResource
+    
+    builds = []
+    resource = LazyResource("test", lambda: builds.append(1) or "value")
+    assert not resource.ready
+    assert resource.status()["ready"] is False
+    
+    assert resource.get() == "value"
+    assert resource.get() == "value"
+    assert builds == [1]
+    assert resource.status()["ready"] is True
+
 def test_get_config():
     """Test the configuration endpoint."""
     response = client.get("/api/config")
@@ -80,6 +110,800 @@ def test_run_store():
     assert len(events) == 1
     assert events[0]["type"] == EventType.VARIANT_START
 
+def test_run_record_round_trip():
+    """Test that compact run records convert back to identical pydantic models."""
+    from datetime import datetime
+    from run_records import RunRecord
+    from models import Run, TaskConfig, Variant, VariantOutput, Score, ScoreComponents
+    
+    run = Run(
+        run_id="r1",
+        input_text="I was double charged",
+        created_at=datetime(2024, 5, 1, 12, 30, 15, 123456),
+        status=RunStatus.COMPLETE,
+        variants=[
+            Variant(variant_id="v1", prompt_spec="Formal", output=VariantOutput(category="billing", summary="Charged twice"), latency_ms=900),
+            Variant(variant_id="v2", prompt_spec="Casual", error="Timeout")
+        ],
+        scores=[Score(variant_id="v1", total=4.5, components=ScoreComponents(
+            label_valid=1.0, label_match=1.0, summary_len_ok=1.0, no_hedging=1.0, format_ok=0.5
+        ))],
+        winner_variant_id="v1",
+        task_config=TaskConfig(labels=["billing", "other"])
+    )
+    
+    record = RunRecord.from_model(run)
+    assert record.to_model() == run
+    assert record.winning_category() == "billing"
+    assert record.summary()["created_at"] == "2024-05-01T12:30:15.123456"
+
+def test_encoded_events_match_structured_events():
+    """Test that pre-encoded events back the run and replay endpoints."""
+    import json
+    from main import run_store
+    
+    run_id = run_store.create_run("Encoding test")
+    run_store.add_event(run_id, {
+        "type": EventType.VARIANT_START,
+        "ts": 1000,
+        "payload": {"variant_id": "v1", "prompt_spec": "Formal approach"}
+    })
+    
+    encoded = run_store.get_encoded_events(run_id)
+    assert [json.loads(event) for event in encoded] == run_store.get_events(run_id)
+    assert run_store.get_encoded_events(run_id, 1) == []
+    assert run_store.get_encoded_events("missing") is None
+    
+    replay = client.get(f"/api/run/{run_id}/replay")
+    assert replay.status_code == 200
+    assert replay.json()["events"][0]["payload"]["variant_id"] == "v1"
+    
+    run = client.get(f"/api/run/{run_id}")
+    assert run.status_code == 200
+    assert run.json()["input_text"] == "Encoding test"
+    assert run.json()["event_log"] == replay.json()["events"]
+
+def test_multiplexed_websocket_stream():
+    """Test following several runs over one WebSocket."""
+    from main import run_store
+    
+    run_a = run_store.create_run("Multiplex A")
+    run_b = run_store.create_run("Multiplex B")
+    run_store.add_event(run_a, {"type": EventType.VARIANT_START, "ts": 1000, "payload": {"variant_id": "v1"}})
+    run_store.add_event(run_b, {"type": EventType.VARIANT_START, "ts": 1000, "payload": {"variant_id": "v2"}})
+    run_store.update_run_status(run_b, RunStatus.COMPLETE)
+    
+    with client.websocket_connect("/api/runs/ws") as websocket:
+        websocket.send_text("not json")
+        assert websocket.receive_json() == {"error": "Invalid JSON"}
+        
+        websocket.send_json({"action": "subscribe", "run_ids": [run_a, run_b, "missing"]})
+        frame = websocket.receive_json()
+        runs = {run["run_id"]: run for run in frame["runs"]}
+        assert runs[run_a]["events"][0]["payload"] == {"variant_id": "v1"}
+        assert runs[run_a]["done"] is False
+        assert runs[run_b]["done"] is True
+        assert runs["missing"]["error"] == "Run not found"
+        
+        # Only new events are sent, in one frame per tick
+        run_store.add_event(run_a, {"type": EventType.VARIANT_OUTPUT, "ts": 2000, "payload": {"variant_id": "v1"}})
+        run_store.update_run_status(run_a, RunStatus.COMPLETE)
+        frame = websocket.receive_json()
+        assert [run["run_id"] for run in frame["runs"]] == [run_a]
+        assert [event["type"] for event in frame["runs"][0]["events"]] == ["VariantOutput"]
+        assert frame["runs"][0]["done"] is True
+
+def test_run_subscriptions_limit():
+    """Test subscription limits and unsubscribing."""
+    from run_multiplexer import RunSubscriptions
+    
+    subscriptions = RunSubscriptions(max_subscriptions=2)
+    assert subscriptions.handle_message({"action": "subscribe", "run_ids": ["a", "b", "c"]}) is not None
+    assert subscriptions.run_ids == ["a", "b"]
+    assert subscriptions.handle_message({"action": "unsubscribe", "run_ids": ["a"]}) is None
+    assert subscriptions.run_ids == ["b"]
+    assert subscriptions.handle_message(["a"]) is not None
+
+def test_firehose_ring_buffer_gaps():
+    """Test that a slow firehose subscriber loses the oldest events behind a gap marker."""
+    import json
+    
+    store = RunStore()
+    subscriber_id = store.firehose.subscribe(buffer_size=3, max_subscribers=1)
+    assert store.firehose.subscribe(max_subscribers=1) is None
+    
+    run_id = store.create_run("Firehose input")
+    for i in range(10):
+        store.add_event(run_id, {"type": EventType.VARIANT_START, "ts": i, "payload": {"i": i}})
+    
+    messages = store.firehose.get(subscriber_id).drain()
+    assert messages[0] == b'event: gap\ndata: {"dropped": 7}\n\n'
+    events = [json.loads(message[len(b"data: "):]) for message in messages[1:]]
+    assert [event["event"]["payload"]["i"] for event in events] == [7, 8, 9]
+    assert events[0]["run_id"] == run_id
+    assert store.firehose.get(subscriber_id).drain() == []
+    assert store.firehose.get_stats() == {"subscribers": 1, "dropped_total": 7}
+    
+    store.firehose.unsubscribe(subscriber_id)
+    assert store.firehose.get_stats()["subscribers"] == 0
+
+def test_sse_resume_and_heartbeat():
+    """Test SSE event ids, Last-Event-ID resume and heartbeats on idle streams."""
+    import threading
+    import main
+    from main import run_store
+    
+    run_id = run_store.create_run("Resume test")
+    for i in range(3):
+        run_store.add_event(run_id, {
+            "type": EventType.VARIANT_START,
+            "ts": 1000 + i,
+            "payload": {"variant_id": f"v{i + 1}", "prompt_spec": "spec"}
+        })
+    
+    # Finish the run after the stream has been idle past the heartbeat interval
+    threading.Timer(0.4, run_store.update_run_status, (run_id, RunStatus.COMPLETE)).start()
+    with patch.dict(main.config, {"sse": {"heartbeat_s": 0.1, "retry_ms": 500}}):
+        body = client.get(f"/api/run/{run_id}/stream", headers={"Last-Event-ID": "0"}).text
+    
+    assert body.startswith("retry: 500\n\n")
+    assert "id: 0\n" not in body
+    assert body.index("id: 1\n") < body.index("id: 2\n")
+    assert '"variant_id":"v1"' not in body
+    assert ": heartbeat\n\n" in body
+    
+    # A malformed id replays the whole log
+    body = client.get(f"/api/run/{run_id}/stream", params={"last_event_id": "abc"}).text
+    assert "id: 0\n" in body and "id: 2\n" in body
+
+def test_firehose_released_when_client_leaves_early():
+    """Test that the firehose subscriber is released if the client disconnects before streaming starts."""
+    import main
+    
+    store = RunStore()
+    request = Mock()
+    
+    async def receive():
+        return {"type": "http.disconnect"}
+    
+    async def send(message):
+        await asyncio.sleep(10)  # Headers never go out before the disconnect
+    
+    async def scenario():
+        with patch("main.run_store", store):
+            response = await main.stream_all_events(request)
+            assert store.firehose.get_stats()["subscribers"] == 1
+            await asyncio.wait_for(response({"type": "http"}, receive, send), timeout=5)
+    
+    asyncio.run(scenario())
+    assert store.firehose.get_stats()["subscribers"] == 0
+
+def test_stream_lifecycle():
+    """Test that run streams end on error, eviction and idle timeout, and respect the cap."""
+    import threading
+    import main
+    from stream_slots import StreamTracker
+    
+    tracker = StreamTracker(max_streams=1)
+    store = RunStore()
+    store._max_runs = 1
+    
+    with patch("main.stream_tracker", tracker), patch("main.run_store", store), \
+            patch.dict(main.config, {"sse": {"idle_timeout_s": 0.3}}):
+        # A failed run ends the stream like a completed one
+        failed_id = store.create_run("Fails")
+        store.add_event(failed_id, {"type": EventType.ERROR, "ts": 1000, "payload": {"error": "boom"}})
+        store.update_run_status(failed_id, RunStatus.ERROR)
+        assert '"error":"boom"' in client.get(f"/api/run/{failed_id}/stream").text
+        
+        # Creating another run evicts this one mid-stream
+        evicted_id = store.create_run("Evicted")
+        threading.Timer(0.2, store.create_run, ("Newer",)).start()
+        assert "Run evicted" in client.get(f"/api/run/{evicted_id}/stream").text
+        
+        # A run that never produces events is closed after the idle timeout
+        idle_id = store.create_run("Idle")
+        response = client.get(f"/api/run/{idle_id}/stream")
+        assert response.status_code == 200
+        
+        # The cap rejects streams while the only slot is taken
+        slot = tracker.acquire()
+        assert client.get(f"/api/run/{idle_id}/stream").status_code == 503
+        slot.close("test")
+    
+    stats = tracker.get_stats()
+    assert stats["active"] == 0 and stats["rejected"] == 1 and stats["peak"] == 1
+    assert stats["closed"] == {"error": 1, "evicted": 1, "idle_timeout": 1, "test": 1}
+    assert "streams" in client.get("/api/metrics").json()
+
+def test_completed_run_http_caching():
+    """Test ETags, compression and conditional GETs for completed runs."""
+    from main import run_store
+    
+    run_id = run_store.create_run("Caching test")
+    for _ in range(10):
+        run_store.add_event(run_id, {
+            "type": EventType.VARIANT_START,
+            "ts": 1000,
+            "payload": {"variant_id": "v1", "prompt_spec": "Formal approach: Classify the text"}
+        })
+    
+    # In-progress runs are never cached
+    response = client.get(f"/api/run/{run_id}")
+    assert "ETag" not in response.headers
+    
+    run_store.update_run_status(run_id, RunStatus.COMPLETE)
+    
+    for path in [f"/api/run/{run_id}", f"/api/run/{run_id}/replay"]:
+        response = client.get(path, headers={"Accept-Encoding": "gzip"})
+        assert response.status_code == 200
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert response.json()
+        assert "immutable" in response.headers["Cache-Control"]
+        etag = response.headers["ETag"]
+        
+        response = client.get(path, headers={"If-None-Match": etag})
+        assert response.status_code == 304
+    
+    assert client.get(f"/api/run/{run_id}").json()["status"] == "complete"
+
+def test_evicted_runs_fault_in_from_archive(tmp_path):
+    """Test that evicted completed runs stay readable through the on-disk archive."""
+    from run_archive import RunArchive
+    
+    archive = RunArchive(str(tmp_path), segment_bytes=256)
+    store = RunStore(archive, faulted_cache_size=2)
+    store._max_runs = 2
+    
+    run_ids = []
+    for i in range(5):
+        run_id = store.create_run(f"Archived input {i}")
+        store.add_event(run_id, {"type": EventType.VARIANT_START, "ts": 1000, "payload": {"variant_id": f"v{i}"}})
+        store.update_run_status(run_id, RunStatus.COMPLETE)
+        run_ids.append(run_id)
+    etag = store.get_frozen(run_ids[0], "run").etag
+    store.create_run("Evicts the last completed run")
+    
+    # Evicted runs stay readable while the archive thread writes them
+    assert store.get_status(run_ids[0]) == RunStatus.COMPLETE
+    store.flush_archive()
+    assert len(archive) == 4
+    assert len(list(tmp_path.glob("segment-*.log"))) > 1
+    
+    # A fresh store (e.g. after a restart) reads the same archive
+    reopened = RunStore(RunArchive(str(tmp_path)))
+    for reader in (store, reopened):
+        assert reader.run_exists(run_ids[0])
+        assert reader.get_status(run_ids[0]) == RunStatus.COMPLETE
+        assert reader.get_run(run_ids[0])["input_text"] == "Archived input 0"
+        assert reader.get_events(run_ids[1])[0]["payload"] == {"variant_id": "v1"}
+        assert reader.get_frozen(run_ids[0], "run").etag == etag
+        assert b'"v2"' in reader.get_replay_json(run_ids[2])
+    
+    assert not store.run_exists("missing")
+    assert store.get_stats()["archive"]["archived_runs"] == 4
+
+def test_archive_dir_relative_to_backend(tmp_path, monkeypatch):
+    """Test that a relative archive_dir resolves against backend/, not the working directory."""
+    from pathlib import Path
+    from run_store import create_run_store
+    
+    # Relative to backend/, but landing in tmp_path so the working tree stays clean
+    backend_dir = Path(__file__).parent
+    archive_dir = os.path.relpath(tmp_path / "archive", backend_dir)
+    working_dir = tmp_path / "cwd"
+    working_dir.mkdir()
+    monkeypatch.chdir(working_dir)
+    store = create_run_store({"backend": "memory", "archive_dir": archive_dir})
+    assert store._archive.directory.resolve() == (tmp_path / "archive").resolve()
+    assert not (working_dir / archive_dir).exists()
+
+def test_sqlite_run_store_shared_between_workers(tmp_path):
+    """Test that two SQLite-backed stores (one per worker) see the same runs."""
+    from sqlite_run_store import SqliteRunStore
+    
+    path = str(tmp_path / "runs.sqlite3")
+    worker_a = SqliteRunStore(path)
+    worker_b = SqliteRunStore(path)
+    
+    run_id = worker_a.create_run("Shared input")
+    assert worker_b.run_exists(run_id)
+    assert worker_b.get_encoded_events(run_id) == []
+    
+    worker_a.update_run_status(run_id, RunStatus.PROCESSING)
+    worker_a.add_event(run_id, {
+        "type": EventType.VARIANT_START,
+        "ts": 1000,
+        "payload": {"variant_id": "v1"}
+    })
+    worker_a.set_winner(run_id, "v1")
+    
+    assert worker_b.get_status(run_id) == RunStatus.PROCESSING
+    assert worker_b.get_events(run_id)[0]["payload"] == {"variant_id": "v1"}
+    assert worker_b.get_encoded_events(run_id, 1) == []
+    assert worker_b.get_frozen(run_id, "run") is None
+    
+    worker_a.update_run_status(run_id, RunStatus.COMPLETE)
+    frozen = worker_b.get_frozen(run_id, "run")
+    assert frozen.etag == worker_a.get_frozen(run_id, "run").etag
+    
+    run_data = worker_b.get_run(run_id)
+    assert run_data["winner_variant_id"] == "v1"
+    assert len(run_data["event_log"]) == 1
+    assert worker_b.get_stats()["status_counts"] == {"complete": 1}
+
+def test_sqlite_firehose_carries_every_workers_events(tmp_path):
+    """Test that each worker's firehose tails the shared events table, not just its own writes."""
+    import json
+    from sqlite_run_store import SqliteRunStore
+    
+    path = str(tmp_path / "runs.sqlite3")
+    worker_a = SqliteRunStore(path)
+    worker_b = SqliteRunStore(path)
+    
+    # Events from before the subscription are skipped
+    old_id = worker_a.create_run("Before subscribing")
+    worker_a.add_event(old_id, {"type": EventType.VARIANT_START, "ts": 1000, "payload": {"variant_id": "old"}})
+    worker_b.sync_firehose()
+    subscriber_id = worker_b.firehose.subscribe()
+    
+    run_a = worker_a.create_run("Processed by worker A")
+    run_b = worker_b.create_run("Processed by worker B")
+    worker_a.add_event(run_a, {"type": EventType.VARIANT_START, "ts": 1001, "payload": {"variant_id": "v1"}})
+    worker_b.add_event(run_b, {"type": EventType.VARIANT_START, "ts": 1002, "payload": {"variant_id": "v2"}})
+    worker_a.add_event(run_a, {"type": EventType.VARIANT_START, "ts": 1003, "payload": {"variant_id": "v3"}})
+    
+    worker_b.sync_firehose(batch_size=2)
+    events = [json.loads(message[len(b"data: "):]) for message in worker_b.firehose.get(subscriber_id).drain()]
+    assert [(event["run_id"], event["event"]["payload"]["variant_id"]) for event in events] == [
+        (run_a, "v1"), (run_b, "v2"), (run_a, "v3")
+    ]
+    
+    worker_b.sync_firehose()
+    assert worker_b.firehose.get(subscriber_id).drain() == []
+
+def test_sqlite_run_store_trims_old_runs(tmp_path):
+    """Test that runs past the retention window are deleted along with their events, and only theirs."""
+    from sqlite_run_store import SqliteRunStore
+    
+    store = SqliteRunStore(str(tmp_path / "runs.sqlite3"), retention_runs=2)
+    
+    run_ids = []
+    for i in range(3):
+        run_id = store.create_run(f"Input {i}")
+        store.add_event(run_id, {"type": EventType.VARIANT_START, "ts": 1000, "payload": {"variant_id": f"v{i}"}})
+        run_ids.append(run_id)
+    store.create_run("Trims the two oldest runs")
+    
+    assert not store.run_exists(run_ids[0]) and not store.run_exists(run_ids[1])
+    assert store.get_events(run_ids[2])[0]["payload"] == {"variant_id": "v2"}
+    with store._lock:
+        assert store._conn.execute("SELECT COUNT(*) FROM events").fetchone()[0] == 1
+    
+    # Retention is separate from the in-memory cache bound, so old runs stay replayable
+    store = SqliteRunStore(str(tmp_path / "retained.sqlite3"))
+    store._max_runs = 2
+    first_id = store.create_run("Oldest")
+    store.add_event(first_id, {"type": EventType.VARIANT_START, "ts": 1000, "payload": {"variant_id": "v1"}})
+    for i in range(5):
+        store.create_run(f"Newer {i}")
+    assert b'"v1"' in store.get_replay_json(first_id)
+
+def test_sqlite_run_store_schema_setup_is_safe_across_workers(tmp_path):
+    """Test that workers opening a fresh database together, or an old one, all end up with the query columns."""
+    import sqlite3
+    import threading
+    from sqlite_run_store import SqliteRunStore, QUERY_COLUMNS
+    
+    path = str(tmp_path / "fresh.sqlite3")
+    barrier = threading.Barrier(8)
+    errors = []
+    
+    def start_worker():
+        barrier.wait()
+        try:
+            SqliteRunStore(path).create_run("Started together")
+        except Exception as e:
+            errors.append(e)
+    
+    threads = [threading.Thread(target=start_worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert SqliteRunStore(path).get_stats()["total_runs"] == 8
+    
+    # A database from before the query columns existed is migrated in place
+    old_path = str(tmp_path / "old.sqlite3")
+    conn = sqlite3.connect(old_path)
+    conn.execute("CREATE TABLE runs (run_id TEXT PRIMARY KEY, created_at TEXT NOT NULL, status TEXT NOT NULL, data BLOB NOT NULL)")
+    conn.commit()
+    conn.close()
+    
+    store = SqliteRunStore(old_path)
+    columns = {row[1] for row in store._conn.execute("PRAGMA table_info(runs)")}
+    assert set(QUERY_COLUMNS) <= columns
+    assert store.run_exists(store.create_run("After migration"))
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_query_runs(backend, tmp_path):
+    """Test filtered, cursor-paginated run history on both store backends."""
+    from datetime import datetime, timedelta
+    from run_store import create_run_store
+    from models import Variant, VariantOutput, Score, ScoreComponents
+    
+    store = create_run_store({"backend": backend, "path": str(tmp_path / "runs.sqlite3")})
+    run_ids = []
+    for i in range(5):
+        run_id = store.create_run(f"Input {i}")
+        run_ids.append(run_id)
+        category = "billing" if i % 2 == 0 else "technical"
+        store.add_variant(run_id, Variant(variant_id="v1", prompt_spec="spec", output=VariantOutput(category=category, summary="s")))
+        store.set_winner(run_id, "v1")
+        store.add_score(run_id, Score(variant_id="v1", total=4.0, components=ScoreComponents(
+            label_valid=1.0, label_match=1.0, summary_len_ok=1.0, no_hedging=1.0, format_ok=0.0
+        )))
+        if i < 4:
+            store.update_run_status(run_id, RunStatus.COMPLETE)
+    
+    # Pages come newest first and chain through next_cursor
+    page = store.query_runs(status="complete", limit=2)
+    assert [run["run_id"] for run in page["runs"]] == [run_ids[3], run_ids[2]]
+    page = store.query_runs(status="complete", cursor=page["next_cursor"], limit=2)
+    assert [run["run_id"] for run in page["runs"]] == [run_ids[1], run_ids[0]]
+    assert page["next_cursor"] is None
+    
+    billing = store.query_runs(winning_category="billing", winner_variant_id="v1")
+    assert [run["run_id"] for run in billing["runs"]] == [run_ids[4], run_ids[2], run_ids[0]]
+    assert billing["runs"][0]["status"] == "pending"
+    assert store.query_runs(status="error")["runs"] == []
+    
+    # Runs move between status indexes
+    store.update_run_status(run_ids[4], RunStatus.ERROR)
+    assert [run["run_id"] for run in store.query_runs(status="error")["runs"]] == [run_ids[4]]
+    
+    assert len(store.query_runs(since=datetime.utcnow() - timedelta(minutes=1))["runs"]) == 5
+    assert store.query_runs(until=datetime.utcnow() - timedelta(minutes=1))["runs"] == []
+    assert [run["run_id"] for run in store.get_latest_runs(2)] == [run_ids[4], run_ids[3]]
+
+def test_list_runs_endpoint():
+    """Test the /api/runs history endpoint."""
+    run_id = client.post("/api/run", json={"input_text": "History endpoint test"}).json()["run_id"]
+    
+    response = client.get("/api/runs", params={"limit": 1})
+    assert response.status_code == 200
+    assert response.json()["runs"][0]["run_id"] == run_id
+    assert "next_cursor" in response.json()
+    
+    assert client.get("/api/runs", params={"status": "bogus"}).status_code == 422
+    assert client.get("/api/runs", params={"cursor": "bogus"}).status_code == 400
+    assert client.get("/api/runs", params={"since": "2000-01-01T00:00:00Z"}).status_code == 200
+
+def test_rolling_analytics():
+    """Test windowed per-variant analytics and the latency sketch."""
+    from analytics import RunAnalytics, QuantileSketch
+    from models import Variant, Score, ScoreComponents
+    
+    sketch = QuantileSketch(relative_accuracy=0.01)
+    for value in range(1, 1001):
+        sketch.add(value)
+    assert abs(sketch.quantile(0.5) - 500) <= 500 * 0.02
+    assert abs(sketch.quantile(0.99) - 990) <= 990 * 0.02
+    
+    now = [1000.0]
+    analytics = RunAnalytics(clock=lambda: now[0])
+    components = ScoreComponents(label_valid=1.0, label_match=0.0, summary_len_ok=1.0, no_hedging=1.0, format_ok=1.0)
+    for latency in (100, 200, 300, 400):
+        analytics.record_variant(Variant(variant_id="v1", prompt_spec="spec", latency_ms=latency))
+        analytics.record_score(Score(variant_id="v1", total=4.0, components=components))
+    analytics.record_win("v1")
+    
+    stats = analytics.get_analytics()
+    assert stats["5m"]["v1"]["runs"] == 4
+    assert stats["5m"]["v1"]["win_rate"] == 0.25
+    assert stats["1h"]["v1"]["mean_total"] == 4.0
+    assert stats["all"]["v1"]["mean_components"]["label_match"] == 0.0
+    assert 190 <= stats["all"]["v1"]["latency_ms"]["p50"] <= 310
+    
+    # Ten minutes later the 5 minute window has rolled over
+    now[0] += 600
+    stats = analytics.get_analytics()
+    assert "v1" not in stats["5m"]
+    assert stats["1h"]["v1"]["runs"] == 4
+    assert stats["all"]["v1"]["runs"] == 4
+    
+    response = client.get("/api/analytics")
+    assert response.status_code == 200
+    assert set(response.json()) == {"5m", "1h", "all"}
+
+def test_sqlite_analytics_shared_between_workers(tmp_path):
+    """Test that sqlite workers share analytics and leaderboards, matching the in-memory aggregates."""
+    from analytics import RunAnalytics
+    from sqlite_run_store import SqliteRunStore
+    from models import Variant, Score, ScoreComponents
+    
+    now = [1000.0]
+    path = str(tmp_path / "runs.sqlite3")
+    workers = [SqliteRunStore(path), SqliteRunStore(path)]
+    for worker in workers:
+        worker._clock = lambda: now[0]
+    expected = RunAnalytics(clock=lambda: now[0])
+    
+    components = ScoreComponents(label_valid=1.0, label_match=0.0, summary_len_ok=1.0, no_hedging=1.0, format_ok=1.0)
+    for i, (variant_id, latency, total) in enumerate([("v1", 100, 4.0), ("v2", 300, 5.0), ("v1", 0, 3.0)]):
+        worker = workers[i % 2]
+        run_id = worker.create_run(f"Input {i}")
+        variant = Variant(variant_id=variant_id, prompt_spec="spec", latency_ms=latency, prompt_tokens=50)
+        score = Score(variant_id=variant_id, total=total, components=components)
+        worker.add_variant(run_id, variant)
+        worker.add_score(run_id, score)
+        worker.set_winner(run_id, variant_id)
+        expected.record_variant(variant)
+        expected.record_score(score)
+        expected.record_win(variant_id)
+    
+    # Dungeon runs stay out, as in the in-memory store
+    dungeon_id = workers[0].create_run("Dungeon", kind="dungeon")
+    workers[0].add_variant(dungeon_id, Variant(variant_id="c1", prompt_spec="spec", latency_ms=5))
+    
+    for worker in workers:
+        assert worker.get_analytics() == expected.get_analytics()
+        assert worker.get_variant_leaderboard("5m") == expected.get_leaderboard("5m")
+    assert [entry["variant_id"] for entry in workers[1].get_variant_leaderboard()] == ["v2", "v1"]
+    
+    # Ten minutes later the 5 minute window has rolled over in the database too
+    now[0] += 600
+    assert workers[1].get_analytics() == expected.get_analytics()
+    assert workers[1].get_variant_leaderboard("5m") == []
+    with pytest.raises(KeyError):
+        workers[0].get_variant_leaderboard("1d")
+
+def test_leaderboards():
+    """Test per-run and cross-run leaderboards ordered by score, then latency."""
+    from main import run_store
+    from models import Variant, VariantOutput, Score, ScoreComponents
+    
+    def components(format_ok: float) -> ScoreComponents:
+        return ScoreComponents(label_valid=1.0, label_match=1.0, summary_len_ok=1.0, no_hedging=1.0, format_ok=format_ok)
+    
+    run_id = run_store.create_run("Leaderboard input")
+    assert run_store.get_leader(run_id) is None
+    for variant_id, latency, total in [("v1", 900, 4.0), ("v2", 700, 5.0), ("v3", 500, 5.0)]:
+        run_store.add_variant(run_id, Variant(
+            variant_id=variant_id, prompt_spec="spec", latency_ms=latency,
+            output=VariantOutput(category="billing", summary="s")
+        ))
+        run_store.add_score(run_id, Score(variant_id=variant_id, total=total, components=components(total - 4.0)))
+    
+    # Ties on score go to the faster variant
+    assert run_store.get_leader(run_id) == "v3"
+    response = client.get(f"/api/run/{run_id}/leaderboard")
+    assert [entry["variant_id"] for entry in response.json()["variants"]] == ["v3", "v2", "v1"]
+    assert response.json()["variants"][0] == {"variant_id": "v3", "total": 5.0, "latency_ms": 500}
+    assert client.get("/api/run/missing/leaderboard").status_code == 404
+    
+    response = client.get("/api/leaderboard", params={"window": "5m"})
+    assert response.status_code == 200
+    totals = [entry["mean_total"] for entry in response.json()["variants"] if entry["mean_total"] is not None]
+    assert totals and totals == sorted(totals, reverse=True)
+    assert client.get("/api/leaderboard", params={"window": "1d"}).status_code == 400
+
+def test_rate_limiter():
+    """Test token-bucket limits per client and route, refill and idle bucket expiry."""
+    from rate_limiter import RateLimiter
+    
+    now = [0.0]
+    limiter = RateLimiter(
+        {"enabled": True, "routes": {"run": {"per_minute": 60, "burst": 2}}},
+        clock=lambda: now[0]
+    )
+    
+    assert limiter.check("run", "ip:a") == 0.0
+    assert limiter.check("run", "ip:a") == 0.0
+    assert limiter.check("run", "ip:a") == pytest.approx(1.0)
+    assert limiter.check("run", "ip:b") == 0.0
+    assert limiter.check("unlimited", "ip:a") == 0.0
+    
+    now[0] = 1.0
+    assert limiter.check("run", "ip:a") == 0.0
+    
+    # Both buckets have refilled by now, so they are dropped
+    now[0] = 10.0
+    limiter.check("run", "ip:c")
+    stats = limiter.get_stats()
+    assert stats["clients"] == 1 and stats["expired_buckets"] == 2
+    assert stats["allowed"] == {"run": 5} and stats["limited"] == {"run": 1}
+
+def test_run_endpoint_rate_limited():
+    """Test that run creation returns 429 with Retry-After once the client is out of tokens."""
+    from rate_limiter import RateLimiter
+    
+    limiter = RateLimiter({"enabled": True, "routes": {"run": {"per_minute": 1, "burst": 1}}})
+    limiter.check("run", "ip:testclient")
+    
+    with patch("main.rate_limiter", limiter):
+        response = client.post("/api/run", json={"input_text": "Too many requests"})
+    
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) > 0
+    assert limiter.get_stats()["limited"] == {"run": 1}
+
+def test_rate_limit_client_keys(monkeypatch):
+    """Test that only allow-listed API keys get their own bucket and X-Forwarded-For is read only from trusted proxies."""
+    from rate_limiter import RateLimiter
+    
+    monkeypatch.setenv("RATE_LIMIT_API_KEYS", "team-a, team-b")
+    limiter = RateLimiter({"key": "api_key", "trusted_proxies": ["172.16.0.0/12"]})
+    
+    assert limiter.client_key("10.0.0.5", api_key="team-a") == "key:team-a"
+    assert limiter.client_key("10.0.0.5", api_key="made-up") == "ip:10.0.0.5"
+    
+    # Only a trusted proxy's X-Forwarded-For is used, skipping proxy hops from the right
+    assert limiter.client_key("172.18.0.3", "203.0.113.9") == "ip:203.0.113.9"
+    assert limiter.client_key("172.18.0.3", "1.2.3.4, 203.0.113.9, 172.18.0.2") == "ip:203.0.113.9"
+    assert limiter.client_key("10.0.0.5", "203.0.113.9") == "ip:10.0.0.5"
+
+def test_hedge_policy():
+    """Test that a slow call is hedged and the faster duplicate wins."""
+    from hedging import HedgePolicy
+    
+    policy = HedgePolicy({"enabled": True, "min_samples": 5, "budget_ratio": 0.5})
+    for _ in range(5):
+        policy._latencies.append(0.01)
+    policy.calls = 5
+    
+    delays = iter([1.0, 0.0])
+    
+    async def call():
+        await asyncio.sleep(next(delays))
+        return "done"
+    
+    assert asyncio.run(asyncio.wait_for(policy.run(call), timeout=0.5)) == "done"
+    stats = policy.get_stats()
+    assert stats["hedges_fired"] == 1
+    assert stats["hedge_wins"] == 1
+    
+    # Budget exhausted: no further hedges are fired
+    policy.budget_ratio = 0.0
+    delays = iter([0.05])
+    asyncio.run(policy.run(call))
+    assert policy.get_stats()["hedges_fired"] == 1
+    assert policy._latencies[-1] >= 0.05
+    
+    # A primary call that times out is still sampled, capped at the timeout
+    delays = iter([1.0])
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(asyncio.wait_for(policy.run(call, timeout=0.1), timeout=0.1))
+    assert 0.05 < policy._latencies[-1] <= 0.1
+    
+    from main import optimizer
+    optimizer.get()
+    response = client.get("/api/metrics")
+    assert response.status_code == 200
+    assert "hedges_fired" in response.json()["hedging"]
+
+def test_lm_call_tracker_orphans():
+    """Test that timed-out thread calls are counted as orphaned until they return."""
+    import threading
+    from providers import LMCallTracker
+    
+    tracker = LMCallTracker(max_threads=1)
+    release = threading.Event()
+    
+    async def timed_out_calls():
+        running = tracker.run_in_thread(release.wait, timeout=5)
+        queued = tracker.run_in_thread(release.wait, timeout=5)
+        results = await asyncio.gather(
+            asyncio.wait_for(running, timeout=0.05),
+            asyncio.wait_for(queued, timeout=0.05),
+            return_exceptions=True
+        )
+        assert all(isinstance(result, asyncio.TimeoutError) for result in results)
+    
+    asyncio.run(timed_out_calls())
+    
+    # Only the call that had started holds a thread; the queued one was dropped
+    stats = tracker.get_stats()
+    assert stats["orphaned"] == 1
+    assert stats["cancelled"] == 2
+    assert stats["in_flight"] == 0
+    
+    release.set()
+    tracker._executor.shutdown(wait=True)
+    assert tracker.get_stats()["orphaned"] == 0
+    assert tracker.get_stats()["orphaned_total"] == 1
+
+def test_dungeon_optimizer_scores_and_caches():
+    """Test that dungeon prompts are scored on the dev set concurrently and cached."""
+    from main import dungeon_optimizer, optimizer as lazy_optimizer
+    from models import Variant, VariantOutput
+    from dungeon_optimizer import DEV_SET
+    
+    optimizer = lazy_optimizer.get()
+    calls = []
+    
+    async def fake_run_instruction(instruction, input_text, variant_id="custom"):
+        calls.append(instruction)
+        await asyncio.sleep(0.01)
+        variant = Variant(
+            variant_id=variant_id,
+            prompt_spec=instruction,
+            output=VariantOutput(category="billing", summary="Customer has a billing issue")
+        )
+        return variant, optimizer.scorer.score_variant(variant, input_text)
+    
+    prompts = ["Be specific", "Give examples", "Think step by step"]
+    with patch.object(optimizer, "run_instruction", fake_run_instruction):
+        results = asyncio.run(dungeon_optimizer.optimize_prompts(prompts, "dungeon_test"))
+        assert len(calls) == (len(prompts) + 1) * len(DEV_SET)
+        assert len(results["individual_scores"]) == 3
+        assert 0 < results["score"] <= 100
+        
+        # Repeat submissions are served from the prompt-hash cache
+        assert asyncio.run(dungeon_optimizer.optimize_prompts(prompts, "dungeon_test")) == results
+        assert len(calls) == (len(prompts) + 1) * len(DEV_SET)
+        
+        # /api/optimize returns a run whose progress is recorded as events
+        response = client.post("/api/optimize", json={"prompts": prompts, "task": "dungeon_test"})
+        assert response.status_code == 200
+        run_id = response.json()["run_id"]
+    
+    from main import run_store
+    run_data = run_store.get_run(run_id)
+    assert run_data["kind"] == "dungeon"
+    assert run_data["status"] == "complete"
+    assert run_data["winner_variant_id"] is not None
+    
+    types = [event["type"] for event in run_data["event_log"]]
+    assert types.count(EventType.CANDIDATE_SCORED) == 4
+    assert types[-1] == EventType.RUN_COMPLETE
+    assert run_data["event_log"][-1]["payload"]["results"]["score"] == results["score"]
+    
+    # Dungeon candidates stay out of the classifier variant analytics
+    candidate_ids = {variant["variant_id"] for variant in run_data["variants"]}
+    assert not candidate_ids & set(run_store.get_analytics()["all"])
+    assert not candidate_ids & {entry["variant_id"] for entry in run_store.get_variant_leaderboard()}
+
+def test_dungeon_failed_evaluations_not_cached():
+    """Test that a dev-set timeout is not cached and the prompt is re-evaluated next time."""
+    from main import dungeon_optimizer, optimizer as lazy_optimizer
+    from models import Variant, VariantOutput
+    from dungeon_optimizer import DEV_SET
+    
+    optimizer = lazy_optimizer.get()
+    calls = []
+    
+    async def flaky_run_instruction(instruction, input_text, variant_id="custom"):
+        calls.append(input_text)
+        if len(calls) == 1:
+            variant = Variant(variant_id=variant_id, prompt_spec=instruction, error="Timeout")
+        else:
+            variant = Variant(
+                variant_id=variant_id,
+                prompt_spec=instruction,
+                output=VariantOutput(category="billing", summary="Customer has a billing issue")
+            )
+        return variant, optimizer.scorer.score_variant(variant, input_text)
+    
+    semaphore = asyncio.Semaphore(1)
+    on_evaluated = lambda *args: None
+    with patch.object(optimizer, "run_instruction", flaky_run_instruction):
+        first = asyncio.run(dungeon_optimizer._score_prompt(
+            optimizer, "c1", "Flaky prompt", "flaky_test", semaphore, on_evaluated
+        ))
+        second = asyncio.run(dungeon_optimizer._score_prompt(
+            optimizer, "c1", "Flaky prompt", "flaky_test", semaphore, on_evaluated
+        ))
+        third = asyncio.run(dungeon_optimizer._score_prompt(
+            optimizer, "c1", "Flaky prompt", "flaky_test", semaphore, on_evaluated
+        ))
+    
+    assert first[2] is False and second[2] is False and third[2] is True
+    assert second[0] > first[0]
+    assert third[0] == second[0]
+    assert len(calls) == 2 * len(DEV_SET)
+
 def test_variant_scorer():
     """Test the deterministic scoring system."""
     config = load_config()
@@ -124,6 +948,97 @@ def test_intent_detection():
     intent = scorer._detect_intent(cancel_text)
     assert intent == "cancellation"
 
+def test_keyword_automaton():
+    """Test whole-word, multi-label phrase counting in one pass."""
+    from keyword_automaton import KeywordAutomaton
+    
+    automaton = KeywordAutomaton({
+        "billing": ["charge", "double charged"],
+        "urgent": ["now", "locked out"],
+        "other": []
+    })
+    
+    counts = automaton.count("I was DOUBLE-charged and I'm locked out now, now!")
+    assert counts == {"billing": 1, "urgent": 3}
+    assert automaton.count("Nowhere to recharge") == {}
+
+def test_intent_lexicon_from_config(tmp_path):
+    """Test that intent lexicons can be loaded from a configured YAML file."""
+    config = load_config()
+    lexicon_path = tmp_path / "lexicon.yaml"
+    lexicon_path.write_text("billing: [invoice]\ntechnical: [kernel panic]\n")
+    config["intent_lexicon_path"] = str(lexicon_path)
+    
+    scorer = VariantScorer(config)
+    assert scorer._detect_intent("Kernel panic on boot") == "technical"
+    assert scorer._detect_intent("The app crashed") == "other"
+
+def test_similarity_label_match():
+    """Test centroid-based label_match scoring and batch similarities."""
+    config = load_config()
+    config["label_match"] = {"method": "similarity"}
+    scorer = VariantScorer(config)
+    scorer.fit_label_similarity([
+        ("My bill seems wrong this month", "billing"),
+        ("Please cancel my subscription", "cancellation")
+    ])
+    
+    text = "I was double-charged after upgrading my plan."
+    assert scorer._score_label_match("billing", text) == 1.0
+    assert scorer._score_label_match("cancellation", text) < 1.0
+    assert scorer._score_label_match("billing", "hello there") == 0.5
+    
+    # One matrix multiply scores the whole batch
+    similarities = scorer.label_similarity.similarities([text, "Please cancel it", "hello there"])
+    assert similarities.shape == (3, len(config["labels"]))
+    assert scorer.label_similarity.closest_label("Please cancel it") == "cancellation"
+
+def test_custom_metrics_registry():
+    """Test that declared metrics run inline, on a thread pool and on a process pool."""
+    from metrics import MetricRunner
+    from models import Variant, VariantOutput
+    
+    config = load_config()
+    config["custom_metrics"] = {
+        "thread_workers": 2,
+        "process_workers": 1,
+        "metrics": [
+            {"name": "readability", "executor": "inline", "weight": 0.5},
+            {"name": "reference_similarity", "executor": "process", "weight": 1.0, "references": "training_data.yaml"},
+            {"name": "metrics:readability", "executor": "thread", "weight": 0.0}
+        ]
+    }
+    scorer = VariantScorer(config)
+    assert scorer.max_total == sum(config["weights"].values()) + 1.5
+    
+    variant = Variant(
+        variant_id="v1",
+        prompt_spec="test",
+        output=VariantOutput(category="billing", summary="Customer reports a duplicate subscription charge")
+    )
+    try:
+        score = asyncio.run(scorer.score_variant_async(variant, "I was charged twice"))
+    finally:
+        scorer.metrics.shutdown()
+    
+    base = scorer.score_variant(variant, "I was charged twice")
+    assert score.metrics["reference_similarity"] == 1.0
+    assert 0.0 <= score.metrics["readability"] <= 1.0
+    assert score.metrics["metrics:readability"] == score.metrics["readability"]
+    assert score.total == pytest.approx(base.total + 0.5 * score.metrics["readability"] + 1.0)
+    
+    stats = scorer.metrics.get_stats()
+    assert stats["reference_similarity"]["executor"] == "process"
+    assert all(entry["calls"] == 1 and entry["errors"] == 0 for entry in stats.values())
+    assert stats["reference_similarity"]["mean_wall_ms"] >= stats["reference_similarity"]["mean_run_ms"]
+    
+    with pytest.raises(KeyError):
+        MetricRunner({"metrics": [{"name": "no_such_metric"}]})
+    
+    # Weights, costs and results are keyed by name, so a repeated name is an error
+    with pytest.raises(ValueError):
+        MetricRunner({"metrics": [{"name": "readability"}, {"name": "readability", "executor": "thread"}]})
+
 def test_score_explanation():
     """Test score explanation functionality."""
     config = load_config()
@@ -157,5 +1072,245 @@ def test_score_explanation():
     assert explanation["total_score"] == 4.0
     assert len(explanation["explanations"]) > 0
 
+def test_split_completion():
+    """Test parsing of partial DSPy-format completions."""
+    from providers import split_completion
+    
+    assert split_completion("bill") == ("bill", None)
+    assert split_completion("billing\n\nSumm") == ("billing", None)
+    assert split_completion("billing\nSummary: Customer was") == ("billing", "Customer was")
+
+def anthropic_provider(handler):
+    """A ProviderClient for Anthropic whose SDK client sends requests to handler instead of the network."""
+    import httpx
+    from anthropic import AsyncAnthropic
+    from providers import ProviderClient
+    
+    provider = ProviderClient({"name": "anthropic", "model": "claude-2"})
+    provider._client = AsyncAnthropic(api_key="test", http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    return provider
+
+def test_anthropic_complete():
+    """Test that Anthropic completions go through the Text Completions API of the pinned SDK."""
+    import json
+    import httpx
+    
+    requests = []
+    
+    def handler(request):
+        requests.append((request.url.path, json.loads(request.content)))
+        return httpx.Response(200, json={
+            "type": "completion",
+            "completion": " billing\nSummary: Double charge",
+            "model": "claude-2",
+            "stop_reason": "stop_sequence"
+        })
+    
+    completion = asyncio.run(anthropic_provider(handler).complete("Category:", 0.2))
+    assert completion == " billing\nSummary: Double charge"
+    
+    path, body = requests[0]
+    assert path == "/v1/complete"
+    assert body["prompt"] == "\n\nHuman: Category:\n\nAssistant:"
+    assert body["max_tokens_to_sample"] == 200 and body["temperature"] == 0.2
+
+def test_anthropic_stream():
+    """Test that Anthropic streaming yields the deltas of a streamed Text Completions response."""
+    import json
+    import httpx
+    
+    requests = []
+    
+    def handler(request):
+        requests.append(json.loads(request.content))
+        body = "".join(
+            f"event: completion\ndata: {json.dumps({'type': 'completion', 'completion': delta, 'model': 'claude-2', 'stop_reason': None})}\n\n"
+            for delta in [" billing", "\nSummary:", " Double charge"]
+        )
+        return httpx.Response(200, content=body.encode("utf-8"), headers={"content-type": "text/event-stream"})
+    
+    async def collect():
+        return [delta async for delta in anthropic_provider(handler).stream("Category:", 0.3)]
+    
+    assert asyncio.run(collect()) == [" billing", "\nSummary:", " Double charge"]
+    assert requests[0]["stream"] is True
+    assert requests[0]["prompt"] == "\n\nHuman: Category:\n\nAssistant:"
+
+class FakeProviderClient:
+    """Streams a canned billing completion and records the prompts it was sent."""
+    
+    def __init__(self):
+        self.prompts = []
+    
+    async def stream(self, prompt, temperature):
+        self.prompts.append(prompt)
+        for delta in ["billing", "\nSummary:", " Customer was", " double charged"]:
+            yield delta
+
+@pytest.fixture
+def streaming_optimizer():
+    """The optimizer in streaming mode, with provider calls answered by a FakeProviderClient."""
+    from main import optimizer as lazy_optimizer
+    optimizer = lazy_optimizer.get()
+    provider = FakeProviderClient()
+    
+    with patch.object(optimizer, "provider_client", provider), \
+            patch.dict(optimizer.streaming, {"enabled": True, "partial_interval_ms": 0}):
+        yield optimizer, provider
+
+def test_streaming_partial_events(streaming_optimizer):
+    """Test that streaming mode emits partial outputs before the final output."""
+    optimizer, _ = streaming_optimizer
+    
+    store = RunStore()
+    run_id = store.create_run("I was double charged")
+    asyncio.run(optimizer.optimize(run_id, "I was double charged", store))
+    
+    events = store.get_events(run_id)
+    types = [event["type"] for event in events]
+    assert EventType.VARIANT_PARTIAL in types
+    assert types.index(EventType.VARIANT_PARTIAL) < types.index(EventType.VARIANT_OUTPUT)
+    
+    final = next(event for event in events if event["type"] == EventType.VARIANT_OUTPUT)
+    assert final["payload"]["output"] == {"category": "billing", "summary": "Customer was double charged"}
+
+def test_prompt_budget_trims_examples(streaming_optimizer):
+    """Test that prompt tokens are recorded and budget mode drops examples to fit."""
+    optimizer, provider = streaming_optimizer
+    
+    _, spec = optimizer.variants[0]
+    full = optimizer._prepare_prompt(spec, "I was double charged")
+    assert full["prompt_tokens"] > 0 and full["examples_dropped"] == 0
+    
+    store = RunStore()
+    run_id = store.create_run("I was double charged")
+    budget = {"enabled": True, "max_prompt_tokens": full["prompt_tokens"] - 1}
+    
+    with patch.object(optimizer, "prompt_budget", budget):
+        asyncio.run(optimizer.optimize(run_id, "I was double charged", store))
+    
+    outputs = [event["payload"] for event in store.get_events(run_id) if event["type"] == EventType.VARIANT_OUTPUT]
+    first = outputs[0]
+    assert first["examples_dropped"] >= 1
+    assert first["prompt_tokens"] < full["prompt_tokens"]
+    assert spec["examples"][-1][0] not in provider.prompts[0]
+    
+    variant = store.get_run(run_id)["variants"][0]
+    assert variant["prompt_tokens"] == first["prompt_tokens"]
+    assert variant["examples_dropped"] == first["examples_dropped"]
+    assert store.get_analytics()["all"][variant["variant_id"]]["mean_prompt_tokens"] is not None
+
+def test_token_counter_uses_tiktoken_or_falls_back():
+    """Test that counts come from the tiktoken encoding, and fall back to an estimate if it can't load."""
+    import tokens
+    
+    class FakeEncoding:
+        def encode(self, text):
+            return text.split()
+    
+    class FakeTiktoken:
+        def __init__(self, error=None):
+            self.error = error
+            self.requested = []
+        
+        def encoding_for_model(self, model):
+            if self.error:
+                raise self.error
+            if model != "gpt-4o-mini":
+                raise KeyError(model)
+            return FakeEncoding()
+        
+        def get_encoding(self, name):
+            self.requested.append(name)
+            return FakeEncoding()
+    
+    with patch.object(tokens, "tiktoken", FakeTiktoken()):
+        counter = tokens.TokenCounter("gpt-4o-mini")
+        assert counter.exact
+        assert counter.count("one two three") == 3
+    
+    fake = FakeTiktoken()
+    with patch.object(tokens, "tiktoken", fake):
+        assert tokens.TokenCounter("unknown-model").exact
+        assert fake.requested == ["cl100k_base"]
+    
+    # Offline: loading the BPE file fails, so counts are estimated
+    with patch.object(tokens, "tiktoken", FakeTiktoken(error=OSError("network unreachable"))):
+        counter = tokens.TokenCounter("gpt-4o-mini")
+        assert not counter.exact
+        assert counter.count("one two three") == 4
+
+def test_near_duplicate_inputs_reuse_outputs(streaming_optimizer):
+    """Test that near-duplicate inputs hit the MinHash cache and reuse variant outputs."""
+    from near_duplicates import NearDuplicateCache
+    optimizer, provider = streaming_optimizer
+    
+    cache = NearDuplicateCache({"mode": "reuse", "threshold": 0.8, "capacity": 2})
+    cache.add("My internet keeps dropping", "internet")
+    assert cache.lookup("I was double-charged") == (0.0, None)
+    
+    store = RunStore()
+    first_id = store.create_run("I was double charged!!")
+    second_id = store.create_run("i was double-charged")
+    
+    with patch.object(optimizer, "input_cache", cache):
+        asyncio.run(optimizer.optimize(first_id, "I was double charged!!", store))
+        calls_after_first = len(provider.prompts)
+        asyncio.run(optimizer.optimize(second_id, "i was double-charged", store))
+    
+    assert calls_after_first == len(optimizer.variants)
+    assert len(provider.prompts) == calls_after_first
+    
+    events = store.get_events(second_id)
+    complete = next(event for event in events if event["type"] == EventType.RUN_COMPLETE)
+    assert complete["payload"]["reused_run_id"] == first_id
+    assert complete["payload"]["input_similarity"] == 1.0
+    assert all(event["payload"]["cached"] for event in events if event["type"] == EventType.VARIANT_OUTPUT)
+    assert all(variant["latency_ms"] is None for variant in store.get_run(second_id)["variants"])
+    assert all(variant["latency_ms"] is not None for variant in store.get_run(first_id)["variants"])
+    assert store.get_run(second_id)["winner_variant_id"] == store.get_run(first_id)["winner_variant_id"]
+    
+    stats = cache.get_stats()
+    assert stats["hits"] == 1 and stats["entries"] == 2
+    assert stats["hit_rate_by_threshold"]["1.0"] == 1 / 3
+
+def test_compiled_programs_round_trip(tmp_path):
+    """Test that compiled demos are saved, versioned and used in variant prompts."""
+    import dspy
+    from dspy.utils.dummies import DummyLM
+    from optimizer import DSPyOptimizer
+    from program_store import save_compiled_programs, find_version
+    from compile_programs import compile_variants
+    
+    config = load_config()
+    config["variant_count"] = 1
+    config["compiled_programs"] = {"dir": str(tmp_path), "version": "latest"}
+    
+    optimizer = DSPyOptimizer(config)
+    assert "demos" not in optimizer.variants[0][1]
+    
+    dataset = [
+        {"text": "I was charged twice", "category": "billing", "summary": "Customer was charged twice"},
+        {"text": "The app crashes on start", "category": "technical", "summary": "App crashes on startup"}
+    ]
+    answers = ["billing\n\nSummary: Customer was charged twice", "technical\n\nSummary: App crashes on startup"]
+    with dspy.settings.context(lm=DummyLM(answers)):
+        programs = compile_variants(optimizer, dataset, max_demos=2)
+    assert len(programs["v1"].predict.demos) == 2
+    
+    version_dir = save_compiled_programs(config, programs, dataset, {"name": "BootstrapFewShot"})
+    assert find_version(config) == version_dir
+    
+    compiled = DSPyOptimizer(config)
+    variant, spec = compiled.variants[0]
+    assert spec["compiled_version"] == version_dir.name
+    assert version_dir.name in variant.prompt_spec
+    
+    context = compiled._build_context(spec, "Where is my refund?")
+    assert "Examples:" not in context
+    prompt = compiled._render_prompt(context, spec["demos"])
+    assert "App crashes on startup" in prompt
+    assert prompt.rstrip().endswith("Category:")
+
 if __name__ == "__main__":
     pytest.main([__file__])
\ No newline at end of file
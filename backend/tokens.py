@@ -0,0 +1,53 @@
+"""
+Prompt token counting.
+Uses the model's tiktoken encoding when available, else a length estimate.
+"""
+
+from typing import Optional
+import logging
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken is optional; counts fall back to an estimate
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Average characters per token for English text with the GPT/Claude tokenizers
+CHARS_PER_TOKEN = 4
+
+class TokenCounter:
+    """Counts tokens in prompts sent to a given model."""
+
+    def __init__(self, model: str):
+        self.model = model
+        self._encoding = self._load_encoding(model)
+
+    @staticmethod
+    def _load_encoding(model: str) -> Optional["tiktoken.Encoding"]:
+        """
+        The model's encoding, a generic one for unknown models, or None without
+        tiktoken or when the encoding can't be loaded (tiktoken downloads BPE
+        files on first use, which fails offline).
+        """
+        if tiktoken is None:
+            return None
+        try:
+            try:
+                return tiktoken.encoding_for_model(model)
+            except KeyError:
+                return tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            logger.warning(f"Could not load tiktoken encoding for {model}, estimating token counts: {str(e)}")
+            return None
+
+    @property
+    def exact(self) -> bool:
+        """Whether counts come from a real tokenizer rather than an estimate."""
+        return self._encoding is not None
+
+    def count(self, text: str) -> int:
+        """Number of tokens in text."""
+        if self._encoding is not None:
+            return len(self._encoding.encode(text))
+        return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN